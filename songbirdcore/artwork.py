@@ -0,0 +1,449 @@
+from typing import Dict, List, Optional, Union
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import hashlib
+import io
+import logging
+import os
+import threading
+
+import requests
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+ARTWORK_SIZES = [
+    "100x100",
+    "500x500",
+    "1000x1000",
+    "1500x1500",
+    "2000x2000",
+    "2500x2500",
+    "3000x3000",
+]
+"""artwork sizes served by itunes, from smallest to largest"""
+
+_BASE_SIZE = "100x100"
+
+
+def artwork_cache_key(url: str, collection_id: Union[int, str] = "") -> str:
+    """Build the cache key of an album's artwork
+
+    Args:
+        url (str): the artwork url, as given by the itunes api
+        collection_id (Union[int, str], optional): the itunes collection id of the album. Defaults to "".
+
+    Returns:
+        str: the cache key
+    """
+    return f"{collection_id}|{url}"
+
+
+_MAGIC_BYTES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+
+def detect_mime_type(data: bytes) -> Optional[str]:
+    """Detect the mime type of an image from its leading magic bytes
+
+    Args:
+        data (bytes): the image
+
+    Returns:
+        Optional[str]: the mime type, such as 'image/jpeg', or None if the format is unknown
+    """
+    for magic, mime_type in _MAGIC_BYTES:
+        if data.startswith(magic):
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+class ArtworkProcessor:
+    """Downscales and re-encodes artwork before it is embedded into files.
+
+    Results are memoized per cache key (one per album), so each cover is only
+    transcoded once however many tracks it is embedded into.
+
+    Requires Pillow, installed with the `artwork` extra (`pip install songbirdcore[artwork]`).
+    """
+
+    def __init__(
+        self,
+        max_dimension: Optional[int] = 1000,
+        image_format: str = "JPEG",
+        jpeg_quality: int = 85,
+        max_entries: int = 32,
+    ):
+        """
+        Args:
+            max_dimension (Optional[int], optional): maximum width and height of the artwork,
+                larger artwork is downscaled keeping its aspect ratio. None keeps the original size. Defaults to 1000.
+            image_format (str, optional): format the artwork is re-encoded to, 'JPEG' or 'PNG'. Defaults to 'JPEG'.
+            jpeg_quality (int, optional): quality of re-encoded JPEGs, from 1 to 95. Defaults to 85.
+            max_entries (int, optional): number of processed covers memoized. Defaults to 32.
+        """
+        if image_format.upper() not in ("JPEG", "PNG"):
+            raise ValueError(
+                f"Unsupported artwork format '{image_format}', expected JPEG or PNG"
+            )
+        self.max_dimension = max_dimension
+        self.image_format = image_format.upper()
+        self.jpeg_quality = jpeg_quality
+        self.max_entries = max_entries
+        self._memo: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def process(self, data: bytes, key: Optional[str] = None) -> bytes:
+        """Downscale and re-encode artwork
+
+        Args:
+            data (bytes): the original artwork
+            key (Optional[str], optional): memoization key of the artwork, such as its
+                `artwork_cache_key`. Defaults to a hash of data.
+
+        Returns:
+            bytes: the processed artwork, or data unchanged if it could not be decoded
+        """
+        if key is None:
+            key = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            processed = self._memo.get(key)
+            if processed is not None:
+                self._memo.move_to_end(key)
+                return processed
+
+        processed = self._transcode(data)
+        with self._lock:
+            self._memo[key] = processed
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return processed
+
+    def _transcode(self, data: bytes) -> bytes:
+        try:
+            from PIL import Image
+        except ImportError as e:
+            raise ImportError(
+                "Artwork processing requires Pillow, install it with 'pip install songbirdcore[artwork]'"
+            ) from e
+
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except Exception as e:
+            logger.warning(f"Could not decode artwork, embedding it unchanged: {e}")
+            return data
+
+        original_size = image.size
+        if self.max_dimension is not None:
+            image.thumbnail((self.max_dimension, self.max_dimension))
+        if self.image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        if self.image_format == "JPEG":
+            image.save(output, format="JPEG", quality=self.jpeg_quality, optimize=True)
+        else:
+            image.save(output, format="PNG", optimize=True)
+        processed = output.getvalue()
+        logger.info(
+            f"Processed artwork {original_size} {len(data)}B -> {image.size} {len(processed)}B"
+        )
+        return processed
+
+
+class ArtworkCache:
+    """Two tier LRU cache of artwork bytes.
+
+    Artwork is kept in memory up to `max_memory_bytes`, and optionally on disk
+    in `cache_dir` up to `max_disk_bytes`. The disk tier tracks recency with
+    file modification times, so it survives restarts.
+    """
+
+    def __init__(
+        self,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        cache_dir: Optional[str] = None,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+    ):
+        """
+        Args:
+            max_memory_bytes (int, optional): size cap of the memory tier. Defaults to 64MB.
+            cache_dir (Optional[str], optional): folder of the disk tier. If None, artwork is only cached in memory.
+            max_disk_bytes (int, optional): size cap of the disk tier. Defaults to 512MB.
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_bytes = sum(
+                entry.stat().st_size
+                for entry in os.scandir(cache_dir)
+                if entry.is_file() and not entry.name.endswith(".tmp")
+            )
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(
+            self.cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest()
+        )
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Get cached artwork
+
+        Args:
+            key (str): the cache key, see `artwork_cache_key`
+
+        Returns:
+            Optional[bytes]: the artwork, or None if it is not cached
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            if self.cache_dir is None:
+                return data
+            path = self._disk_path(key)
+            try:
+                if data is None:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                # mark the file as recently used, so the disk tier evicts in LRU order
+                os.utime(path)
+            except OSError:
+                return data
+            self._memory_set(key, data)
+            return data
+
+    def set(self, key: str, data: bytes) -> None:
+        """Cache artwork
+
+        Args:
+            key (str): the cache key, see `artwork_cache_key`
+            data (bytes): the artwork
+        """
+        with self._lock:
+            self._memory_set(key, data)
+            if self.cache_dir is None or len(data) > self.max_disk_bytes:
+                return
+            path = self._disk_path(key)
+            try:
+                previous_size = os.path.getsize(path)
+            except OSError:
+                previous_size = 0
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._disk_bytes += len(data) - previous_size
+            self._evict_disk()
+
+    def _memory_set(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _evict_disk(self) -> None:
+        """delete the least recently used files until the disk tier fits its cap"""
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        entries = sorted(
+            (entry.stat().st_mtime_ns, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.cache_dir)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        )
+        self._disk_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+
+
+class ArtworkFetcher:
+    """Finds and downloads the largest available album artwork.
+
+    Every size in `sizes` is probed concurrently, with HEAD requests or with
+    single byte range requests for servers that do not support HEAD, and only
+    the largest available size is downloaded. Downloads are cached by
+    collection and artwork url, so the tracks of an album share one download.
+    """
+
+    def __init__(
+        self,
+        sizes: List[str] = ARTWORK_SIZES,
+        probe: str = "head",
+        artwork_cache: Optional[ArtworkCache] = None,
+        session: Optional[requests.Session] = None,
+        timeout: Optional[float] = 10,
+        processor: Optional[ArtworkProcessor] = None,
+    ):
+        """
+        Args:
+            sizes (List[str], optional): the sizes to probe, from smallest to largest. Defaults to ARTWORK_SIZES.
+            probe (str, optional): 'head' to probe with HEAD requests, 'range' to probe with
+                single byte range requests. Defaults to 'head'.
+            artwork_cache (Optional[ArtworkCache], optional): the artwork cache. Defaults to a memory only cache.
+            session (Optional[requests.Session], optional): session used for every request. Defaults to a new session.
+            timeout (Optional[float], optional): timeout of each request in seconds. Defaults to 10.
+            processor (Optional[ArtworkProcessor], optional): optional stage downscaling and re-encoding
+                the artwork returned by `fetch`. The cache keeps the original artwork.
+        """
+        if probe not in ("head", "range"):
+            raise ValueError(f"Unknown probe method '{probe}', expected head or range")
+        self.sizes = sizes
+        self.probe = probe
+        self.artwork_cache = (
+            artwork_cache if artwork_cache is not None else ArtworkCache()
+        )
+        self.session = session if session is not None else requests.Session()
+        self.timeout = timeout
+        self.processor = processor
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(sizes), thread_name_prefix="artwork-probe"
+        )
+        # one lock per cache key, so concurrent taggers of an album wait for a single
+        # download. Locks are reference counted and dropped once no thread holds them.
+        self._key_locks: Dict[str, List] = {}
+        self._key_locks_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _key_lock(self, key: str):
+        """hold the lock of a cache key"""
+        with self._key_locks_lock:
+            entry = self._key_locks.get(key)
+            if entry is None:
+                entry = self._key_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._key_locks_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[key]
+
+    def _probe(self, url: str) -> bool:
+        try:
+            if self.probe == "head":
+                response = self.session.head(
+                    url, timeout=self.timeout, allow_redirects=True
+                )
+                if response.status_code not in (405, 501):
+                    return response.status_code == 200
+            response = self.session.get(
+                url, headers={"Range": "bytes=0-0"}, timeout=self.timeout, stream=True
+            )
+            response.close()
+            return response.status_code in (200, 206)
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"Failed to probe artwork at {url}: {e}")
+            return False
+
+    @metrics.timed("artwork.probe")
+    def find_url(self, url: str) -> Optional[str]:
+        """Find the url of the largest available size of some artwork
+
+        Args:
+            url (str): the artwork url, as given by the itunes api (artworkUrl100)
+
+        Returns:
+            Optional[str]: the url of the largest available size, or None if no size is available
+        """
+        candidates = [url.replace(_BASE_SIZE, size) for size in self.sizes]
+        available = list(self._executor.map(self._probe, candidates))
+        for size, candidate, found in reversed(
+            list(zip(self.sizes, candidates, available))
+        ):
+            if found:
+                logger.info(f"Found art at size: {size}")
+                return candidate
+        logger.info("Couldnt find album art. Your file wont have the art.")
+        return None
+
+    def fetch(self, url: str, collection_id: Union[int, str] = "") -> Optional[bytes]:
+        """Get the largest available size of some artwork, from the cache when possible
+
+        Args:
+            url (str): the artwork url, as given by the itunes api (artworkUrl100)
+            collection_id (Union[int, str], optional): the itunes collection id of the album. Defaults to "".
+
+        Returns:
+            Optional[bytes]: the artwork, or None if it could not be found
+        """
+        if not url:
+            return None
+        key = artwork_cache_key(url, collection_id)
+        with metrics.span("artwork.fetch") as span, self._key_lock(key):
+            data = self.artwork_cache.get(key)
+            span.set_attribute("cached", data is not None)
+            if data is None:
+                data = self._download(url)
+                if data is None:
+                    return None
+                self.artwork_cache.set(key, data)
+            if self.processor is not None:
+                data = self.processor.process(data, key)
+            return data
+
+    def _download(self, url: str) -> Optional[bytes]:
+        """download the largest available size of some artwork"""
+        artwork_url = self.find_url(url)
+        if artwork_url is None:
+            return None
+        try:
+            response = self.session.get(artwork_url, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Failed to download artwork at {artwork_url}: {e}")
+            return None
+        if response.status_code != 200:
+            logger.error(
+                f"Failed to download artwork at {artwork_url}, code: {response.status_code}"
+            )
+            return None
+        return response.content
+
+    def close(self):
+        """Release the probe threads and pooled connections"""
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+
+_default_fetcher: Optional[ArtworkFetcher] = None
+_default_fetcher_lock = threading.Lock()
+
+
+def default_fetcher() -> ArtworkFetcher:
+    """Get the process wide artwork fetcher used by the taggers when none is given
+
+    Returns:
+        ArtworkFetcher: the shared fetcher, with a memory only cache
+    """
+    global _default_fetcher
+    with _default_fetcher_lock:
+        if _default_fetcher is None:
+            _default_fetcher = ArtworkFetcher()
+        return _default_fetcher
@@ -0,0 +1,314 @@
+"""Benchmark suite of the songbirdcore hot paths.
+
+Generates a synthetic <artist>/<album>/<track>.<format> library of small
+valid mp3 and m4a files, then times the library search, file name
+sanitizing and de-duplication, the tag readers and writers, and the
+parsing of the itunes api and youtube search fixtures. The youtube search
+page is synthetic and ~4 KB, far smaller than a real one, so its timing
+tracks regressions of the parser rather than real page costs. Results are
+printed as JSON, and can be compared against the JSON of a previous run to
+track regressions between releases.
+
+Run with `python -m songbirdcore.bench`, see `--help` for the options.
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import tempfile
+import timeit
+
+from .. import catalog, common, itunes, library, youtube
+from ..models import modes
+from ..version import version
+from . import sanitize, synthetic
+
+RESOURCES_FOLDER = os.path.join(os.path.dirname(__file__), "resources")
+"""folder of the api response fixtures, shipped with the package and shared with the unit tests"""
+
+_ITUNES_FIXTURE = "itunes-lookup-jolene.json"
+_YOUTUBE_FIXTURE = "youtube-search-jolene.html"
+"""synthetic search results page, hand-written in the layout of a real one"""
+
+_COVER = b"\xff\xd8\xff\xe0" + bytes(64 * 1024)
+
+Benchmark = Callable[["_Context"], Tuple[Callable[[], object], int]]
+"""builds the function timed by a benchmark and the number of items it handles per call"""
+
+
+class _Context:
+    """state shared by the benchmarks of a run"""
+
+    def __init__(self, folder: str, n_tracks: int, resources: str):
+        self.folder = folder
+        self.resources = resources
+        self.library_path = os.path.join(folder, "library")
+        self.tracks = synthetic.write_library(self.library_path, n_tracks)
+        self.n_tracks = n_tracks
+
+    def resource(self, name: str) -> str:
+        path = os.path.join(self.resources, name)
+        # a missing fixture would drop its benchmarks from comparisons between runs
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"Benchmark fixture {name} not found in {self.resources}"
+            )
+        return path
+
+    def tagged_copies(self, file_format: str, n_tracks: int) -> List[str]:
+        """write n_tracks tagged tracks of file_format outside of the library"""
+        folder = os.path.join(self.folder, f"tagged-{file_format}")
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        for i in range(n_tracks):
+            path = synthetic.write_track(os.path.join(folder, f"{i}.{file_format}"))
+            itunes._TAG_WRITERS[f".{file_format}"](
+                path, synthetic.song_tags(i + 1, 12), _COVER
+            )
+            paths.append(path)
+        return paths
+
+
+def _itunes_lib_search(ctx: _Context):
+    return (
+        lambda: itunes.itunes_lib_search(ctx.library_path, "track 1"),
+        ctx.n_tracks,
+    )
+
+
+def _itunes_lib_search_index(ctx: _Context):
+    index = library.LibraryIndex(ctx.library_path)
+    index.refresh()
+    return (
+        lambda: itunes.itunes_lib_search(ctx.library_path, "track 1", index=index),
+        ctx.n_tracks,
+    )
+
+
+def _remove_illegal_characters(ctx: _Context):
+    names = [
+        name
+        for path in sanitize.synthetic_paths(ctx.n_tracks)
+        for name in path.split(os.sep)
+    ]
+    return (
+        lambda: [common.remove_illegal_characters(name) for name in names],
+        len(names),
+    )
+
+
+def _collisions(ctx: _Context, n_collisions: int = 50) -> str:
+    folder = os.path.join(ctx.folder, "collisions")
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+        for i in range(n_collisions):
+            for name in [f"song{'dup' * i}.mp3", f"song {i}.mp3"]:
+                with open(os.path.join(folder, name), "wb"):
+                    pass
+    return os.path.join(folder, "song.mp3")
+
+
+def _fname_duper(ctx: _Context):
+    path = _collisions(ctx)
+    return lambda: common.fname_duper(path, limit=100, count=1, dup_key="dup"), 1
+
+
+def _unique_fname(ctx: _Context):
+    path = _collisions(ctx)
+    return lambda: common.unique_fname(path), 1
+
+
+def _parse_itunes_response(n_results: Optional[int] = None) -> Benchmark:
+    """decode and parse the recorded album lookup, as query_api does. Its tracks are
+    repeated to n_results tracks when given, the size of a limit=200 lookup."""
+
+    def benchmark(ctx: _Context):
+        with open(ctx.resource(_ITUNES_FIXTURE), "rb") as f:
+            body = f.read()
+        results = json.loads(body)["results"]
+        if n_results is not None:
+            # the first result is the album, skipped when parsing songs
+            album, tracks = results[0], results[1:]
+            results = [album] + [tracks[i % len(tracks)] for i in range(n_results)]
+            body = json.dumps({"resultCount": len(results), "results": results})
+            body = body.encode()
+        return (
+            lambda: itunes.parse_api_response(itunes._loads(body), modes.Modes.SONG),
+            len(results),
+        )
+
+    return benchmark
+
+
+def _parse_youtube_search(ctx: _Context):
+    with open(ctx.resource(_YOUTUBE_FIXTURE), "r", encoding="utf-8") as f:
+        html = f.read()
+    return (
+        lambda: youtube.video_results_from_initial_data(
+            youtube.parse_initial_data(html)
+        ),
+        1,
+    )
+
+
+def _tag_reader(file_format: str, reader: Callable, n_tracks: int = 24) -> Benchmark:
+    def benchmark(ctx: _Context):
+        paths = ctx.tagged_copies(file_format, n_tracks)
+        return lambda: [reader(path) for path in paths], n_tracks
+
+    return benchmark
+
+
+def _tag_writer(file_format: str, n_tracks: int = 24) -> Benchmark:
+    def benchmark(ctx: _Context):
+        paths = ctx.tagged_copies(file_format, n_tracks)
+        writer = itunes._TAG_WRITERS[f".{file_format}"]
+        tags = [synthetic.song_tags(i + 1, 12) for i in range(n_tracks)]
+        return (
+            lambda: [writer(path, tag, _COVER) for path, tag in zip(paths, tags)],
+            n_tracks,
+        )
+
+    return benchmark
+
+
+def _catalog_rescan(ctx: _Context):
+    library_catalog = catalog.LibraryCatalog()
+    library_catalog.rescan(ctx.library_path, max_workers=0)
+    return lambda: library_catalog.rescan(ctx.library_path), ctx.n_tracks
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    "itunes_lib_search": _itunes_lib_search,
+    "itunes_lib_search_index": _itunes_lib_search_index,
+    "remove_illegal_characters": _remove_illegal_characters,
+    "fname_duper": _fname_duper,
+    "unique_fname": _unique_fname,
+    "parse_itunes_response": _parse_itunes_response(),
+    "parse_itunes_response_200": _parse_itunes_response(200),
+    "parse_youtube_search": _parse_youtube_search,
+    "mp3_tag_reader": _tag_reader("mp3", itunes.mp3_tag_reader),
+    "m4a_tag_reader": _tag_reader("m4a", itunes.m4a_tag_reader),
+    "mp3_tag_writer": _tag_writer("mp3"),
+    "m4a_tag_writer": _tag_writer("m4a"),
+    "catalog_rescan": _catalog_rescan,
+}
+"""the benchmarks of the suite, by name"""
+
+
+def time_call(fn: Callable[[], object], repeat: int = 5) -> Dict[str, float]:
+    """Time a function, calling it enough times per round to last at least 0.2 seconds
+
+    Args:
+        fn (Callable[[], object]): the function to time
+        repeat (int, optional): number of rounds. Defaults to 5.
+
+    Returns:
+        Dict[str, float]: the number of calls per round, and the fastest and median duration of a call in seconds
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    durations = [duration / number for duration in timer.repeat(repeat, number)]
+    return {
+        "number": number,
+        "min_s": min(durations),
+        "median_s": statistics.median(durations),
+    }
+
+
+def run(
+    n_tracks: int = 2000,
+    repeat: int = 5,
+    only: Optional[List[str]] = None,
+    resources: str = RESOURCES_FOLDER,
+) -> dict:
+    """Run the benchmark suite
+
+    Args:
+        n_tracks (int, optional): number of tracks in the synthetic library. Defaults to 2000.
+        repeat (int, optional): number of timing rounds of each benchmark. Defaults to 5.
+        only (Optional[List[str]], optional): names of the benchmarks to run. Defaults to None, all of them.
+        resources (str, optional): folder of the api response fixtures. Defaults to RESOURCES_FOLDER.
+
+    Returns:
+        dict: the environment of the run and the results of each benchmark
+    """
+    names = list(BENCHMARKS) if only is None else only
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {sorted(unknown)}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        ctx = _Context(folder, n_tracks, resources)
+        for name in names:
+            fn, n_items = BENCHMARKS[name](ctx)
+            result = time_call(fn, repeat)
+            result["items"] = n_items
+            result["per_item_us"] = result["min_s"] / n_items * 1e6
+            results[name] = result
+
+    return {
+        "songbirdcore": version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "n_tracks": n_tracks,
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Add the ratio of each benchmark's fastest call to the one in baseline
+
+    A ratio above 1 means the benchmark got slower since the baseline.
+
+    Args:
+        report (dict): the report of a run, see `run`
+        baseline (dict): the report of a previous run
+
+    Returns:
+        dict: report, with a baseline_ratio added to the results found in baseline
+    """
+    for name, result in report["results"].items():
+        previous = baseline.get("results", {}).get(name, {})
+        if "min_s" in result and "min_s" in previous:
+            result["baseline_ratio"] = result["min_s"] / previous["min_s"]
+    report["baseline"] = {
+        key: baseline.get(key) for key in ["songbirdcore", "timestamp"]
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--only", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run"
+    )
+    parser.add_argument("--resources", default=RESOURCES_FOLDER)
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--compare", help="results of a previous run to compare to")
+    args = parser.parse_args()
+
+    # the parsers log a warning for every result they skip
+    logging.disable(logging.WARNING)
+    report = run(args.tracks, args.repeat, args.only, args.resources)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report = compare(report, json.load(f))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark of sequential downloads with and without a YoutubeDL pool.
+
+Compares building a new YoutubeDL for every download, as run_download did,
+against taking it from a `youtube.YoutubeDLPool`. Media is served as direct
+links by a local stand-in server, so yt-dlp uses its generic extractor.
+Downloads only fetch, without FFmpeg conversion, so ffmpeg is not needed and
+the timings isolate the per-download setup cost.
+
+Run with `python -m songbirdcore.bench.downloads`.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import yt_dlp as youtube_dl
+
+from .. import youtube
+from . import http_stub
+
+
+def _unpooled_download(url: str, file_path_no_format: str) -> int:
+    ydl_opts = youtube._ydl_options(file_path_no_format, "mp3", False, [])
+    ydl_opts["postprocessors"] = []
+    with youtube_dl.YoutubeDL(ydl_opts) as ydl:
+        return ydl.download(url)
+
+
+def _pooled_download(
+    pool: youtube.YoutubeDLPool, url: str, file_path_no_format: str
+) -> int:
+    with pool.acquire(file_path_no_format, "mp3", postprocess=False) as ydl:
+        return ydl.download(url)
+
+
+def run(n_downloads: int = 20, media_kb: int = 256, latency: float = 0) -> dict:
+    """Time sequential downloads with a new YoutubeDL each, and with a pool
+
+    Args:
+        n_downloads (int, optional): number of downloads in each run. Defaults to 20.
+        media_kb (int, optional): size of each served media file in KB. Defaults to 256.
+        latency (float, optional): latency of the media server in seconds. Defaults to 0.
+
+    Returns:
+        dict: per-download cost of each approach in milliseconds, and the speedup
+    """
+    media = random.Random(0).randbytes(media_kb * 1024)
+    routes = {
+        f"/{i}.mp3": (200, {"Content-Type": "audio/mpeg"}, media)
+        for i in range(n_downloads)
+    }
+    with (
+        http_stub.StubServer(routes, latency=latency) as server,
+        tempfile.TemporaryDirectory() as folder,
+    ):
+        urls = [f"{server.url}/{i}.mp3" for i in range(n_downloads)]
+
+        start = time.perf_counter()
+        for i, url in enumerate(urls):
+            assert _unpooled_download(url, os.path.join(folder, f"new-{i}")) == 0
+        unpooled = time.perf_counter() - start
+
+        with youtube.YoutubeDLPool() as pool:
+            start = time.perf_counter()
+            for i, url in enumerate(urls):
+                assert (
+                    _pooled_download(pool, url, os.path.join(folder, f"pool-{i}")) == 0
+                )
+            pooled = time.perf_counter() - start
+
+    return {
+        "n_downloads": n_downloads,
+        "media_kb": media_kb,
+        "unpooled_ms_per_download": unpooled / n_downloads * 1e3,
+        "pooled_ms_per_download": pooled / n_downloads * 1e3,
+        "speedup": unpooled / pooled,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--downloads", type=int, default=20)
+    parser.add_argument("--media-kb", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0)
+    args = parser.parse_args()
+    print(json.dumps(run(args.downloads, args.media_kb, args.latency), indent=2))
+
+
+if __name__ == "__main__":
+    main()
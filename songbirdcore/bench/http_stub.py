@@ -0,0 +1,82 @@
+"""Local http server standing in for remote services in benchmarks."""
+
+from typing import Dict, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import sys
+import threading
+import time
+
+Response = Tuple[int, Dict[str, str], bytes]
+"""status, headers and body of a response"""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        status, headers, body = self.server.respond(self)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_GET = do_HEAD = do_POST = do_PUT = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """http server answering from a static routing table, with optional
+    per-request latency to approximate a remote service.
+
+    Use as a context manager to serve in a background thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, routes: Dict[str, Response], latency: float = 0):
+        """
+        Args:
+            routes (Dict[str, Response]): maps a url path to a (status, headers, body) tuple
+            latency (float, optional): seconds to wait before answering each request. Defaults to 0.
+        """
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.routes = routes
+        self.latency = latency
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def respond(self, handler: BaseHTTPRequestHandler) -> Response:
+        """Build the response to the request being handled, a 404 for unknown paths
+
+        Args:
+            handler (BaseHTTPRequestHandler): the handler of the request
+
+        Returns:
+            Response: the response
+        """
+        return self.routes.get(handler.path.split("?", 1)[0], (404, {}, b""))
+
+    def handle_error(self, request, client_address):
+        # clients such as yt-dlp hang up after sniffing the start of a response
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def __enter__(self) -> "StubServer":
+        threading.Thread(
+            target=self.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+        ).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
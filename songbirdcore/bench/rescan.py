@@ -0,0 +1,75 @@
+"""Benchmark of an incremental rescan of a large library catalog.
+
+Builds a synthetic <artist>/<album>/<track> tree of small untagged files,
+seeds a catalog with the stat of every file, then times
+`LibraryCatalog.rescan` when nothing changed and when a handful of tracks
+were retagged, against a full scan reading the tags of every file.
+
+Run with `python -m songbirdcore.bench.rescan`.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from .. import catalog
+from . import synthetic
+
+
+def run(n_tracks: int = 100_000, n_changed: int = 10, n_full_scan: int = 2000) -> dict:
+    """Time rescans of a synthetic library
+
+    Args:
+        n_tracks (int, optional): number of tracks in the library. Defaults to 100_000.
+        n_changed (int, optional): number of tracks modified before the second rescan. Defaults to 10.
+        n_full_scan (int, optional): number of tracks the full scan is timed on, it is
+            extrapolated to n_tracks. Defaults to 2000.
+
+    Returns:
+        dict: duration of each scan in seconds
+    """
+    with tempfile.TemporaryDirectory() as root:
+        synthetic.write_library(root, n_tracks, formats=("mp3",))
+        files = list(catalog.walk_tracks(root))
+        with catalog.LibraryCatalog() as library_catalog:
+            library_catalog.add(catalog.TrackTags(*file, tags=None) for file in files)
+
+            start = time.perf_counter()
+            unchanged_diff = library_catalog.rescan(root, max_workers=0)
+            unchanged = time.perf_counter() - start
+
+            for file in files[:: max(len(files) // n_changed, 1)][:n_changed]:
+                os.utime(file.path, ns=(file.mtime_ns, file.mtime_ns + 10**9))
+            start = time.perf_counter()
+            changed_diff = library_catalog.rescan(root, max_workers=0)
+            changed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        list(catalog.read_tracks(files[:n_full_scan], max_workers=0))
+        full_scan = (
+            (time.perf_counter() - start) * n_tracks / min(n_full_scan, n_tracks)
+        )
+
+    assert unchanged_diff.unchanged == n_tracks
+    assert len(changed_diff.changed) == n_changed
+    return {
+        "n_tracks": n_tracks,
+        "rescan_unchanged_s": unchanged,
+        "rescan_changed_s": changed,
+        "n_changed": n_changed,
+        "full_scan_estimate_s": full_scan,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=100_000)
+    parser.add_argument("--changed", type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(run(args.tracks, args.changed), indent=2))
+
+
+if __name__ == "__main__":
+    main()
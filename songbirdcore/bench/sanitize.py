@@ -0,0 +1,125 @@
+"""Micro-benchmark of the per-file cost of the itunes_lib_search loop.
+
+Compares the legacy loop, which sanitized every path component and the search
+term with chained str.replace calls for each file, against the current loop,
+which sanitizes the search term once and all path components in bulk.
+
+Run with `python -m songbirdcore.bench.sanitize`.
+"""
+
+from typing import List
+import argparse
+import json
+import os
+import time
+
+from .. import common, itunes
+
+
+def synthetic_paths(n_paths: int, root: str = "library") -> List[str]:
+    """Generate paths of a synthetic <artist>/<album>/<track> library tree
+
+    Args:
+        n_paths (int): number of track paths to generate
+        root (str, optional): root of the tree. Defaults to "library".
+
+    Returns:
+        List[str]: the track paths
+    """
+    paths = []
+    for i in range(n_paths):
+        artist = f"Artist {i // 120}: The 'Band'"
+        album = f"Album {i // 12} <Deluxe?>"
+        track = f"{i % 12 + 1:02d} Song Title {i} / Remix*.mp3".replace("/", "-")
+        paths.append(os.path.join(root, artist, album, track))
+    return paths
+
+
+def _legacy_remove_illegal_characters(filename: str) -> str:
+    return (
+        filename.replace("\\", "")
+        .replace('"', "")
+        .replace("/", "")
+        .replace("*", "")
+        .replace("?", "")
+        .replace("<", "")
+        .replace(">", "")
+        .replace("|", "")
+        .replace("'", "")
+        .replace(":", "")
+    )
+
+
+def legacy_search_loop(song_paths: List[str], search_parameters: str) -> List[str]:
+    """the itunes_lib_search loop body as it was before sanitization was hoisted"""
+    matches = []
+    for song_path in song_paths:
+        song_name_split = song_path.split(os.sep)
+        song_name = _legacy_remove_illegal_characters(song_name_split[-1].lower())
+        album_name = _legacy_remove_illegal_characters(song_name_split[-2].lower())
+        artist_name = _legacy_remove_illegal_characters(song_name_split[-3].lower())
+        search_parameters = _legacy_remove_illegal_characters(search_parameters.lower())
+        formatted_name = song_name + " " + album_name + " " + artist_name
+        if search_parameters in formatted_name:
+            matches.append(song_path)
+    return matches
+
+
+def current_search_loop(song_paths: List[str], search_parameters: str) -> List[str]:
+    """the itunes_lib_search loop body with a hoisted query and bulk sanitization"""
+    search_parameters = common.remove_illegal_characters(search_parameters.lower())
+    song_names, album_names, artist_names = itunes._path_search_keys(song_paths)
+    matches = []
+    for song_path, song_name, album_name, artist_name in zip(
+        song_paths, song_names, album_names, artist_names
+    ):
+        formatted_name = song_name + " " + album_name + " " + artist_name
+        if search_parameters in formatted_name:
+            matches.append(song_path)
+    return matches
+
+
+def _best_of(repeat: int, func, *args) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(n_paths: int = 100_000, repeat: int = 5) -> dict:
+    """Time the legacy and current search loops on a synthetic library
+
+    Args:
+        n_paths (int, optional): size of the synthetic library. Defaults to 100_000.
+        repeat (int, optional): number of timed runs, the best is kept. Defaults to 5.
+
+    Returns:
+        dict: per-file cost of each loop in microseconds, and the speedup
+    """
+    song_paths = synthetic_paths(n_paths)
+    search_parameters = "Song Title 99"
+    assert legacy_search_loop(song_paths, search_parameters) == current_search_loop(
+        song_paths, search_parameters
+    )
+    legacy = _best_of(repeat, legacy_search_loop, song_paths, search_parameters)
+    current = _best_of(repeat, current_search_loop, song_paths, search_parameters)
+    return {
+        "n_paths": n_paths,
+        "legacy_us_per_file": legacy / n_paths * 1e6,
+        "current_us_per_file": current / n_paths * 1e6,
+        "speedup": legacy / current,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paths", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.paths, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
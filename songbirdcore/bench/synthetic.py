@@ -0,0 +1,164 @@
+"""Generators of small but valid audio files, and of their tag data, for benchmarks."""
+
+from typing import List, Tuple
+import os
+import struct
+
+from ..models import itunes_api
+
+# MPEG-1 layer III, 128kbps, 44.1kHz, stereo: 417 byte frames of ~26ms
+_MP3_FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0x64])
+_MP3_FRAME_SIZE = 417
+
+
+def _atom(name: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", 8 + len(data)) + name + data
+
+
+def _full_atom(name: bytes, data: bytes, version: int = 0, flags: int = 0) -> bytes:
+    return _atom(name, bytes([version]) + flags.to_bytes(3, "big") + data)
+
+
+def mp3_bytes(n_frames: int = 38) -> bytes:
+    """Build a silent mp3 without any tags
+
+    Args:
+        n_frames (int, optional): number of frames, each ~26ms long. Defaults to 38 (~1s).
+
+    Returns:
+        bytes: the mp3 file contents
+    """
+    frame = _MP3_FRAME_HEADER + bytes(_MP3_FRAME_SIZE - len(_MP3_FRAME_HEADER))
+    return frame * n_frames
+
+
+def m4a_bytes() -> bytes:
+    """Build an empty m4a (an ftyp, a movie header and an empty media box) without any tags
+
+    Returns:
+        bytes: the m4a file contents
+    """
+    ftyp = _atom(b"ftyp", b"M4A " + bytes(4) + b"M4A mp42isom" + bytes(4))
+    mvhd = _full_atom(
+        b"mvhd",
+        struct.pack(">IIII", 0, 0, 44100, 0)  # created, modified, timescale, duration
+        + struct.pack(">IH", 0x00010000, 0x0100)  # rate, volume
+        + bytes(10)
+        + struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)  # matrix
+        + bytes(24)
+        + struct.pack(">I", 2),  # next track id
+    )
+    return ftyp + _atom(b"moov", mvhd) + _atom(b"mdat", b"")
+
+
+def write_track(path: str) -> str:
+    """Write a synthetic track, its format is picked from the extension of path
+
+    Args:
+        path (str): the path of the track, ending in .mp3 or .m4a
+
+    Returns:
+        str: path
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".mp3":
+        data = mp3_bytes()
+    elif extension == ".m4a":
+        data = m4a_bytes()
+    else:
+        raise ValueError(f"Can not generate a track of format {extension}")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def write_library(
+    root: str,
+    n_tracks: int,
+    tracks_per_album: int = 12,
+    albums_per_artist: int = 10,
+    formats: Tuple[str, ...] = ("mp3", "m4a"),
+) -> List[str]:
+    """Write a synthetic <artist>/<album>/<track>.<format> library tree
+
+    Args:
+        root (str): the library folder
+        n_tracks (int): number of tracks to write
+        tracks_per_album (int, optional): number of tracks per album folder. Defaults to 12.
+        albums_per_artist (int, optional): number of albums per artist folder. Defaults to 10.
+        formats (Tuple[str, ...], optional): formats of the tracks, used in turn. Defaults to ("mp3", "m4a").
+
+    Returns:
+        List[str]: paths of the tracks written
+    """
+    contents = {"mp3": mp3_bytes(n_frames=1), "m4a": m4a_bytes()}
+    paths = []
+    for i in range(n_tracks):
+        album_number = i // tracks_per_album
+        album = os.path.join(
+            root,
+            f"Artist {album_number // albums_per_artist}",
+            f"Album {album_number}",
+        )
+        if i % tracks_per_album == 0:
+            os.makedirs(album, exist_ok=True)
+        file_format = formats[album_number % len(formats)]
+        path = os.path.join(
+            album, f"{i % tracks_per_album + 1:02d} Track {i}.{file_format}"
+        )
+        with open(path, "wb") as f:
+            f.write(contents[file_format])
+        paths.append(path)
+    return paths
+
+
+def song_tags(
+    track_number: int = 1,
+    track_count: int = 1,
+    album: str = "Album",
+    artist: str = "Artist",
+    artwork_url: str = "",
+) -> itunes_api.ItunesApiSongModel:
+    """Build the tag data of a track, as returned by the itunes api
+
+    Args:
+        track_number (int, optional): the number of the track in its album. Defaults to 1.
+        track_count (int, optional): the number of tracks of the album. Defaults to 1.
+        album (str, optional): the album name. Defaults to "Album".
+        artist (str, optional): the artist of the track and of the album. Defaults to "Artist".
+        artwork_url (str, optional): the 100x100 artwork url of the album. Defaults to "".
+
+    Returns:
+        itunes_api.ItunesApiSongModel: the tag data, named "Track <track_number>"
+    """
+    return itunes_api.ItunesApiSongModel(
+        trackName=f"Track {track_number}",
+        artistName=artist,
+        collectionName=album,
+        artworkUrl100=artwork_url,
+        primaryGenreName="Rock",
+        trackNumber=track_number,
+        trackCount=track_count,
+        collectionId=1,
+        collectionArtistName=artist,
+        discNumber=1,
+        discCount=1,
+        releaseDate="2024",
+    )
+
+
+def album_tags(
+    n_tracks: int, artwork_url: str = ""
+) -> List[itunes_api.ItunesApiSongModel]:
+    """Build the tag data of every track of an album, see `song_tags`
+
+    Args:
+        n_tracks (int): the number of tracks
+        artwork_url (str, optional): the 100x100 artwork url of the album. Defaults to "".
+
+    Returns:
+        List[itunes_api.ItunesApiSongModel]: the tag data, in track order
+    """
+    return [
+        song_tags(i + 1, n_tracks, artwork_url=artwork_url) for i in range(n_tracks)
+    ]
@@ -0,0 +1,117 @@
+"""Benchmark of tagging a whole album.
+
+Compares the legacy flow, which called m4a_tagger/mp3ID3Tagger for each file
+and fetched the artwork again for every track with sequential GETs walking
+down from 3000x3000, against `itunes.tag_album`, which fetches the cover once
+and tags the files on a thread pool. Artwork is served by a local stand-in
+server with a configurable latency.
+
+Run with `python -m songbirdcore.bench.tagging`.
+"""
+
+from typing import List
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import requests
+
+from .. import artwork, itunes
+from ..models import itunes_api
+from . import http_stub, synthetic
+
+_AVAILABLE_SIZES = ["100x100", "500x500", "1000x1000"]
+
+
+def _legacy_artwork_searcher(url: str) -> bytes:
+    """artwork lookup as done by the taggers before artwork was cached"""
+    sizes = artwork.ARTWORK_SIZES
+    i = len(sizes) - 1
+    response = requests.get(url.replace("100x100", sizes[i]))
+    while response.status_code != 200 and i != 0:
+        response = requests.get(url.replace("100x100", sizes[i]))
+        i -= 1
+    return response.content
+
+
+def _write_album(folder: str, n_tracks: int) -> List[str]:
+    return [
+        synthetic.write_track(
+            os.path.join(folder, f"{i:02d}.{'mp3' if i % 2 else 'm4a'}")
+        )
+        for i in range(n_tracks)
+    ]
+
+
+def legacy_tag_album(
+    file_paths: List[str], song_tag_data: List[itunes_api.ItunesApiSongModel]
+) -> List[bool]:
+    results = []
+    for file_path, tags in zip(file_paths, song_tag_data):
+        artwork_bytes = _legacy_artwork_searcher(tags.artworkUrl100)
+        writer = itunes._TAG_WRITERS[os.path.splitext(file_path)[1]]
+        writer(file_path, tags, artwork_bytes)
+        results.append(True)
+    return results
+
+
+def run(n_tracks: int = 20, latency: float = 0.05, artwork_kb: int = 300) -> dict:
+    """Time tagging an album with the legacy flow and with tag_album
+
+    Args:
+        n_tracks (int, optional): number of tracks in the album. Defaults to 20.
+        latency (float, optional): latency of the artwork server in seconds. Defaults to 0.05.
+        artwork_kb (int, optional): size of the served artwork in KB. Defaults to 300.
+
+    Returns:
+        dict: duration of each flow in seconds, and the speedup
+    """
+    cover = random.Random(0).randbytes(artwork_kb * 1024)
+    routes = {
+        f"/image/{size}bb.jpg": (200, {"Content-Type": "image/jpeg"}, cover)
+        for size in _AVAILABLE_SIZES
+    }
+    with (
+        http_stub.StubServer(routes, latency=latency) as server,
+        tempfile.TemporaryDirectory() as folder,
+    ):
+        song_tag_data = synthetic.album_tags(
+            n_tracks, f"{server.url}/image/100x100bb.jpg"
+        )
+
+        start = time.perf_counter()
+        legacy_results = legacy_tag_album(_write_album(folder, n_tracks), song_tag_data)
+        legacy = time.perf_counter() - start
+
+        fetcher = artwork.ArtworkFetcher()
+        start = time.perf_counter()
+        results = itunes.tag_album(
+            _write_album(folder, n_tracks), song_tag_data, artwork_fetcher=fetcher
+        )
+        current = time.perf_counter() - start
+        fetcher.close()
+
+    assert all(legacy_results) and all(results)
+    return {
+        "n_tracks": n_tracks,
+        "latency_s": latency,
+        "legacy_s": legacy,
+        "tag_album_s": current,
+        "speedup": legacy / current,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--artwork-kb", type=int, default=300)
+    args = parser.parse_args()
+    print(json.dumps(run(args.tracks, args.latency, args.artwork_kb), indent=2))
+
+
+if __name__ == "__main__":
+    main()
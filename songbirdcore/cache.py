@@ -0,0 +1,197 @@
+from typing import Callable, Dict, List, Optional, Type
+from collections import OrderedDict
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from pydantic import BaseModel
+
+from .models import itunes_api
+
+logger = logging.getLogger(__name__)
+
+_CACHEABLE_MODELS: Dict[str, Type[BaseModel]] = {
+    model.__name__: model
+    for model in [itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]
+}
+
+
+def cache_key(url: str, params: dict) -> str:
+    """Build a cache key from an api url and its query parameters.
+
+    The url includes the host, so a cache shared between apis, such as a
+    mirror and the real one, keeps their results apart. Parameters are
+    sorted, and search terms are case folded with their whitespace
+    collapsed, so equivalent queries share a key.
+
+    Args:
+        url (str): the url of the api endpoint, such as 'https://itunes.apple.com/search'
+        params (dict): the query parameters of the request
+
+    Returns:
+        str: the cache key
+    """
+    normalized = {}
+    for key, value in params.items():
+        value = str(value)
+        if key == "term":
+            value = " ".join(value.split()).casefold()
+        else:
+            value = value.strip()
+        normalized[key] = value
+    return url + "?" + json.dumps(normalized, sort_keys=True)
+
+
+class ResponseCache:
+    """Cache of parsed itunes api results with TTL expiry.
+
+    Results are held in an in-memory LRU tier, optionally backed by a SQLite
+    tier that survives restarts. Both tiers store the already validated
+    models, so a hit skips the http request and pydantic validation.
+    Empty results are cached too (negative caching), with their own TTL.
+
+    Cached models are shared between callers and should be treated as read only.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 24 * 60 * 60,
+        negative_ttl: float = 5 * 60,
+        db_path: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            max_entries (int, optional): maximum number of entries kept in memory. Defaults to 1024.
+            ttl (float, optional): seconds a non empty result stays valid. Defaults to one day.
+            negative_ttl (float, optional): seconds an empty result stays valid. Defaults to five minutes.
+            db_path (Optional[str], optional): path of a SQLite database backing the memory tier.
+                If None, results are only cached in memory.
+            clock (Callable[[], float], optional): source of the current time in seconds. Defaults to time.time.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path is not None:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, expires_at REAL, model TEXT, payload TEXT)"
+            )
+            self._db.commit()
+
+    def get(self, key: str) -> Optional[List[BaseModel]]:
+        """Get the cached results for key
+
+        Args:
+            key (str): the cache key, see `cache_key`
+
+        Returns:
+            Optional[List[BaseModel]]: the cached results, an empty list for a cached
+                empty result, or None if nothing valid is cached for key
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, results = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return list(results)
+                del self._memory[key]
+
+            results = self._db_get(key, now)
+            if results is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(results)
+
+    def set(self, key: str, results: List[BaseModel]) -> None:
+        """Cache the results for key
+
+        Args:
+            key (str): the cache key, see `cache_key`
+            results (List[BaseModel]): the validated results
+        """
+        ttl = self.ttl if results else self.negative_ttl
+        expires_at = self.clock() + ttl
+        results = tuple(results)
+        with self._lock:
+            self._memory_set(key, expires_at, results)
+            if self._db is not None:
+                model = type(results[0]).__name__ if results else None
+                payload = json.dumps([result.model_dump() for result in results])
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                    (key, expires_at, model, payload),
+                )
+                self._db.commit()
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """Drop key from the cache, or every entry if key is None
+
+        Args:
+            key (Optional[str], optional): the key to drop. Defaults to None.
+        """
+        with self._lock:
+            if key is None:
+                self._memory.clear()
+            else:
+                self._memory.pop(key, None)
+            if self._db is not None:
+                if key is None:
+                    self._db.execute("DELETE FROM responses")
+                else:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+
+    def close(self) -> None:
+        """Close the SQLite tier, if any"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def _memory_set(self, key: str, expires_at: float, results: tuple) -> None:
+        self._memory[key] = (expires_at, results)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _db_get(self, key: str, now: float) -> Optional[tuple]:
+        """load key from the SQLite tier, promoting it to the memory tier"""
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT expires_at, model, payload FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        expires_at, model, payload = row
+        if expires_at <= now:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+        model_type = _CACHEABLE_MODELS.get(model)
+        if model is not None and model_type is None:
+            logger.warning(f"Ignoring cached entry with unknown model {model}")
+            return None
+        # the payload was validated before it was cached, so skip validation
+        results = tuple(
+            model_type.model_construct(**fields) for fields in json.loads(payload)
+        )
+        self._memory_set(key, expires_at, results)
+        return results
@@ -0,0 +1,507 @@
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    ProcessPoolExecutor,
+    wait,
+)
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from stat import S_ISREG
+
+from . import itunes
+from .models import itunes_api
+
+logger = logging.getLogger(__name__)
+
+TRACK_EXTENSIONS = (".mp3", ".m4a")
+"""extensions of the files the scanner reads tags from"""
+
+_TAG_READERS = {
+    ".mp3": itunes.mp3_tag_reader,
+    ".m4a": itunes.m4a_tag_reader,
+}
+
+_SCAN_BATCH_SIZE = 32
+"""number of files read by a worker per task, amortizing the inter process overhead"""
+
+
+class FileStat(NamedTuple):
+    """The attributes of a track on disk used to detect changes"""
+
+    path: str
+    """full path to the track on disk"""
+    inode: int
+    """inode number of the track"""
+    size: int
+    """size of the track in bytes"""
+    mtime_ns: int
+    """modification time of the track"""
+
+
+class TrackTags(NamedTuple):
+    """The tags of a single track, as read by `scan_library`"""
+
+    path: str
+    """full path to the track on disk"""
+    inode: int
+    """inode number of the track when it was read"""
+    size: int
+    """size of the track in bytes when it was read"""
+    mtime_ns: int
+    """modification time of the track when it was read"""
+    tags: Optional[itunes_api.ItunesApiSongModel]
+    """the tags of the track, None if they could not be read"""
+    artwork_md5: Optional[str] = None
+    """md5 hex digest of the embedded artwork, None without artwork"""
+    artwork_size: int = 0
+    """size of the embedded artwork in bytes"""
+    artwork: Optional[bytes] = None
+    """the embedded artwork, only kept when the scan asked for it"""
+
+
+def walk_tracks(
+    root: str, extensions: Tuple[str, ...] = TRACK_EXTENSIONS
+) -> Iterator[FileStat]:
+    """Walk a folder tree, yielding every track in it
+
+    Hidden files and folders are skipped, like the glob searches of the library do.
+
+    Args:
+        root (str): the folder to walk
+        extensions (Tuple[str, ...], optional): lower case extensions of the files yielded. Defaults to TRACK_EXTENSIONS.
+
+    Yields:
+        FileStat: the tracks found and their stat
+    """
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        # tracks are matched first, so they cost a single stat
+                        if entry.name.lower().endswith(extensions):
+                            stat = entry.stat()
+                            if S_ISREG(stat.st_mode):
+                                # entry.inode() is also filled in on windows, unlike st_ino
+                                yield FileStat(
+                                    entry.path,
+                                    entry.inode(),
+                                    stat.st_size,
+                                    stat.st_mtime_ns,
+                                )
+                                continue
+                        if entry.is_dir():
+                            stack.append(entry.path)
+                    except OSError as e:
+                        logger.debug(f"Skipping {entry.path}: {e}")
+        except OSError as e:
+            logger.warning(f"Could not list {folder}: {e}")
+
+
+def read_track(file: FileStat, include_artwork: bool = False) -> TrackTags:
+    """Read the tags of a track
+
+    Args:
+        file (FileStat): the track to read
+        include_artwork (bool, optional): keep the artwork bytes in the result. Defaults to False,
+            keeping only their hash and size.
+
+    Returns:
+        TrackTags: the tags of the track
+    """
+    reader = _TAG_READERS.get(os.path.splitext(file.path)[1].lower())
+    if reader is None:
+        return TrackTags(*file, tags=None)
+    tags, artwork_bytes = reader(file.path)
+    if not artwork_bytes:
+        return TrackTags(*file, tags=tags)
+    return TrackTags(
+        *file,
+        tags=tags,
+        artwork_md5=hashlib.md5(artwork_bytes).hexdigest(),
+        artwork_size=len(artwork_bytes),
+        artwork=artwork_bytes if include_artwork else None,
+    )
+
+
+def _read_batch(files: List[FileStat], include_artwork: bool) -> List[TrackTags]:
+    return [read_track(file, include_artwork) for file in files]
+
+
+def _batches(files: Iterable[FileStat], batch_size: int) -> Iterator[List[FileStat]]:
+    batch = []
+    for file in files:
+        batch.append(file)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_tracks(
+    files: Iterable[FileStat],
+    include_artwork: bool = False,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    batch_size: int = _SCAN_BATCH_SIZE,
+) -> Iterator[TrackTags]:
+    """Read the tags of many tracks in parallel
+
+    Files are read in batches on a process pool, so parsing the tags is not
+    serialized by the GIL. Only a bounded number of batches is in flight at once,
+    so results stream out as they complete (in no particular order) and memory
+    stays flat however many files are read.
+
+    Args:
+        files (Iterable[FileStat]): the tracks to read, see `walk_tracks`
+        include_artwork (bool, optional): keep the artwork bytes in the results. Defaults to False.
+        max_workers (Optional[int], optional): number of worker processes. Defaults to None, one per cpu.
+            0 reads every file in the calling process.
+        executor (Optional[Executor], optional): executor to read the files on instead of a new process pool.
+            max_workers then only bounds the number of batches in flight.
+        batch_size (int, optional): number of files read per task. Defaults to 32.
+
+    Yields:
+        TrackTags: the tags of every track
+    """
+    batches = _batches(files, batch_size)
+    if executor is None and max_workers == 0:
+        for batch in batches:
+            yield from _read_batch(batch, include_artwork)
+        return
+
+    owns_executor = executor is None
+    if owns_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    max_in_flight = 2 * (max_workers or os.cpu_count() or 1)
+    pending = set()
+    try:
+        for batch in batches:
+            pending.add(executor.submit(_read_batch, batch, include_artwork))
+            if len(pending) < max_in_flight:
+                continue
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        if owns_executor:
+            executor.shutdown(cancel_futures=True)
+
+
+def scan_library(
+    root: str,
+    include_artwork: bool = False,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> Iterator[TrackTags]:
+    """Walk a library and read the tags of every mp3 and m4a in it, see `read_tracks`
+
+    Args:
+        root (str): the library folder
+        include_artwork (bool, optional): keep the artwork bytes in the results. Defaults to False.
+        max_workers (Optional[int], optional): number of worker processes. Defaults to None, one per cpu.
+        executor (Optional[Executor], optional): executor to read the files on instead of a new process pool.
+
+    Yields:
+        TrackTags: the tags of every track
+    """
+    yield from read_tracks(
+        walk_tracks(root),
+        include_artwork=include_artwork,
+        max_workers=max_workers,
+        executor=executor,
+    )
+
+
+_TAG_COLUMNS = [
+    "trackName",
+    "artistName",
+    "collectionName",
+    "collectionArtistName",
+    "primaryGenreName",
+    "trackNumber",
+    "trackCount",
+    "discNumber",
+    "discCount",
+    "releaseDate",
+]
+
+
+class CatalogDiff(NamedTuple):
+    """The changes found by `LibraryCatalog.rescan`"""
+
+    added: List[str]
+    """paths of the new tracks"""
+    changed: List[str]
+    """paths of the tracks whose inode, size or modification time changed"""
+    removed: List[str]
+    """paths of the tracks no longer on disk"""
+    unchanged: int
+    """number of tracks that were not read again"""
+
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS tracks ("
+    "path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+    "tagged INTEGER, trackName TEXT, artistName TEXT, collectionName TEXT, "
+    "collectionArtistName TEXT, primaryGenreName TEXT, trackNumber INTEGER, "
+    "trackCount INTEGER, discNumber INTEGER, discCount INTEGER, releaseDate TEXT, "
+    "artwork_md5 TEXT, artwork_size INTEGER) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS tracks_album "
+    "ON tracks (collectionName COLLATE NOCASE, artistName COLLATE NOCASE)",
+]
+
+
+class LibraryCatalog:
+    """Queryable SQLite catalog of the tags of the tracks in a library.
+
+    Fill it with `add` from a `scan_library` generator, or keep it up to date
+    with `rescan`, which only reads the tracks changed since they were last
+    read. Tracks are indexed by album, so questions like `is_album_tagged`
+    are an index lookup instead of a rescan of the library.
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        """
+        Args:
+            db_path (str, optional): path of the SQLite database. Defaults to ":memory:".
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    def add(self, tracks: Iterable[TrackTags], commit_every: int = 1000) -> int:
+        """Insert or replace tracks in the catalog
+
+        Args:
+            tracks (Iterable[TrackTags]): the tracks, such as a `scan_library` generator
+            commit_every (int, optional): number of tracks written per transaction. Defaults to 1000.
+
+        Returns:
+            int: the number of tracks written
+        """
+        count = 0
+        for batch in _batches(tracks, commit_every):
+            rows = [self._row(track) for track in batch]
+            with self._lock, self._db:
+                self._db.executemany(
+                    f"INSERT OR REPLACE INTO tracks VALUES ({', '.join('?' * len(rows[0]))})",
+                    rows,
+                )
+            count += len(rows)
+        return count
+
+    def remove(self, paths: Iterable[str]) -> None:
+        """Drop tracks from the catalog
+
+        Args:
+            paths (Iterable[str]): paths of the tracks to drop
+        """
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM tracks WHERE path = ?", [(path,) for path in paths]
+            )
+
+    def snapshot(self, root: Optional[str] = None) -> Dict[str, Tuple[int, int, int]]:
+        """Get the stat of the tracks as of when their tags were read
+
+        Args:
+            root (Optional[str], optional): only include the tracks under this folder. Defaults to None, every track.
+
+        Returns:
+            Dict[str, Tuple[int, int, int]]: (inode, size, mtime_ns) of each track path
+        """
+        query = "SELECT path, inode, size, mtime_ns FROM tracks"
+        params = ()
+        if root is not None:
+            prefix = os.path.join(root, "")
+            # every path starting with prefix sorts within this range
+            query += " WHERE path >= ? AND path < ?"
+            params = (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return {path: (inode, size, mtime_ns) for path, inode, size, mtime_ns in rows}
+
+    def rescan(
+        self,
+        root: str,
+        include_artwork: bool = False,
+        max_workers: Optional[int] = None,
+        executor: Optional[Executor] = None,
+    ) -> CatalogDiff:
+        """Bring the catalog up to date with the tracks under root
+
+        Every track's (inode, size, mtime_ns) is compared with the snapshot
+        stored when its tags were read, and only new or changed tracks are
+        read again. Tracks no longer on disk are dropped. A rescan that
+        finds no changes costs one stat per track.
+
+        Tracks are stat'ed before they are read, so a track modified while
+        it is read is picked up by the next rescan.
+
+        Args:
+            root (str): the library folder, such as the itunes_lib_path
+            include_artwork (bool, optional): keep the artwork bytes of the tracks read. Defaults to False.
+            max_workers (Optional[int], optional): number of worker processes. Defaults to None, one per cpu.
+            executor (Optional[Executor], optional): executor to read the files on instead of a new process pool.
+
+        Returns:
+            CatalogDiff: the changes found
+        """
+        snapshot = self.snapshot(root)
+        added = []
+        changed = []
+        unchanged = 0
+        for file in walk_tracks(root):
+            known = snapshot.pop(file.path, None)
+            if known is None:
+                added.append(file)
+            elif known != file[1:]:
+                changed.append(file)
+            else:
+                unchanged += 1
+        removed = list(snapshot)
+
+        to_read = added + changed
+        if executor is None and len(to_read) <= _SCAN_BATCH_SIZE:
+            # starting a process pool costs more than reading a handful of files
+            max_workers = 0
+        self.add(
+            read_tracks(
+                to_read,
+                include_artwork=include_artwork,
+                max_workers=max_workers,
+                executor=executor,
+            )
+        )
+        self.remove(removed)
+        diff = CatalogDiff(
+            [file.path for file in added],
+            [file.path for file in changed],
+            removed,
+            unchanged,
+        )
+        logger.info(
+            f"Rescanned {root}: {len(diff.added)} added, {len(diff.changed)} changed, "
+            f"{len(diff.removed)} removed, {diff.unchanged} unchanged"
+        )
+        return diff
+
+    @staticmethod
+    def _row(track: TrackTags) -> tuple:
+        if track.tags is None:
+            tags = (None,) * len(_TAG_COLUMNS)
+        else:
+            tags = tuple(getattr(track.tags, column) for column in _TAG_COLUMNS)
+        return (
+            track.path,
+            track.inode,
+            track.size,
+            track.mtime_ns,
+            track.tags is not None,
+            *tags,
+            track.artwork_md5,
+            track.artwork_size,
+        )
+
+    @staticmethod
+    def _track(row: tuple) -> TrackTags:
+        path, inode, size, mtime_ns, tagged = row[:5]
+        tag_values = row[5 : 5 + len(_TAG_COLUMNS)]
+        artwork_md5, artwork_size = row[5 + len(_TAG_COLUMNS) :]
+        tags = None
+        if tagged:
+            # the tags were validated when they were read, so skip validation
+            tags = itunes_api.ItunesApiSongModel.model_construct(
+                artworkUrl100="", **dict(zip(_TAG_COLUMNS, tag_values))
+            )
+        return TrackTags(
+            path, inode, size, mtime_ns, tags, artwork_md5, artwork_size or 0
+        )
+
+    def get(self, path: str) -> Optional[TrackTags]:
+        """Get a track from the catalog
+
+        Args:
+            path (str): path of the track
+
+        Returns:
+            Optional[TrackTags]: the track, or None if it is not in the catalog
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT * FROM tracks WHERE path = ?", (path,)
+            ).fetchone()
+        return None if row is None else self._track(row)
+
+    def album_tracks(self, artist: str, album: str) -> List[TrackTags]:
+        """Get the tracks of an album, matched case insensitively on their tags
+
+        Args:
+            artist (str): the artist, matched against the track or album artist
+            album (str): the album name
+
+        Returns:
+            List[TrackTags]: the tracks, sorted by disc and track number
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM tracks WHERE collectionName = ? COLLATE NOCASE "
+                "AND (artistName = ? COLLATE NOCASE OR collectionArtistName = ? COLLATE NOCASE) "
+                "ORDER BY discNumber, trackNumber",
+                (album, artist, artist),
+            ).fetchall()
+        return [self._track(row) for row in rows]
+
+    def is_album_tagged(
+        self,
+        album_properties: itunes_api.ItunesApiAlbumKeys,
+        require_artwork: bool = True,
+    ) -> bool:
+        """Check whether every track of an album is in the library with its tags
+
+        Args:
+            album_properties (itunes_api.ItunesApiAlbumKeys): the album to look for
+            require_artwork (bool, optional): only count tracks with embedded artwork. Defaults to True.
+
+        Returns:
+            bool: True if at least trackCount tagged tracks of the album are in the catalog
+        """
+        tracks = self.album_tracks(
+            album_properties.artistName, album_properties.collectionName
+        )
+        if require_artwork:
+            tracks = [track for track in tracks if track.artwork_md5 is not None]
+        return len(tracks) >= max(album_properties.trackCount, 1)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def close(self) -> None:
+        """Close the database"""
+        self._db.close()
+
+    def __enter__(self) -> "LibraryCatalog":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
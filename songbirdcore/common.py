@@ -1,7 +1,9 @@
-from typing import List
+from typing import Dict, Iterable, List, Set
+import functools
 import logging
 import glob
 import os, sys
+import threading
 import tomllib
 
 from typing import Optional
@@ -64,51 +66,247 @@ def name_plate(entries: List[str]) -> None:
 def fname_duper(fname: str, limit: int, count: int, dup_key: str) -> Optional[str]:
     """Generates a duplicate filename for when a filename already exists
 
+    The candidates fname, fname + dup_key, fname + dup_key * 2, ... are checked
+    in turn. New code should prefer `unique_fname`, which numbers duplicates
+    instead and lists the folder once when many names collide.
+
     Args:
         fname (str): filename
         limit (int): a limit of dups before quitting the attempt
-        count (int): recursive count tracker
+        count (int): number of attempts already made, counted against limit
         dup_key (str): the key to use as the duplicate addon
 
     Returns:
         Optional[str]: the modified filename, or None if the limit has been reached.
     """
-    fname_split = os.path.splitext(fname)
-    fname_noext = fname_split[0]
-    ext = fname_split[1]
-    if count == limit:
+    fname_noext, ext = os.path.splitext(fname)
+    for i in range(limit - count):
+        candidate = fname_noext + dup_key * i + ext
+        if not os.path.exists(candidate):
+            return candidate
+    logger.error(
+        f"Max retry limit {limit} reached for fname {fname}. Please try changing some filenames and try again later."
+    )
+    return None
+
+
+def _list_names(folder: str) -> Set[str]:
+    try:
+        return set(os.listdir(folder or "."))
+    except FileNotFoundError:
+        return set()
+
+
+class FnameResolver:
+    """Resolves file names in a folder that collide with existing files.
+
+    A name that is taken resolves to the next free numbered name, so
+    "song.mp3" becomes "song 1.mp3", then "song 2.mp3" and so on. The folder
+    is listed once (or the names in it are given up front), and the next
+    number tried is remembered per name, so resolving k collisions of the
+    same name costs O(1) amortized each instead of k file system checks.
+
+    Names handed out are treated as taken, so a resolver shared between
+    threads never returns the same name twice. Use `create` when other
+    processes may write to the folder too.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        existing: Optional[Iterable[str]] = None,
+        dup_key: str = " ",
+        limit: Optional[int] = None,
+    ):
+        """
+        Args:
+            folder (str): the folder the names are resolved in
+            existing (Optional[Iterable[str]], optional): names already in the folder. Defaults to None, listing the folder.
+            dup_key (str, optional): separator between a name and its number. Defaults to " ".
+            limit (Optional[int], optional): highest number tried before giving up. Defaults to None, no limit.
+        """
+        self.folder = folder
+        self.dup_key = dup_key
+        self.limit = limit
+        self._names = _list_names(folder) if existing is None else set(existing)
+        self._next_number: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._names
+
+    def _reserve(self, name: str) -> Optional[str]:
+        if name not in self._names:
+            self._names.add(name)
+            return name
+        name_noext, ext = os.path.splitext(name)
+        number = self._next_number.get(name, 1)
+        while self.limit is None or number <= self.limit:
+            candidate = f"{name_noext}{self.dup_key}{number}{ext}"
+            number += 1
+            if candidate not in self._names:
+                self._next_number[name] = number
+                self._names.add(candidate)
+                return candidate
+        self._next_number[name] = number
         logger.error(
-            f"Max retry limit {limit} reached for fname {fname}. Please try changing some filenames and try again later."
+            f"Max retry limit {self.limit} reached for fname {name}. Please try changing some filenames and try again later."
         )
         return None
-    if os.path.exists(fname):
-        fname = fname_duper(fname_noext + dup_key + ext, limit, count + 1, dup_key)
 
-    return fname
+    def resolve(self, name: str) -> Optional[str]:
+        """Get a free path for a file name, without creating the file
+
+        Args:
+            name (str): the file name, relative to the folder
+
+        Returns:
+            Optional[str]: path of the file in the folder, or None if the limit has been reached.
+        """
+        with self._lock:
+            free_name = self._reserve(name)
+        return None if free_name is None else os.path.join(self.folder, free_name)
+
+    def create(self, name: str) -> Optional[str]:
+        """Get a free path for a file name and atomically create the file there
+
+        The file is created empty with O_EXCL, so concurrent downloaders, even
+        in other processes, can not race into the same file name. Names found to
+        be taken since the folder was listed are skipped.
+
+        Args:
+            name (str): the file name, relative to the folder
+
+        Returns:
+            Optional[str]: path of the created file, or None if the limit has been reached.
+        """
+        while True:
+            path = self.resolve(name)
+            if path is None:
+                return None
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+            except FileExistsError:
+                logger.debug(f"{path} was created since the folder was listed")
+                continue
+            os.close(fd)
+            return path
+
+
+def unique_fname(
+    fname: str,
+    existing: Optional[Iterable[str]] = None,
+    dup_key: str = " ",
+    limit: Optional[int] = None,
+    exclusive: bool = False,
+) -> Optional[str]:
+    """Get the next free numbered path for a file path, see `FnameResolver`
+
+    Args:
+        fname (str): path of the file
+        existing (Optional[Iterable[str]], optional): names already in the file's folder. Defaults to None, listing the folder.
+        dup_key (str, optional): separator between a name and its number. Defaults to " ".
+        limit (Optional[int], optional): highest number tried before giving up. Defaults to None, no limit.
+        exclusive (bool, optional): atomically create the file with O_EXCL. Defaults to False.
+
+    Returns:
+        Optional[str]: the free path, or None if the limit has been reached.
+    """
+    folder, name = os.path.split(fname)
+    resolver = FnameResolver(folder, existing=existing, dup_key=dup_key, limit=limit)
+    return resolver.create(name) if exclusive else resolver.resolve(name)
+
+
+ILLEGAL_CHARACTERS = "\\\"/*?<>|':"
+"""characters stripped from file names by default"""
+WINDOWS_ILLEGAL_CHARACTERS = '<>:"/\\|?*' + "".join(chr(i) for i in range(32))
+"""characters that can not be used in a file name on windows"""
+MACOS_ILLEGAL_CHARACTERS = "/:\x00"
+"""characters that can not be used in a file name on macos"""
+POSIX_ILLEGAL_CHARACTERS = "/\x00"
+"""characters that can not be used in a file name on linux and other posix systems"""
 
+_SANITIZE_SEPARATORS = ["\n", "\x00", "\x1f"]
 
-def remove_illegal_characters(filename) -> str:
+
+def platform_illegal_characters(platform: str = sys.platform) -> str:
+    """Get the characters that are illegal in file names for an operating system
+
+    Args:
+        platform (str, optional): the platform, formatted like sys.platform. Defaults to sys.platform.
+
+    Returns:
+        str: the illegal characters for the platform
+    """
+    if platform.startswith("win") or platform == "cygwin":
+        return WINDOWS_ILLEGAL_CHARACTERS
+    if platform == "darwin":
+        return MACOS_ILLEGAL_CHARACTERS
+    return POSIX_ILLEGAL_CHARACTERS
+
+
+@functools.lru_cache(maxsize=None)
+def translation_table(illegal_characters: str = ILLEGAL_CHARACTERS) -> tuple:
+    """Precompute a str.translate table that deletes illegal_characters.
+
+    The table is a tuple indexed by ordinal, which str.translate looks up
+    faster than a dict. Ordinals past the end of the table are left untouched.
+
+    Args:
+        illegal_characters (str, optional): the characters to delete. Defaults to ILLEGAL_CHARACTERS.
+
+    Returns:
+        tuple: the translation table
+    """
+    table = [chr(i) for i in range(max(map(ord, illegal_characters), default=-1) + 1)]
+    for char in illegal_characters:
+        table[ord(char)] = None
+    return tuple(table)
+
+
+def remove_illegal_characters(
+    filename: str, illegal_characters: str = ILLEGAL_CHARACTERS
+) -> str:
     """
     Used for stripping file names of illegal characters used for saving
 
     Args:
         filename (str): the file's name to strip illegal characters from
+        illegal_characters (str, optional): the characters to strip. Defaults to ILLEGAL_CHARACTERS.
 
     Returns:
         str: stripped file name
     """
-    return (
-        filename.replace("\\", "")
-        .replace('"', "")
-        .replace("/", "")
-        .replace("*", "")
-        .replace("?", "")
-        .replace("<", "")
-        .replace(">", "")
-        .replace("|", "")
-        .replace("'", "")
-        .replace(":", "")
-    )
+    return filename.translate(translation_table(illegal_characters))
+
+
+def sanitize_many(
+    filenames: List[str], illegal_characters: str = ILLEGAL_CHARACTERS
+) -> List[str]:
+    """
+    Strip many file names of illegal characters at once.
+
+    The names are joined and translated in a single call, which is much cheaper
+    than translating each name on its own for large lists of short names.
+
+    Args:
+        filenames (List[str]): the file names to strip illegal characters from
+        illegal_characters (str, optional): the characters to strip. Defaults to ILLEGAL_CHARACTERS.
+
+    Returns:
+        List[str]: the stripped file names, in the same order as filenames
+    """
+    table = translation_table(illegal_characters)
+    if not filenames:
+        return []
+    for sep in _SANITIZE_SEPARATORS:
+        if sep in illegal_characters:
+            continue
+        joined = sep.join(filenames)
+        # only safe to split back if no name contains the separator itself
+        if joined.count(sep) == len(filenames) - 1:
+            return joined.translate(table).split(sep)
+    return [filename.translate(table) for filename in filenames]
 
 
 def find_file(path: str, filename: str) -> List[str]:
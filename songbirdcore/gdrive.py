@@ -1,53 +1,198 @@
 import os, sys
 
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient import http
-
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 import logging
-from typing import Optional
+import mimetypes
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from . import metrics
+
+# the google api client and oauth stack take a few hundred ms to import,
+# they are imported on first use
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+    import google_auth_httplib2
+
+
+def __getattr__(name: str):
+    # keeps gdrive.HttpError, raised by uploads, available without importing
+    # the google api client along with this module
+    if name == "HttpError":
+        from googleapiclient.errors import HttpError
+
+        return HttpError
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 logger = logging.getLogger(__name__)
 
+SCOPES = ["https://www.googleapis.com/auth/drive"]
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+"""default size of each chunk of a resumable upload. Drive needs a multiple of 256 KiB."""
+_RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+_LIST_PAGE_SIZE = 1000
+MANIFEST_VERSION = 1
 
-def save_song(
-    gdrive_folder_id: str,
+
+def file_md5(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash a file with md5, reading it in chunks so large files are not loaded into memory
+
+    Args:
+        path (str): path of the file
+        chunk_size (int, optional): bytes read at a time. Defaults to 1 MiB.
+
+    Returns:
+        str: the hex digest, comparable to the md5Checksum drive reports
+    """
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class DriveManifest:
+    """Local record of the files in google drive folders, used to skip duplicate uploads.
+
+    For each folder the manifest keeps the id, name, size and md5Checksum of
+    its files, as listed by drive, plus the files uploaded since. A folder is
+    listed again once its listing is older than `ttl`. The manifest is saved
+    to `path` as json, when given, so listings are reused between runs.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: float = 60 * 60,
+        clock=time.time,
+    ):
+        """
+        Args:
+            path (Optional[str], optional): json file the manifest is kept in. Defaults to None, for memory only.
+            ttl (float, optional): seconds before a folder is listed again. Defaults to one hour.
+            clock (optional): source of the current time in seconds. Defaults to time.time.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self._folders: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logger.warning(f"Ignoring unreadable drive manifest {self.path}")
+            return
+        if data.get("version") != MANIFEST_VERSION:
+            logger.info(f"Ignoring drive manifest {self.path} of another version")
+            return
+        self._folders = data.get("folders", {})
+
+    def save(self) -> None:
+        """Write the manifest to its path atomically, if it has one"""
+        if self.path is None:
+            return
+        with self._lock:
+            data = json.dumps({"version": MANIFEST_VERSION, "folders": self._folders})
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def is_fresh(self, folder_id: str) -> bool:
+        """True if folder_id was listed within the ttl"""
+        with self._lock:
+            folder = self._folders.get(folder_id)
+            return folder is not None and folder["listed_at"] + self.ttl > self.clock()
+
+    def set_listing(self, folder_id: str, files: List[dict]) -> None:
+        """Replace the files recorded for folder_id with a fresh listing
+
+        Args:
+            folder_id (str): google drive folder id
+            files (List[dict]): the files of the folder, with id, name, size and md5Checksum
+        """
+        with self._lock:
+            self._folders[folder_id] = {"listed_at": self.clock(), "files": {}}
+        for file in files:
+            self.add(folder_id, file)
+
+    def add(self, folder_id: str, file: dict) -> None:
+        """Record a file of folder_id
+
+        Args:
+            folder_id (str): google drive folder id
+            file (dict): the file, with id, name, size and md5Checksum.
+                Files without a checksum, such as google docs, are ignored.
+        """
+        if not file.get("md5Checksum"):
+            return
+        key = f"{int(file.get('size', 0))}:{file['md5Checksum']}"
+        with self._lock:
+            folder = self._folders.setdefault(folder_id, {"listed_at": 0, "files": {}})
+            folder["files"].setdefault(
+                key, {"id": file["id"], "name": file.get("name")}
+            )
+
+    def find(self, folder_id: str, size: int, md5: str) -> Optional[dict]:
+        """Find a file of folder_id with the given content
+
+        Args:
+            folder_id (str): google drive folder id
+            size (int): size of the content in bytes
+            md5 (str): md5 hex digest of the content
+
+        Returns:
+            Optional[dict]: the id and name of the file, or None if the folder has no such file
+        """
+        with self._lock:
+            folder = self._folders.get(folder_id)
+            if folder is None:
+                return None
+            return folder["files"].get(f"{size}:{md5}")
+
+
+def load_credentials(
     credentials_path: str,
     token_path: str,
-    song_name: str,
-    song_path: str,
     auth_port: int,
     bind_addr: Optional[str] = None,
-) -> str:
-    """save a song to google drive
+) -> "Credentials":
+    """Load google drive credentials, running the oauth flow if needed
 
     Args:
-        gdrive_folder_id (str): google drive folder id
         credentials_path (str): path to a credentials.json file
-        token_path (str): path to a google cloud token file
-        song_name (str): the name of the song (filename)
-        song_path (str): the path of the song locally
+        token_path (str): path to a google cloud token file, rewritten when the token changes
         auth_port (int): the port to use for oauth
         bind_addr (Optional[str], optional): optionally specify the bind address, otherwise localhost is used. Defaults to None.
 
     Returns:
-        str: the file id of the upload
+        Credentials: the loaded credentials
     """
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+
     creds = None
     # The file token.json stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
     # time.
-    scopes = ["https://www.googleapis.com/auth/drive"]
     if os.path.exists(token_path):
-        creds = Credentials.from_authorized_user_file(token_path, scopes)
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
     # If there are no (valid) credentials available, let the user log in.
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
-            flow = InstalledAppFlow.from_client_secrets_file(credentials_path, scopes)
+            flow = InstalledAppFlow.from_client_secrets_file(credentials_path, SCOPES)
             creds = flow.run_local_server(
                 port=auth_port, bind_addr=bind_addr, open_browser=False
             )
@@ -56,18 +201,333 @@ def save_song(
             token.write(creds.to_json())
 
     logger.debug(f"Loaded credentials: {creds}")
-    service = build("drive", "v3", credentials=creds)
-
-    file_metadata = {"name": song_name, "parents": [gdrive_folder_id]}
-    media = http.MediaFileUpload(song_path, mimetype="audio/jpeg")
-    file = (
-        service.files()
-        .create(body=file_metadata, media_body=media, fields="id")
-        .execute()
-    )
-    file_id = file.get("id")
-    logger.info(f"File creation successful -- ID: {file_id}")
-    return file_id
+    return creds
+
+
+class DriveUploader:
+    """Uploads songs to google drive, reusing credentials and the drive service.
+
+    Credentials are loaded and the drive service built once, on first use.
+    Files are sent as resumable uploads in chunks of `chunk_size`. A chunk that
+    fails with a transient error is retried with exponential backoff, resuming
+    where the upload stopped instead of starting over.
+
+    Drive does not accept media uploads in batch requests, so `upload_many`
+    runs uploads on a small thread pool instead, each thread with its own
+    http connection.
+
+    With a `manifest`, uploads are deduplicated: a file whose content (size
+    and md5) is already in the target folder is not uploaded again, and the id
+    of the existing file is returned instead.
+    """
+
+    def __init__(
+        self,
+        credentials_path: Optional[str] = None,
+        token_path: Optional[str] = None,
+        auth_port: int = 8080,
+        bind_addr: Optional[str] = None,
+        credentials=None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        num_retries: int = 5,
+        backoff: float = 1,
+        max_workers: int = 4,
+        timeout: Optional[float] = 60,
+        root_url: Optional[str] = None,
+        manifest: Optional[DriveManifest] = None,
+    ):
+        """
+        Args:
+            credentials_path (Optional[str], optional): path to a credentials.json file.
+            token_path (Optional[str], optional): path to a google cloud token file.
+            auth_port (int, optional): the port to use for oauth. Defaults to 8080.
+            bind_addr (Optional[str], optional): bind address for oauth, otherwise localhost is used.
+            credentials (optional): google auth credentials to use instead of loading them from
+                credentials_path and token_path. Defaults to None.
+            chunk_size (int, optional): bytes sent per request, a multiple of 256 KiB. Defaults to 8 MiB.
+            num_retries (int, optional): retries of each failing chunk. Defaults to 5.
+            backoff (float, optional): seconds before the first retry of a chunk, doubled
+                for every later retry. Defaults to 1.
+            max_workers (int, optional): number of concurrent uploads in upload_many. Defaults to 4.
+            timeout (Optional[float], optional): timeout of each request in seconds. Defaults to 60.
+            root_url (Optional[str], optional): root url of the google apis, such as a local
+                stand-in for tests. Defaults to None, for https://www.googleapis.com/.
+            manifest (Optional[DriveManifest], optional): manifest of the drive folders,
+                enables deduplication of uploads. Defaults to None.
+        """
+        self.credentials_path = credentials_path
+        self.token_path = token_path
+        self.auth_port = auth_port
+        self.bind_addr = bind_addr
+        self.chunk_size = chunk_size
+        self.num_retries = num_retries
+        self.backoff = backoff
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.root_url = root_url
+        self.manifest = manifest
+        self._credentials = credentials
+        self._service = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._folder_locks: Dict[str, threading.Lock] = {}
+
+    @property
+    def credentials(self):
+        """the credentials, loaded on first use"""
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = load_credentials(
+                    self.credentials_path,
+                    self.token_path,
+                    self.auth_port,
+                    self.bind_addr,
+                )
+            return self._credentials
+
+    @property
+    def service(self):
+        """the drive v3 service, built on first use"""
+        from googleapiclient.discovery import build, build_from_document
+        from googleapiclient.discovery_cache import get_static_doc
+
+        credentials = self.credentials
+        with self._lock:
+            if self._service is None:
+                if self.root_url is None:
+                    self._service = build("drive", "v3", credentials=credentials)
+                else:
+                    document = json.loads(get_static_doc("drive", "v3"))
+                    document["rootUrl"] = self.root_url.rstrip("/") + "/"
+                    self._service = build_from_document(
+                        document, credentials=credentials
+                    )
+            return self._service
+
+    def _http(self) -> "google_auth_httplib2.AuthorizedHttp":
+        """an authorized http client for the calling thread, httplib2 is not thread safe"""
+        authorized_http = getattr(self._local, "http", None)
+        if authorized_http is None:
+            from googleapiclient import http
+            import google_auth_httplib2
+
+            # build_http keeps httplib2 from following the 308 of resumable uploads
+            thread_http = http.build_http()
+            thread_http.timeout = self.timeout
+            authorized_http = google_auth_httplib2.AuthorizedHttp(
+                self.credentials, http=thread_http
+            )
+            self._local.http = authorized_http
+        return authorized_http
+
+    def list_folder(self, gdrive_folder_id: str) -> List[dict]:
+        """List the files of a google drive folder, following every page
+
+        Args:
+            gdrive_folder_id (str): google drive folder id
+
+        Returns:
+            List[dict]: the id, name, size and md5Checksum of each file in the folder
+        """
+        files = []
+        page_token = None
+        while True:
+            response = (
+                self.service.files()
+                .list(
+                    q=f"'{gdrive_folder_id}' in parents and trashed = false",
+                    fields="nextPageToken, files(id, name, size, md5Checksum)",
+                    pageSize=_LIST_PAGE_SIZE,
+                    pageToken=page_token,
+                )
+                .execute(http=self._http(), num_retries=self.num_retries)
+            )
+            files.extend(response.get("files", []))
+            page_token = response.get("nextPageToken")
+            if page_token is None:
+                return files
+
+    def _refresh_manifest(self, gdrive_folder_id: str) -> None:
+        """list the folder into the manifest, unless its listing is fresh"""
+        with self._lock:
+            folder_lock = self._folder_locks.setdefault(
+                gdrive_folder_id, threading.Lock()
+            )
+        # one listing per folder, even when many uploads start at once
+        with folder_lock:
+            if self.manifest.is_fresh(gdrive_folder_id):
+                return
+            files = self.list_folder(gdrive_folder_id)
+            self.manifest.set_listing(gdrive_folder_id, files)
+            self.manifest.save()
+            logger.info(
+                f"Listed {len(files)} files of google drive folder {gdrive_folder_id}"
+            )
+
+    @metrics.timed("gdrive.upload")
+    def upload(
+        self,
+        gdrive_folder_id: str,
+        song_name: str,
+        song_path: str,
+        mimetype: Optional[str] = None,
+    ) -> str:
+        """Upload a song to a google drive folder
+
+        Args:
+            gdrive_folder_id (str): google drive folder id
+            song_name (str): the name of the song (filename)
+            song_path (str): the path of the song locally
+            mimetype (Optional[str], optional): mime type of the song. Guessed from
+                its extension when not given.
+
+        Raises:
+            HttpError: if the upload failed, after retrying transient errors
+
+        Returns:
+            str: the file id of the upload, or of the existing file with the same
+                content when deduplicating
+        """
+        if self.manifest is not None:
+            self._refresh_manifest(gdrive_folder_id)
+            size = os.path.getsize(song_path)
+            md5 = file_md5(song_path)
+            existing = self.manifest.find(gdrive_folder_id, size, md5)
+            if existing is not None:
+                metrics.count("gdrive.deduplicated")
+                logger.info(
+                    f"Skipping upload of {song_name}, its content is already in google drive as {existing['name']} -- ID: {existing['id']}"
+                )
+                return existing["id"]
+        from googleapiclient import http
+        from googleapiclient.errors import HttpError
+        import httplib2
+
+        if mimetype is None:
+            mimetype = mimetypes.guess_type(song_path)[0] or "application/octet-stream"
+        media = http.MediaFileUpload(
+            song_path, mimetype=mimetype, chunksize=self.chunk_size, resumable=True
+        )
+        file_metadata = {"name": song_name, "parents": [gdrive_folder_id]}
+        request = self.service.files().create(
+            body=file_metadata, media_body=media, fields="id"
+        )
+        authorized_http = self._http()
+        response = None
+        failures = 0
+        while response is None:
+            try:
+                status, response = request.next_chunk(http=authorized_http)
+            except (HttpError, httplib2.HttpLib2Error, OSError) as e:
+                if (
+                    isinstance(e, HttpError)
+                    and e.resp.status not in _RETRYABLE_STATUSES
+                ):
+                    raise
+                failures += 1
+                if failures > self.num_retries:
+                    raise
+                delay = self.backoff * 2 ** (failures - 1)
+                logger.warning(
+                    f"Upload of {song_name} failed ({e}), retrying in {delay:.1f}s."
+                )
+                time.sleep(delay)
+                continue
+            # retries are counted per chunk
+            failures = 0
+            if status is not None:
+                logger.debug(
+                    f"Uploaded {status.resumable_progress}/{status.total_size} bytes of {song_name}"
+                )
+        file_id = response.get("id")
+        metrics.count("gdrive.uploaded_bytes", media.size())
+        logger.info(f"File creation successful -- ID: {file_id}")
+        if self.manifest is not None:
+            self.manifest.add(
+                gdrive_folder_id,
+                {"id": file_id, "name": song_name, "size": size, "md5Checksum": md5},
+            )
+            self.manifest.save()
+        return file_id
+
+    def upload_many(
+        self, gdrive_folder_id: str, songs: List[Tuple[str, str]]
+    ) -> List[Optional[str]]:
+        """Upload many songs to a google drive folder concurrently
+
+        Args:
+            gdrive_folder_id (str): google drive folder id
+            songs (List[Tuple[str, str]]): the (name, local path) of each song
+
+        Returns:
+            List[Optional[str]]: the file id of each upload in the order of songs,
+                None for uploads that failed
+        """
+
+        def upload(song: Tuple[str, str]) -> Optional[str]:
+            song_name, song_path = song
+            try:
+                return self.upload(gdrive_folder_id, song_name, song_path)
+            except Exception:
+                logger.exception(f"Failed to upload {song_path} to google drive.")
+                return None
+
+        # load the credentials and build the service once, before fanning out
+        self.service
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="gdrive-upload"
+        ) as executor:
+            return list(executor.map(upload, songs))
+
+
+_uploaders: Dict[tuple, DriveUploader] = {}
+_uploaders_lock = threading.Lock()
+
+
+@metrics.timed("gdrive.save_song")
+def save_song(
+    gdrive_folder_id: str,
+    credentials_path: str,
+    token_path: str,
+    song_name: str,
+    song_path: str,
+    auth_port: int,
+    bind_addr: Optional[str] = None,
+    manifest_path: Optional[str] = None,
+) -> str:
+    """save a song to google drive
+
+    Credentials and the drive service are kept between calls, see `DriveUploader`.
+
+    Args:
+        gdrive_folder_id (str): google drive folder id
+        credentials_path (str): path to a credentials.json file
+        token_path (str): path to a google cloud token file
+        song_name (str): the name of the song (filename)
+        song_path (str): the path of the song locally
+        auth_port (int): the port to use for oauth
+        bind_addr (Optional[str], optional): optionally specify the bind address, otherwise localhost is used. Defaults to None.
+        manifest_path (Optional[str], optional): path of a `DriveManifest` json file. When given, the
+            song is not uploaded if the folder already holds a file with the same content. Defaults to None.
+
+    Returns:
+        str: the file id of the upload, or of the existing file when the song was already uploaded
+    """
+    key = (credentials_path, token_path, auth_port, bind_addr, manifest_path)
+    with _uploaders_lock:
+        uploader = _uploaders.get(key)
+        if uploader is None:
+            uploader = DriveUploader(
+                credentials_path=credentials_path,
+                token_path=token_path,
+                auth_port=auth_port,
+                bind_addr=bind_addr,
+                manifest=(
+                    None if manifest_path is None else DriveManifest(manifest_path)
+                ),
+            )
+            _uploaders[key] = uploader
+    return uploader.upload(gdrive_folder_id, song_name, song_path)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,22 @@
-from typing import List, Optional, Union
+from typing import Annotated, Any, Dict, Iterator, List, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
 import glob
-from pydantic import ValidationError
+from pydantic import Field, TypeAdapter, ValidationError, WrapValidator
 import requests
 from requests import Response
 import json
 import os, sys
-import eyed3
-from mutagen.mp4 import MP4, MP4Cover
 import logging
+import threading
 
-from . import common
+try:  # faster decoding of api responses, see the orjson extra
+    import orjson
+except ImportError:
+    orjson = None
+
+from . import artwork, cache, common, library, metrics
 from .models import itunes_api, modes
 
 logger = logging.getLogger(__name__)
@@ -19,6 +26,7 @@ def itunes_lib_search(
     itunes_lib_path: str,
     search_parameters: str,
     album_properties: Optional[itunes_api.ItunesApiAlbumKeys] = None,
+    index: Optional[library.LibraryIndex] = None,
 ) -> List[str]:
     """
     Performs a search on users iTunes library by album, artist and genre
@@ -27,35 +35,34 @@ def itunes_lib_search(
         itunes_lib_path (str): path to itunes song library on disk
         search_parameters (str): search term
         album_properties (itunes_api.ItunesApiAlbumKeys): determines whether to do a smarter search based on given album properties
+        index (Optional[library.LibraryIndex]): optional prebuilt index of the library at itunes_lib_path.
+            When given, the search runs against the index instead of globbing the library.
 
     Returns: a list of songpaths found
     """
+    if index is not None:
+        return index.search(search_parameters, album_properties=album_properties)
+
     itunes_songs = glob.glob(
         os.path.join(itunes_lib_path, "*", "*", f"*.*"), recursive=True
     )
+    # the query never changes within the search, so sanitize it only once
+    search_parameters = common.remove_illegal_characters(search_parameters.lower())
+    song_names, album_names, artist_names = _path_search_keys(itunes_songs)
     matches = []
-    for song_path in itunes_songs:
-        # song_name_split is list of itunes file path.. artist is -3 from length, song is -1
-        song_name_split = song_path.split(os.sep)
-        song_name = common.remove_illegal_characters(
-            song_name_split[len(song_name_split) - 1].lower()
-        )
-        album_name = common.remove_illegal_characters(
-            song_name_split[len(song_name_split) - 2].lower()
-        )
-        artist_name = common.remove_illegal_characters(
-            song_name_split[len(song_name_split) - 3].lower()
-        )
-        search_parameters = common.remove_illegal_characters(search_parameters.lower())
-        if album_properties == None:
+    if album_properties == None:
+        for song_path, song_name, album_name, artist_name in zip(
+            itunes_songs, song_names, album_names, artist_names
+        ):
             formatted_name = song_name + " " + album_name + " " + artist_name
             if search_parameters in formatted_name:
                 matches.append(song_path)
-        else:
-            if (
-                album_properties.artistName.lower() in artist_name
-                and search_parameters in song_name
-            ):
+    else:
+        album_artist = album_properties.artistName.lower()
+        for song_path, song_name, artist_name in zip(
+            itunes_songs, song_names, artist_names
+        ):
+            if album_artist in artist_name and search_parameters in song_name:
                 matches.append(song_path)
 
     # returns sorted alphabetical list of matches.
@@ -63,7 +70,173 @@ def itunes_lib_search(
     return matches
 
 
-def m4a_tagger(file_path: str, song_tag_data: itunes_api.ItunesApiSongModel) -> bool:
+def itunes_lib_search_many(
+    itunes_lib_path: str,
+    queries: List[str],
+    album_properties: Optional[itunes_api.ItunesApiAlbumKeys] = None,
+    index: Optional[library.LibraryIndex] = None,
+) -> List[List[str]]:
+    """
+    Performs many searches on users iTunes library in a single pass over the library.
+
+    Every query is matched with the same semantics as `itunes_lib_search`, using an
+    Aho-Corasick automaton so the cost grows with the size of the library plus the
+    total length of the queries, rather than their product.
+
+    Args:
+        itunes_lib_path (str): path to itunes song library on disk
+        queries (List[str]): the search terms
+        album_properties (itunes_api.ItunesApiAlbumKeys): determines whether to do a smarter search based on given album properties
+        index (Optional[library.LibraryIndex]): optional prebuilt index of the library at itunes_lib_path
+
+    Returns:
+        List[List[str]]: for every query, the sorted list of songpaths found
+    """
+    terms = [common.remove_illegal_characters(query.lower()) for query in queries]
+    matcher = library.MultiTermMatcher(terms)
+    matches = [[] for _ in queries]
+    album_artist = (
+        album_properties.artistName.lower() if album_properties is not None else None
+    )
+
+    if index is not None:
+        search_keys = index.search_keys()
+    else:
+        search_keys = _glob_search_keys(itunes_lib_path)
+
+    for song_path, song_name, formatted_name, artist_name in search_keys:
+        if album_artist is None:
+            found = matcher.match(formatted_name)
+        elif album_artist in artist_name:
+            found = matcher.match(song_name)
+        else:
+            continue
+        for query_idx in found:
+            matches[query_idx].append(song_path)
+
+    for query_matches in matches:
+        query_matches.sort()
+    return matches
+
+
+def _path_search_keys(
+    song_paths: List[str],
+) -> Tuple[List[str], List[str], List[str]]:
+    """Compute the sanitized song, album and artist search keys for library paths
+
+    Args:
+        song_paths (List[str]): paths formatted as <itunes_lib_path>/<artist>/<album>/<song>
+
+    Returns:
+        Tuple[List[str], List[str], List[str]]: the song, album and artist keys, aligned with song_paths
+    """
+    # song_name_split is list of itunes file path.. artist is -3 from length, song is -1
+    splits = [song_path.split(os.sep) for song_path in song_paths]
+    song_names = common.sanitize_many([split[-1].lower() for split in splits])
+    album_names = common.sanitize_many([split[-2].lower() for split in splits])
+    artist_names = common.sanitize_many([split[-3].lower() for split in splits])
+    return song_names, album_names, artist_names
+
+
+def _glob_search_keys(itunes_lib_path: str):
+    """yields (path, song key, formatted key, artist key) for every song in the library"""
+    itunes_songs = glob.glob(os.path.join(itunes_lib_path, "*", "*", f"*.*"))
+    song_names, album_names, artist_names = _path_search_keys(itunes_songs)
+    for song_path, song_name, album_name, artist_name in zip(
+        itunes_songs, song_names, album_names, artist_names
+    ):
+        formatted_name = song_name + " " + album_name + " " + artist_name
+        yield song_path, song_name, formatted_name, artist_name
+
+
+@metrics.timed("itunes.write_m4a_tags")
+def _write_m4a_tags(
+    file_path: str,
+    song_tag_data: itunes_api.ItunesApiSongModel,
+    artwork_bytes: Optional[bytes] = None,
+) -> None:
+    """write song_tag_data (and optionally artwork) into the m4a file at file_path"""
+    # the tagging libraries are imported on first use, keeping lookups light
+    from mutagen.mp4 import MP4, MP4Cover
+
+    audiofile = MP4(file_path)
+
+    # Set all the tags for the m4a, all without if statement were checked for existence.
+    audiofile["\xa9ART"] = song_tag_data.artistName
+    audiofile["\xa9alb"] = song_tag_data.collectionName
+    audiofile["\xa9nam"] = song_tag_data.trackName
+    audiofile["\xa9gen"] = song_tag_data.primaryGenreName
+    audiofile["trkn"] = [(song_tag_data.trackNumber, song_tag_data.trackCount)]
+    audiofile["disk"] = [(song_tag_data.discNumber, song_tag_data.discCount)]
+    audiofile["\xa9day"] = song_tag_data.releaseDate
+
+    if (
+        song_tag_data.collectionArtistName is not None
+    ):  # check if collection_artist_name exists before adding to tags
+        audiofile["aART"] = song_tag_data.collectionArtistName
+
+    if artwork_bytes is not None:
+        # mp4 covers can only be tagged as jpeg or png
+        if artwork.detect_mime_type(artwork_bytes) == "image/jpeg":
+            imageformat = MP4Cover.FORMAT_JPEG
+        else:
+            imageformat = MP4Cover.FORMAT_PNG
+        audiofile["covr"] = [MP4Cover(artwork_bytes, imageformat=imageformat)]
+
+    audiofile.save()
+
+
+@metrics.timed("itunes.write_mp3_tags")
+def _write_mp3_tags(
+    mp3_path: str,
+    song_tag_data: itunes_api.ItunesApiSongModel,
+    artwork_bytes: Optional[bytes] = None,
+) -> None:
+    """write song_tag_data (and optionally artwork) into the mp3 file at mp3_path"""
+    import eyed3
+
+    audiofile = eyed3.load(mp3_path)
+    if audiofile.tag is None:  # files without an ID3 tag need one created first
+        audiofile.initTag()
+
+    # Set all the tags for the mp3, all without if statement were checked for existence.
+    audiofile.tag.artist = song_tag_data.artistName
+    audiofile.tag.album = song_tag_data.collectionName
+    audiofile.tag.title = song_tag_data.trackName
+    audiofile.tag.genre = song_tag_data.primaryGenreName
+    audiofile.tag.track_num = (song_tag_data.trackNumber, song_tag_data.trackCount)
+    audiofile.tag.disc_num = (song_tag_data.discNumber, song_tag_data.discCount)
+    audiofile.tag.recording_date = song_tag_data.releaseDate
+
+    if (
+        song_tag_data.collectionArtistName is not None
+    ):  # check if collection_artist_name exists before adding to tags
+        audiofile.tag.album_artist = song_tag_data.collectionArtistName
+
+    if artwork_bytes is not None:
+        audiofile.tag.images.set(
+            type_=3,
+            img_data=artwork_bytes,
+            mime_type=artwork.detect_mime_type(artwork_bytes) or "image/png",
+            description="Art",
+            img_url=None,
+        )
+
+    audiofile.tag.save()
+
+
+_TAG_WRITERS = {
+    ".m4a": _write_m4a_tags,
+    ".mp3": _write_mp3_tags,
+}
+"""tag writer for each supported file extension"""
+
+
+def m4a_tagger(
+    file_path: str,
+    song_tag_data: itunes_api.ItunesApiSongModel,
+    artwork_fetcher: Optional[artwork.ArtworkFetcher] = None,
+) -> bool:
     """Tag an m4a file using iTunes recognized tags.
 
     The below is a tag legend taken from mutagen website.
@@ -86,6 +259,8 @@ def m4a_tagger(file_path: str, song_tag_data: itunes_api.ItunesApiSongModel) ->
     Args:
         file_path (str): path to the m4a file
         song_tag_data (itunes_api.ItunesApiSongModel): The model for the songs relevant metadata collected from itunes search api
+        artwork_fetcher (Optional[artwork.ArtworkFetcher]): fetcher for the album artwork.
+            Defaults to the shared `artwork.default_fetcher`, which caches artwork across tracks.
 
     Returns:
         bool: true if tagging was successful.
@@ -93,29 +268,12 @@ def m4a_tagger(file_path: str, song_tag_data: itunes_api.ItunesApiSongModel) ->
     try:
         logger.info(f"Adding tags to m4a file : {file_path}")
 
-        response = artwork_searcher(url=song_tag_data.artworkUrl100)
-        audiofile = MP4(file_path)
-
-        # Set all the tags for the mp3, all without if statement were checked for existence.
-        audiofile["\xa9ART"] = song_tag_data.artistName
-        audiofile["\xa9alb"] = song_tag_data.collectionName
-        audiofile["\xa9nam"] = song_tag_data.trackName
-        audiofile["\xa9gen"] = song_tag_data.primaryGenreName
-        audiofile["trkn"] = [(song_tag_data.trackNumber, song_tag_data.trackCount)]
-        audiofile["disk"] = [(song_tag_data.discNumber, song_tag_data.discCount)]
-        audiofile["\xa9day"] = song_tag_data.releaseDate
-
-        if (
-            song_tag_data.collectionArtistName is not None
-        ):  # check if collection_artist_name exists before adding to tags
-            audiofile["aART"] = song_tag_data.collectionArtistName
-
-        if response.status_code == 200:
-            audiofile["covr"] = [
-                MP4Cover(response.content, imageformat=MP4Cover.FORMAT_PNG)
-            ]
-
-        audiofile.save()
+        if artwork_fetcher is None:
+            artwork_fetcher = artwork.default_fetcher()
+        artwork_bytes = artwork_fetcher.fetch(
+            song_tag_data.artworkUrl100, song_tag_data.collectionId
+        )
+        _write_m4a_tags(file_path, song_tag_data, artwork_bytes)
         logger.info("Your tags have been set.")
         return True
     except Exception as e:
@@ -125,52 +283,34 @@ def m4a_tagger(file_path: str, song_tag_data: itunes_api.ItunesApiSongModel) ->
         return False
 
 
-def mp3ID3Tagger(mp3_path: str, song_tag_data: itunes_api.ItunesApiSongModel) -> bool:
+def mp3ID3Tagger(
+    mp3_path: str,
+    song_tag_data: itunes_api.ItunesApiSongModel,
+    artwork_fetcher: Optional[artwork.ArtworkFetcher] = None,
+) -> bool:
     """
     Tags an mp3 file at mp3_path given a itunes_api.ItunesApiSongModel object
 
     Args:
         mp3_path (str): file path of mp3 file
         song_tag_data (itunes_api.ItunesApiSongModel): the model with tag fields
+        artwork_fetcher (Optional[artwork.ArtworkFetcher]): fetcher for the album artwork.
+            Defaults to the shared `artwork.default_fetcher`, which caches artwork across tracks.
 
     Returns:
         bool: true if tagging was a success
     """
     try:
-        # Create MP3File instance.
         logger.info(f"Adding your tags to mp3 file: {mp3_path}")
-        # Have to call MP3File twice for it to work.
 
         # Get the image to show for a song .. but get high res
         # get album artwork from the list of sizes
-
-        response = artwork_searcher(url=song_tag_data.artworkUrl100)
-
-        # Set all the tags for the mp3, all without if statement were checked for existence.
-        audiofile = eyed3.load(mp3_path)
-        audiofile.tag.artist = song_tag_data.artistName
-        audiofile.tag.album = song_tag_data.collectionName
-        audiofile.tag.title = song_tag_data.trackName
-        audiofile.tag.genre = song_tag_data.primaryGenreName
-        audiofile.tag.track_num = (song_tag_data.trackNumber, song_tag_data.trackCount)
-        audiofile.tag.disc_num = (song_tag_data.discNumber, song_tag_data.discCount)
-        audiofile.tag.recording_date = song_tag_data.releaseDate
-
-        if (
-            song_tag_data.collectionArtistName is not None
-        ):  # check if collection_artist_name exists before adding to tags
-            audiofile.tag.album_artist = song_tag_data.collectionArtistName
-
-        if response.status_code == 200:
-            audiofile.tag.images.set(
-                type_=3,
-                img_data=response.content,
-                mime_type="image/png",
-                description="Art",
-                img_url=None,
-            )
-
-        audiofile.tag.save()
+        if artwork_fetcher is None:
+            artwork_fetcher = artwork.default_fetcher()
+        artwork_bytes = artwork_fetcher.fetch(
+            song_tag_data.artworkUrl100, song_tag_data.collectionId
+        )
+        _write_mp3_tags(mp3_path, song_tag_data, artwork_bytes)
         logger.info("Your tags have been set.")
         return True
 
@@ -187,17 +327,7 @@ def m4aID3TaggerNoArtwork(
     """Tag an m4a file with metadata only — no artwork fetch."""
     try:
         logger.info(f"Adding tags (no artwork) to m4a file: {file_path}")
-        audiofile = MP4(file_path)
-        audiofile["\xa9ART"] = song_tag_data.artistName
-        audiofile["\xa9alb"] = song_tag_data.collectionName
-        audiofile["\xa9nam"] = song_tag_data.trackName
-        audiofile["\xa9gen"] = song_tag_data.primaryGenreName
-        audiofile["trkn"] = [(song_tag_data.trackNumber, song_tag_data.trackCount)]
-        audiofile["disk"] = [(song_tag_data.discNumber, song_tag_data.discCount)]
-        audiofile["\xa9day"] = song_tag_data.releaseDate
-        if song_tag_data.collectionArtistName is not None:
-            audiofile["aART"] = song_tag_data.collectionArtistName
-        audiofile.save()
+        _write_m4a_tags(file_path, song_tag_data)
         logger.info("Your tags have been set.")
         return True
     except Exception as e:
@@ -213,17 +343,7 @@ def mp3ID3TaggerNoArtwork(
     """Tag an mp3 file with metadata only — no artwork fetch."""
     try:
         logger.info(f"Adding tags (no artwork) to mp3 file: {mp3_path}")
-        audiofile = eyed3.load(mp3_path)
-        audiofile.tag.artist = song_tag_data.artistName
-        audiofile.tag.album = song_tag_data.collectionName
-        audiofile.tag.title = song_tag_data.trackName
-        audiofile.tag.genre = song_tag_data.primaryGenreName
-        audiofile.tag.track_num = (song_tag_data.trackNumber, song_tag_data.trackCount)
-        audiofile.tag.disc_num = (song_tag_data.discNumber, song_tag_data.discCount)
-        audiofile.tag.recording_date = song_tag_data.releaseDate
-        if song_tag_data.collectionArtistName is not None:
-            audiofile.tag.album_artist = song_tag_data.collectionArtistName
-        audiofile.tag.save()
+        _write_mp3_tags(mp3_path, song_tag_data)
         logger.info("Your tags have been set.")
         return True
     except Exception as e:
@@ -233,6 +353,69 @@ def mp3ID3TaggerNoArtwork(
         return False
 
 
+@metrics.timed("itunes.tag_album")
+def tag_album(
+    file_paths: List[str],
+    song_tag_data: List[itunes_api.ItunesApiSongModel],
+    artwork_fetcher: Optional[artwork.ArtworkFetcher] = None,
+    embed_artwork: bool = True,
+    max_workers: int = 4,
+) -> List[bool]:
+    """Tag every file of an album.
+
+    The artwork of the album is fetched once up front and shared by every
+    track, then the files are tagged on a bounded thread pool. The tagging
+    backend is picked from each file's extension (.mp3 or .m4a).
+
+    Args:
+        file_paths (List[str]): paths of the files to tag
+        song_tag_data (List[itunes_api.ItunesApiSongModel]): the tags of each file, aligned with file_paths
+        artwork_fetcher (Optional[artwork.ArtworkFetcher]): fetcher for the album artwork.
+            Defaults to the shared `artwork.default_fetcher`.
+        embed_artwork (bool): set to False to only write metadata. Defaults to True.
+        max_workers (int): maximum number of files tagged at once. Defaults to 4.
+
+    Returns:
+        List[bool]: for every file, true if tagging was successful
+    """
+    if len(file_paths) != len(song_tag_data):
+        raise ValueError(
+            f"Got {len(file_paths)} files but tags for {len(song_tag_data)} files."
+        )
+
+    covers = {}
+    if embed_artwork:
+        if artwork_fetcher is None:
+            artwork_fetcher = artwork.default_fetcher()
+        for tags in song_tag_data:
+            cover_key = (tags.artworkUrl100, tags.collectionId)
+            if cover_key not in covers:
+                covers[cover_key] = artwork_fetcher.fetch(*cover_key)
+
+    def tag_file(file_path: str, tags: itunes_api.ItunesApiSongModel) -> bool:
+        extension = os.path.splitext(file_path)[1].lower()
+        writer = _TAG_WRITERS.get(extension)
+        if writer is None:
+            logger.error(f"Can not tag {file_path}, unsupported format {extension}")
+            return False
+        try:
+            writer(file_path, tags, covers.get((tags.artworkUrl100, tags.collectionId)))
+            return True
+        except Exception as e:
+            logger.exception(
+                f"Unexpected error occured while trying to tag {file_path}: {e}"
+            )
+            return False
+
+    logger.info(f"Adding tags to {len(file_paths)} files")
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="tagger"
+    ) as executor:
+        results = list(executor.map(tag_file, file_paths, song_tag_data))
+    logger.info(f"Tagged {sum(results)}/{len(results)} files.")
+    return results
+
+
 def mp3_tag_reader(
     mp3_path: str,
 ) -> tuple[Optional[itunes_api.ItunesApiSongModel], Optional[bytes]]:
@@ -241,6 +424,8 @@ def mp3_tag_reader(
     Returns:
         (ItunesApiSongModel or None, artwork bytes or None)
     """
+    import eyed3
+
     try:
         audiofile = eyed3.load(mp3_path)
         if audiofile is None or audiofile.tag is None:
@@ -278,6 +463,8 @@ def m4a_tag_reader(
     Returns:
         (ItunesApiSongModel or None, artwork bytes or None)
     """
+    from mutagen.mp4 import MP4
+
     try:
         audiofile = MP4(m4a_path)
         tags = audiofile.tags or {}
@@ -309,41 +496,121 @@ def m4a_tag_reader(
         return None, None
 
 
-def query_api(
-    search_variable: str, limit: int, mode: modes.Modes, lookup: bool = False
-) -> List[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]:
-    """
-    Args:
-        search_variable (str): the term to search itunes api for
-        limit  (int): limit of the search in the api
-        mode (modes.Modes): value of album, or song for now
-        lookup (bool): if true, perform a lookup search via itunes api rather than a default search
-    Returns
-        List[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]: a list containing a
-            tuple with itunes song properties and album properties
+ITUNES_API_URL = "https://itunes.apple.com"
+"""base url of the itunes search api"""
+MAX_PAGE_SIZE = 200
+"""most results the itunes api returns for one request, whatever its limit"""
+
+
+def _api_request(
+    search_variable: str, limit: int, mode: modes.Modes, lookup: bool
+) -> Tuple[str, dict]:
+    """Build the endpoint and query parameters for an itunes api request
+
+    Returns:
+        Tuple[str, dict]: the endpoint path and the query parameters
     """
-    parsed_results_list = []
-    result_dict = {}
     if not lookup:  # perform general search
-        search_parameters = {
+        return "/search", {
             "term": search_variable,
             "entity": mode.value,
             "limit": limit,
         }
-        itunes_response = requests.get(
-            "https://itunes.apple.com/search", params=search_parameters
-        )
-    else:  # perform lookup query by itunes id
-        search_parameters = {
-            "id": search_variable,
-            "entity": mode.value,
-            "limit": limit,
-        }
-        itunes_response = requests.get(
-            "https://itunes.apple.com/lookup", params=search_parameters
-        )
+    # perform lookup query by itunes id
+    return "/lookup", {
+        "id": search_variable,
+        "entity": mode.value,
+        "limit": limit,
+    }
+
+
+def _release_year(search_result: dict, handler) -> itunes_api.ItunesApiSongModel:
+    """validate a song, keeping only the year of its release date"""
+    result = handler(search_result)
+    # will grab the year from date formatted 2016-06-01
+    result.releaseDate = search_result[result.releaseDateKey].split("-")[0]
+    return result
+
+
+def _results_adapter(item_type) -> TypeAdapter:
+    """a validator of a list of results, returning the results that are not
+    valid items as they are instead of failing the whole list"""
+    return TypeAdapter(
+        List[Annotated[Union[item_type, Any], Field(union_mode="left_to_right")]]
+    )
+
+
+_SongWithYear = Annotated[itunes_api.ItunesApiSongModel, WrapValidator(_release_year)]
+_RESULT_ADAPTERS: Dict[modes.Modes, Tuple[type, TypeAdapter, TypeAdapter]] = {
+    modes.Modes.SONG: (
+        itunes_api.ItunesApiSongModel,
+        TypeAdapter(_SongWithYear),
+        _results_adapter(_SongWithYear),
+    ),
+    modes.Modes.ALBUM: (
+        itunes_api.ItunesApiAlbumKeys,
+        TypeAdapter(itunes_api.ItunesApiAlbumKeys),
+        _results_adapter(itunes_api.ItunesApiAlbumKeys),
+    ),
+}
+"""model, validator of a single result and validator of a list of results, by mode"""
+
+
+def parse_api_response(
+    itunes_json_dict: dict, mode: modes.Modes
+) -> List[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]:
+    """Parse the json body of an itunes api response, skipping any results that
+    do not fit the expected model.
+
+    All the results are validated in a single call, only the invalid ones are
+    validated again one by one to log why they were skipped.
+
+    Args:
+        itunes_json_dict (dict): the decoded json body of the response
+        mode (modes.Modes): value of album, or song for now
+
+    Returns:
+        List[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]: the parsed results
+    """
+    model, item_adapter, results_adapter = _RESULT_ADAPTERS[mode]
+    parsed_results_list = []
+    for index, result in enumerate(
+        results_adapter.validate_python(itunes_json_dict["results"])
+    ):
+        if not isinstance(result, model):
+            try:
+                result = item_adapter.validate_python(result)
+            except ValidationError as e:
+                logger.warning(
+                    f"Skipping the display of song at index [{index}] as it could not be loaded into expected format.\n{e}"
+                )
+                continue
+        parsed_results_list.append(result)
+
+    return parsed_results_list
+
+
+def _loads(content: bytes):
+    """decode a json body, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
 
-    # itunesResponse = requests.get('https://itunes.apple.com/search?term=jack+johnson')
+
+def _parse_response(
+    itunes_response: Response, mode: modes.Modes
+) -> Optional[
+    List[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]
+]:
+    """check the status of an itunes api response and parse its body"""
+    body = _decode_response(itunes_response)
+    if body is None:
+        return None
+    return parse_api_response(body, mode)
+
+
+def _decode_response(itunes_response: Response) -> Optional[dict]:
+    """check the status of an itunes api response and decode its json body"""
     logger.info(f"Connected to {itunes_response.url}")
     if itunes_response.status_code != 200:
         logger.error(
@@ -354,58 +621,368 @@ def query_api(
         )
         return None
 
-    itunes_json_dict = json.loads(itunes_response.content)
-    for index, search_result in enumerate(itunes_json_dict["results"]):
-        try:
-            if mode == modes.Modes.SONG:
-                result = itunes_api.ItunesApiSongModel.model_validate(search_result)
-                year = search_result[result.releaseDateKey].split("-")[
-                    0
-                ]  # will grab the year from date formatted 2016-06-01
-                result.releaseDate = year
-            elif mode == modes.Modes.ALBUM:
-                result = itunes_api.ItunesApiAlbumKeys.model_validate(search_result)
-
-            parsed_results_list.append(result)
-        except ValidationError as e:
-            logger.warning(
-                f"Skipping the display of song at index [{index}] as it could not be loaded into expected format.\n{e}"
+    return _loads(itunes_response.content)
+
+
+def pooled_session(pool_size: int = 10) -> requests.Session:
+    """Create a requests session keeping up to pool_size connections alive per host
+
+    Args:
+        pool_size (int, optional): maximum number of pooled connections per host. Defaults to 10.
+
+    Returns:
+        requests.Session: the session
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def query_api(
+    search_variable: str,
+    limit: int,
+    mode: modes.Modes,
+    lookup: bool = False,
+    base_url: str = ITUNES_API_URL,
+    session: Optional[requests.Session] = None,
+    response_cache: Optional[cache.ResponseCache] = None,
+) -> List[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]:
+    """
+    Args:
+        search_variable (str): the term to search itunes api for
+        limit  (int): limit of the search in the api
+        mode (modes.Modes): value of album, or song for now
+        lookup (bool): if true, perform a lookup search via itunes api rather than a default search
+        base_url (str): base url of the itunes api. Defaults to ITUNES_API_URL.
+        session (Optional[requests.Session]): optional session to reuse connections across calls
+        response_cache (Optional[cache.ResponseCache]): optional cache of parsed results.
+            A hit skips both the request and validation.
+    Returns
+        List[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]: a list containing a
+            tuple with itunes song properties and album properties
+    """
+    endpoint, search_parameters = _api_request(search_variable, limit, mode, lookup)
+    url = base_url.rstrip("/") + endpoint
+    with metrics.span("itunes.query_api", endpoint=endpoint) as span:
+        if response_cache is not None:
+            key = cache.cache_key(url, search_parameters)
+            cached = response_cache.get(key)
+            metrics.count("itunes.cache", result="miss" if cached is None else "hit")
+            if cached is not None:
+                span.set_attribute("cached", True)
+                logger.info(
+                    f"Loaded {len(cached)} cached results for {search_parameters}"
+                )
+                return cached
+
+        get = session.get if session is not None else requests.get
+        itunes_response = get(url, params=search_parameters)
+        span.set_attribute("status_code", itunes_response.status_code)
+        results = _parse_response(itunes_response, mode)
+        if response_cache is not None and results is not None:
+            response_cache.set(key, results)
+        return results
+
+
+_default_session: Optional[requests.Session] = None
+_default_session_lock = threading.Lock()
+
+
+def default_session() -> requests.Session:
+    """Get the process wide pooled session used by `iter_query_api` when none is given
+
+    Returns:
+        requests.Session: the shared session, see `pooled_session`
+    """
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = pooled_session()
+        return _default_session
+
+
+def _query_page(get, url: str, endpoint: str, params: dict, mode: modes.Modes) -> Tuple[
+    Optional[List[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]],
+    List[dict],
+]:
+    """request one page of results
+
+    Returns:
+        the parsed results of the page, or None if the request failed, and its raw results
+    """
+    with metrics.span(
+        "itunes.query_api", endpoint=endpoint, offset=params["offset"]
+    ) as span:
+        itunes_response = get(url + endpoint, params=params)
+        span.set_attribute("status_code", itunes_response.status_code)
+        body = _decode_response(itunes_response)
+        if body is None:
+            return None, []
+        return parse_api_response(body, mode), body["results"]
+
+
+def iter_query_api(
+    search_variable: str,
+    mode: modes.Modes,
+    lookup: bool = False,
+    page_size: int = 50,
+    max_results: Optional[int] = None,
+    base_url: str = ITUNES_API_URL,
+    session: Optional[requests.Session] = None,
+    prefetch: bool = True,
+) -> Iterator[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]:
+    """Iterate over the results of an itunes api query, requesting them page by page
+
+    Unlike `query_api`, results are not capped by a single request's limit and only
+    the current and next pages are held in memory. While the caller consumes a page,
+    the next one is requested in the background. Breaking out of the loop stops the
+    requests, the page in flight is discarded.
+
+    Pages are requested with the limit and offset parameters of the api. Results that
+    do not fit the expected model are skipped, as in `query_api`. Iteration stops at
+    the first page that is not full, or that failed.
+
+    Example:
+        ```python
+        for album in iter_query_api(artist_id, modes.Modes.ALBUM, lookup=True):
+            ...
+        ```
+
+    Args:
+        search_variable (str): the term to search itunes api for
+        mode (modes.Modes): value of album, or song for now
+        lookup (bool, optional): if true, perform a lookup search via itunes api rather than a default search. Defaults to False.
+        page_size (int, optional): number of results requested at a time. Larger values than
+            MAX_PAGE_SIZE, the most the api returns at once, are lowered to it. Defaults to 50.
+        max_results (Optional[int], optional): maximum number of results requested in total. Defaults to None, no maximum.
+        base_url (str, optional): base url of the itunes api. Defaults to ITUNES_API_URL.
+        session (Optional[requests.Session], optional): session the pages are requested with. Defaults to
+            None, the process wide `default_session`.
+        prefetch (bool, optional): whether to request the next page while the current one is consumed. Defaults to True.
+
+    Yields:
+        Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]: the parsed results
+    """
+    if page_size < 1:
+        raise ValueError(f"page_size must be positive, got {page_size}")
+    # a page larger than the api returns would look like the last one
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    get = (session or default_session()).get
+
+    def page_request(offset: int) -> Optional[Tuple[str, dict]]:
+        limit = page_size
+        if max_results is not None:
+            limit = min(limit, max_results - offset)
+            if limit <= 0:
+                return None
+        endpoint, params = _api_request(search_variable, limit, mode, lookup)
+        params["offset"] = offset
+        return endpoint, params
+
+    executor = None
+    next_page = None
+    try:
+        offset = 0
+        request = page_request(offset)
+        previous_last = None
+        while request is not None:
+            limit = request[1]["limit"]
+            if next_page is None:
+                results, raw_results = _query_page(get, base_url, *request, mode)
+            else:
+                results, raw_results = next_page.result()
+                next_page = None
+            if results is None:
+                return
+            if raw_results and raw_results[-1] == previous_last:
+                logger.warning(
+                    f"Stopping at offset {offset}, the api returned the previous page again"
+                )
+                return
+            previous_last = raw_results[-1] if raw_results else None
+
+            # lookups also return the looked up artist or album, so a full
+            # page may hold one more result than its limit
+            offset += limit
+            request = page_request(offset) if len(raw_results) >= limit else None
+            if request is not None and prefetch:
+                if executor is None:
+                    executor = ThreadPoolExecutor(
+                        max_workers=1, thread_name_prefix="itunes-api-prefetch"
+                    )
+                # in the caller's context, so the page's span keeps its parent
+                next_page = executor.submit(
+                    contextvars.copy_context().run,
+                    _query_page,
+                    get,
+                    base_url,
+                    *request,
+                    mode,
+                )
+            yield from results
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+class AsyncItunesClient:
+    """asyncio client for the itunes search api.
+
+    All requests share one pooled keep-alive session and run on a dedicated
+    thread pool, with at most `concurrency` requests in flight at once.
+    Responses are parsed exactly like `query_api`, so results that do not
+    fit the expected model are skipped.
+
+    Example:
+        ```python
+        async with AsyncItunesClient(concurrency=16) as client:
+            albums = await client.query_many(ids, limit=200, mode=modes.Modes.SONG, lookup=True)
+        ```
+    """
+
+    def __init__(
+        self,
+        base_url: str = ITUNES_API_URL,
+        concurrency: int = 8,
+        timeout: Optional[float] = 10,
+        response_cache: Optional[cache.ResponseCache] = None,
+    ):
+        """
+        Args:
+            base_url (str, optional): base url of the itunes api. Defaults to ITUNES_API_URL.
+            concurrency (int, optional): maximum number of requests in flight. Defaults to 8.
+            timeout (Optional[float], optional): timeout of each request in seconds. Defaults to 10.
+            response_cache (Optional[cache.ResponseCache], optional): optional cache of parsed results.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.response_cache = response_cache
+        self.session = pooled_session(concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="itunes-api"
+        )
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def _get(self, endpoint: str, params: dict) -> Response:
+        return self.session.get(
+            self.base_url + endpoint, params=params, timeout=self.timeout
+        )
+
+    async def query(
+        self,
+        search_variable: str,
+        limit: int,
+        mode: modes.Modes,
+        lookup: bool = False,
+    ) -> Optional[
+        List[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]
+    ]:
+        """Query the itunes api, see `query_api`
+
+        Returns:
+            Optional[List[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]]: the
+                parsed results, or None if the request failed
+        """
+        endpoint, params = _api_request(search_variable, limit, mode, lookup)
+        with metrics.span("itunes.query_api", endpoint=endpoint) as span:
+            if self.response_cache is not None:
+                key = cache.cache_key(self.base_url + endpoint, params)
+                cached = self.response_cache.get(key)
+                metrics.count(
+                    "itunes.cache", result="miss" if cached is None else "hit"
+                )
+                if cached is not None:
+                    span.set_attribute("cached", True)
+                    return cached
+
+            loop = asyncio.get_running_loop()
+            async with self._semaphore:
+                try:
+                    itunes_response = await loop.run_in_executor(
+                        self._executor, self._get, endpoint, params
+                    )
+                except requests.exceptions.RequestException as e:
+                    logger.error(
+                        f"Error submitting request to: {self.base_url}{endpoint}"
+                    )
+                    logger.error(e)
+                    span.set_attribute("error", repr(e))
+                    return None
+            span.set_attribute("status_code", itunes_response.status_code)
+            results = _parse_response(itunes_response, mode)
+            if self.response_cache is not None and results is not None:
+                self.response_cache.set(key, results)
+            return results
+
+    async def query_many(
+        self,
+        search_variables: List[str],
+        limit: int,
+        mode: modes.Modes,
+        lookup: bool = False,
+    ) -> List[
+        Optional[
+            List[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]
+        ]
+    ]:
+        """Run many queries concurrently, bounded by the client's concurrency
+
+        Args:
+            search_variables (List[str]): the terms (or ids, when lookup is set) to query
+            limit (int): limit of each search in the api
+            mode (modes.Modes): value of album, or song for now
+            lookup (bool, optional): if true, perform lookup queries by itunes id. Defaults to False.
+
+        Returns:
+            List[Optional[List[Union[itunes_api.ItunesApiSongModel, itunes_api.ItunesApiAlbumKeys]]]]: the
+                results of each query, in the order of search_variables
+        """
+        return await asyncio.gather(
+            *(
+                self.query(search_variable, limit, mode, lookup)
+                for search_variable in search_variables
             )
+        )
 
-    return parsed_results_list
+    def close(self):
+        """Release the pooled connections and worker threads"""
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    async def __aenter__(self) -> "AsyncItunesClient":
+        return self
 
+    async def __aexit__(self, *exc_info):
+        self.close()
 
-def artwork_searcher(url: str) -> Optional[Response]:
+
+@metrics.timed("artwork.search")
+def artwork_searcher(
+    url: str, artwork_fetcher: Optional[artwork.ArtworkFetcher] = None
+) -> Optional[Response]:
     """Album artwork searcher.
 
+    Every artwork size is probed concurrently and only the largest available
+    size is downloaded. Prefer `artwork.ArtworkFetcher.fetch`, which also caches the artwork.
+
     Args:
         url (str): the url for the artwork
+        artwork_fetcher (Optional[artwork.ArtworkFetcher]): the fetcher used to probe sizes.
+            Defaults to the shared `artwork.default_fetcher`.
 
     Returns:
-        Response: the response for the artwork request
+        Response: the response for the artwork request, or None if no artwork was found
     """
-    artwork_size_list = [
-        "100x100",
-        "500x500",
-        "1000x1000",
-        "1500x1500",
-        "2000x2000",
-        "2500x2500",
-        "3000x3000",
-    ]
-    i = len(artwork_size_list) - 1
-
-    response = requests.get(url.replace("100x100", artwork_size_list[i]))
-    while response.status_code != 200 and i != 0:
-        logger.info(f"- Size not found -- Trying size: {artwork_size_list[i]}")
-        response = requests.get(url.replace("100x100", artwork_size_list[i]))
-        i -= 1
-
-    if i == 0:
-        logger.info("Couldnt find album art. Your file wont have the art.")
+    if artwork_fetcher is None:
+        artwork_fetcher = artwork.default_fetcher()
+    artwork_url = artwork_fetcher.find_url(url)
+    if artwork_url is None:
         return None
-
-    else:
-        logger.info(f"Found art at size: {artwork_size_list[i]}")
-
-    return response
+    return artwork_fetcher.session.get(artwork_url, timeout=artwork_fetcher.timeout)
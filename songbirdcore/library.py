@@ -0,0 +1,431 @@
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+from bisect import bisect_right
+from collections import deque
+import json
+import logging
+import os
+
+from . import common
+from .models import itunes_api
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+"""version of the on-disk index format, bumped whenever the layout changes"""
+
+_KEY_SEPARATOR = "\x00"
+"""separator used to join search keys, can not appear in a path on disk"""
+
+
+class LibraryEntry(NamedTuple):
+    """A single track stored in a `LibraryIndex`"""
+
+    path: str
+    """full path to the track on disk"""
+    artist: str
+    """artist folder name"""
+    album: str
+    """album folder name"""
+    track: str
+    """track file name"""
+    size: int
+    """size of the track in bytes, as of the last refresh of its album"""
+    mtime_ns: int
+    """modification time of the track, as of the last refresh of its album"""
+
+
+def _stat_mtime_ns(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _list_dirs(path: str) -> List[str]:
+    """lists the non hidden sub directories of path, mirroring glob's '*' semantics"""
+    try:
+        with os.scandir(path) as it:
+            return [
+                entry.name
+                for entry in it
+                if not entry.name.startswith(".") and entry.is_dir()
+            ]
+    except OSError:
+        return []
+
+
+def _list_tracks(path: str) -> List[list]:
+    """lists the entries of an album folder matching glob's '*.*' semantics
+
+    Returns:
+        List[list]: [name, size, mtime_ns] for every track
+    """
+    tracks = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith(".") or "." not in entry.name:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                tracks.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    except OSError:
+        pass
+    return tracks
+
+
+class MultiTermMatcher:
+    """Aho-Corasick automaton matching many search terms against a text in a
+    single pass, so the cost scales with the length of the text plus the total
+    length of the terms rather than their product.
+    """
+
+    def __init__(self, terms: List[str]):
+        """
+        Args:
+            terms (List[str]): the terms to search for. Terms are identified by their index in this list.
+        """
+        self.terms = terms
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        out: List[List[int]] = [[]]
+        # the empty term is contained in every text
+        self._always = tuple(idx for idx, term in enumerate(terms) if term == "")
+
+        for idx, term in enumerate(terms):
+            if term == "":
+                continue
+            state = 0
+            for ch in term:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    out.append([])
+                    self._goto[state][ch] = nxt
+                state = nxt
+            out[state].append(idx)
+
+        # breadth first construction of the failure links
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                out[nxt].extend(out[self._fail[nxt]])
+        self._out = [tuple(ids) for ids in out]
+
+    def match(self, text: str) -> Set[int]:
+        """Find the terms contained in text
+
+        Args:
+            text (str): the text to search
+
+        Returns:
+            Set[int]: the indices of every term found in text
+        """
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set(self._always)
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class LibraryIndex:
+    """Persistent index of an itunes library laid out on disk as
+    `<itunes_lib_path>/<artist>/<album>/<track>`.
+
+    The index is built once by walking the library and is then kept up to date
+    with `refresh`, which only re-lists the folders whose modification time
+    changed since the last refresh. Searches run against precomputed,
+    sanitized search keys so no disk access happens at query time.
+
+    Note that modifying a track in place (for example retagging it) does not
+    change its folder's modification time, so the size and mtime of a track
+    are only as recent as the last change to its album folder.
+    """
+
+    def __init__(self, itunes_lib_path: str, index_path: Optional[str] = None):
+        """
+        Args:
+            itunes_lib_path (str): path to itunes song library on disk
+            index_path (Optional[str], optional): path of the file the index is persisted to.
+                If None, the index only lives in memory.
+        """
+        self.itunes_lib_path = itunes_lib_path
+        self.index_path = index_path
+        self.root_mtime_ns: Optional[int] = None
+        # artist folder -> mtime_ns of the folder
+        self.artists: Dict[str, int] = {}
+        # (artist folder, album folder) -> [mtime_ns, [[track, size, mtime_ns], ...]]
+        self.albums: Dict[Tuple[str, str], list] = {}
+        self._keys_stale = True
+
+    @classmethod
+    def open(
+        cls, itunes_lib_path: str, index_path: str, save: bool = True
+    ) -> "LibraryIndex":
+        """Load the index persisted at index_path, then bring it up to date with the library.
+
+        Args:
+            itunes_lib_path (str): path to itunes song library on disk
+            index_path (str): path to the persisted index. Created if it does not exist.
+            save (bool, optional): persist the index if the refresh found changes. Defaults to True.
+
+        Returns:
+            LibraryIndex: the refreshed index
+        """
+        index = cls(itunes_lib_path, index_path)
+        index.load()
+        if index.refresh() and save:
+            index.save()
+        return index
+
+    def load(self) -> bool:
+        """Load the index from `index_path`.
+
+        Returns:
+            bool: True if a compatible index was loaded, False if the index
+                is missing, unreadable or was built for another library.
+        """
+        if self.index_path is None or not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read library index {self.index_path}: {e}")
+            return False
+
+        if data.get("version") != INDEX_VERSION or data.get(
+            "itunes_lib_path"
+        ) != os.path.abspath(self.itunes_lib_path):
+            logger.info(f"Ignoring outdated library index at {self.index_path}")
+            return False
+
+        self.root_mtime_ns = data["root_mtime_ns"]
+        self.artists = data["artists"]
+        self.albums = {
+            (artist, album): [mtime_ns, tracks]
+            for artist, album, mtime_ns, tracks in data["albums"]
+        }
+        self._keys_stale = True
+        return True
+
+    def save(self) -> None:
+        """Atomically persist the index to `index_path`."""
+        if self.index_path is None:
+            raise ValueError("Can not save a library index without an index_path.")
+        data = {
+            "version": INDEX_VERSION,
+            "itunes_lib_path": os.path.abspath(self.itunes_lib_path),
+            "root_mtime_ns": self.root_mtime_ns,
+            "artists": self.artists,
+            "albums": [
+                [artist, album, mtime_ns, tracks]
+                for (artist, album), (mtime_ns, tracks) in self.albums.items()
+            ],
+        }
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.index_path)
+        logger.debug(f"Saved library index to {self.index_path}")
+
+    def refresh(self) -> bool:
+        """Bring the index up to date with the library on disk.
+
+        Folders are only re-listed when their modification time changed, so a
+        refresh costs one stat per artist and album folder when nothing changed.
+
+        Returns:
+            bool: True if the index changed
+        """
+        changed = False
+        root_mtime_ns = _stat_mtime_ns(self.itunes_lib_path)
+        if root_mtime_ns != self.root_mtime_ns:
+            artist_names = set(_list_dirs(self.itunes_lib_path))
+            for artist in list(self.artists):
+                if artist not in artist_names:
+                    self._drop_artist(artist)
+            for artist in artist_names:
+                self.artists.setdefault(artist, None)
+            self.root_mtime_ns = root_mtime_ns
+            changed = True
+
+        for artist, known_mtime_ns in list(self.artists.items()):
+            artist_path = os.path.join(self.itunes_lib_path, artist)
+            mtime_ns = _stat_mtime_ns(artist_path)
+            if mtime_ns == known_mtime_ns:
+                continue
+            album_names = set(_list_dirs(artist_path))
+            for key in [key for key in self.albums if key[0] == artist]:
+                if key[1] not in album_names:
+                    del self.albums[key]
+            for album in album_names:
+                self.albums.setdefault((artist, album), [None, []])
+            self.artists[artist] = mtime_ns
+            changed = True
+
+        for (artist, album), album_data in self.albums.items():
+            album_path = os.path.join(self.itunes_lib_path, artist, album)
+            mtime_ns = _stat_mtime_ns(album_path)
+            if mtime_ns == album_data[0]:
+                continue
+            album_data[0] = mtime_ns
+            album_data[1] = _list_tracks(album_path)
+            changed = True
+
+        if changed:
+            self._keys_stale = True
+            logger.debug(f"Refreshed library index for {self.itunes_lib_path}")
+        return changed
+
+    def _drop_artist(self, artist: str) -> None:
+        del self.artists[artist]
+        for key in [key for key in self.albums if key[0] == artist]:
+            del self.albums[key]
+
+    def __len__(self) -> int:
+        return sum(len(tracks) for _, tracks in self.albums.values())
+
+    def entries(self) -> Iterator[LibraryEntry]:
+        """Iterate over every track in the index
+
+        Yields:
+            LibraryEntry: the indexed tracks
+        """
+        for (artist, album), (_, tracks) in self.albums.items():
+            for track, size, mtime_ns in tracks:
+                yield LibraryEntry(
+                    os.path.join(self.itunes_lib_path, artist, album, track),
+                    artist,
+                    album,
+                    track,
+                    size,
+                    mtime_ns,
+                )
+
+    def _build_keys(self) -> None:
+        """precompute the sanitized search keys used by `search`"""
+        paths = []
+        tracks = []
+        albums = []
+        artists = []
+        for (artist, album), (_, album_tracks) in self.albums.items():
+            for track, _, _ in album_tracks:
+                paths.append(os.path.join(self.itunes_lib_path, artist, album, track))
+                tracks.append(track.lower())
+                albums.append(album.lower())
+                artists.append(artist.lower())
+        song_keys = common.sanitize_many(tracks)
+        album_keys = common.sanitize_many(albums)
+        artist_keys = common.sanitize_many(artists)
+        formatted_keys = [
+            song_key + " " + album_key + " " + artist_key
+            for song_key, album_key, artist_key in zip(
+                song_keys, album_keys, artist_keys
+            )
+        ]
+
+        self._paths = paths
+        self._artist_keys = artist_keys
+        self._song_blob, self._song_starts = self._join_keys(song_keys)
+        self._formatted_blob, self._formatted_starts = self._join_keys(formatted_keys)
+        self._keys_stale = False
+
+    @staticmethod
+    def _join_keys(keys: List[str]) -> Tuple[str, List[int]]:
+        starts = []
+        offset = 0
+        for key in keys:
+            starts.append(offset)
+            offset += len(key) + len(_KEY_SEPARATOR)
+        return _KEY_SEPARATOR.join(keys), starts
+
+    def search_keys(self) -> Iterator[Tuple[str, str, str, str]]:
+        """Iterate over the precomputed search keys of every track
+
+        Yields:
+            Tuple[str, str, str, str]: the track path, its song key, its formatted
+                'song album artist' key and its artist key
+        """
+        if self._keys_stale:
+            self._build_keys()
+        song_blob, song_starts = self._song_blob, self._song_starts
+        formatted_blob, formatted_starts = self._formatted_blob, self._formatted_starts
+        n = len(self._paths)
+        for idx in range(n):
+            song_end = song_starts[idx + 1] - 1 if idx + 1 < n else len(song_blob)
+            formatted_end = (
+                formatted_starts[idx + 1] - 1 if idx + 1 < n else len(formatted_blob)
+            )
+            yield (
+                self._paths[idx],
+                song_blob[song_starts[idx] : song_end],
+                formatted_blob[formatted_starts[idx] : formatted_end],
+                self._artist_keys[idx],
+            )
+
+    def _find(self, blob: str, starts: List[int], term: str) -> Iterator[int]:
+        """yields the index of every key in blob containing term"""
+        n = len(starts)
+        pos = 0
+        while n:
+            pos = blob.find(term, pos)
+            if pos == -1:
+                return
+            idx = bisect_right(starts, pos) - 1
+            yield idx
+            if idx + 1 >= n:
+                return
+            pos = starts[idx + 1]
+
+    def search(
+        self,
+        search_parameters: str,
+        album_properties: Optional[itunes_api.ItunesApiAlbumKeys] = None,
+    ) -> List[str]:
+        """Search the index, with the same semantics as `itunes.itunes_lib_search`.
+
+        Args:
+            search_parameters (str): search term
+            album_properties (itunes_api.ItunesApiAlbumKeys): determines whether to do a smarter search based on given album properties
+
+        Returns:
+            List[str]: sorted list of song paths found
+        """
+        if self._keys_stale:
+            self._build_keys()
+        term = common.remove_illegal_characters(search_parameters.lower())
+        if _KEY_SEPARATOR in term:
+            return []
+
+        if album_properties is None:
+            matches = [
+                self._paths[idx]
+                for idx in self._find(
+                    self._formatted_blob, self._formatted_starts, term
+                )
+            ]
+        else:
+            artist = album_properties.artistName.lower()
+            matches = [
+                self._paths[idx]
+                for idx in self._find(self._song_blob, self._song_starts, term)
+                if artist in self._artist_keys[idx]
+            ]
+        matches.sort()
+        return matches
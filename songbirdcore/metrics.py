@@ -0,0 +1,466 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from contextvars import ContextVar
+import functools
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> _Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class _NoopSpan:
+    """span of the no-op instrumentation, shared by every call"""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_error(self, error: str) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Instrumentation:
+    """Instrumentation surface of songbirdcore, recording nothing.
+
+    Network and disk stages report to the active instrumentation, see
+    `set_instrumentation`, through three primitives:
+
+    - spans time a stage and nest, like `with span("itunes.query_api"): ...`
+    - counters add up events, like the number of bytes uploaded
+    - timers observe durations in seconds
+
+    Subclasses override the primitives to record them. This base class is
+    the default and costs a function call per stage.
+    """
+
+    def span(self, name: str, **attributes: Any):
+        """Time a stage, used as a context manager yielding an object with a set_attribute(key, value)
+        method, and a set_error(error) method marking a stage that failed without raising
+
+        Args:
+            name (str): the name of the stage, such as "itunes.query_api"
+            **attributes: attributes describing this run of the stage
+        """
+        return _NOOP_SPAN
+
+    def count(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Add value to a counter
+
+        Args:
+            name (str): the name of the counter
+            value (float, optional): the amount added. Defaults to 1.
+            **labels: labels of the counter
+        """
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        """Record a duration in a timer
+
+        Args:
+            name (str): the name of the timer
+            seconds (float): the duration
+            **labels: labels of the timer
+        """
+
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar(
+    "songbirdcore_span", default=None
+)
+
+
+class Span:
+    """A timed run of a stage, recorded by `InMemoryInstrumentation` and
+    `PrometheusInstrumentation`. Every finished span is also observed by the
+    timer of the same name, labelled with its status.
+    """
+
+    def __init__(
+        self, instrumentation: "_RecordingInstrumentation", name: str, attributes: dict
+    ):
+        self.name = name
+        """name of the stage"""
+        self.attributes = attributes
+        """attributes describing this run of the stage"""
+        self.parent: Optional[Span] = None
+        """the span active when this span started, in the same thread or task"""
+        self.start: Optional[float] = None
+        """time.time() when the span started"""
+        self.duration: Optional[float] = None
+        """seconds the span lasted, None while it is running"""
+        self.error: Optional[str] = None
+        """name of the exception that ended the span, or of the error set by `set_error`, if any"""
+        self._instrumentation = instrumentation
+        self._started_at = 0.0
+        self._token = None
+
+    @property
+    def status(self) -> str:
+        """'ok', or 'error' if an exception ended the span"""
+        return "ok" if self.error is None else "error"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, error: str) -> None:
+        """Mark the span failed for a stage handling its own errors
+
+        Args:
+            error (str): the name of the error, such as "DownloadError"
+        """
+        self.error = error
+
+    def __enter__(self) -> "Span":
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self)
+        self.start = time.time()
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.duration = time.perf_counter() - self._started_at
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self._instrumentation._finish(self)
+
+    def __repr__(self) -> str:
+        return f"Span({self.name!r}, duration={self.duration}, status={self.status!r})"
+
+
+class _RecordingInstrumentation(Instrumentation):
+    def span(self, name: str, **attributes: Any) -> Span:
+        return Span(self, name, attributes)
+
+    def _finish(self, span: Span) -> None:
+        self.observe(span.name, span.duration, status=span.status)
+
+
+class InMemoryInstrumentation(_RecordingInstrumentation):
+    """Keeps every span, counter and timing in memory, for tests."""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        """finished spans, in the order they finished"""
+        self._counters: Dict[Tuple[str, _Labels], float] = {}
+        self._timings: Dict[Tuple[str, _Labels], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def _finish(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+        super()._finish(span)
+
+    def count(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._timings.setdefault(key, []).append(seconds)
+
+    def counter(self, name: str, **labels: Any) -> float:
+        """Get the value of a counter
+
+        Args:
+            name (str): the name of the counter
+            **labels: labels of the counter
+
+        Returns:
+            float: the value, 0 if nothing was counted
+        """
+        with self._lock:
+            return self._counters.get((name, _labels(labels)), 0)
+
+    def timings(self, name: str, **labels: Any) -> List[float]:
+        """Get the durations recorded in a timer
+
+        Args:
+            name (str): the name of the timer
+            **labels: labels of the timer
+
+        Returns:
+            List[float]: the durations in seconds, in the order they were recorded
+        """
+        with self._lock:
+            return list(self._timings.get((name, _labels(labels)), []))
+
+    def span_names(self) -> List[str]:
+        """Get the names of the finished spans, in the order they finished"""
+        with self._lock:
+            return [span.name for span in self.spans]
+
+    def reset(self) -> None:
+        """Forget everything recorded"""
+        with self._lock:
+            self.spans.clear()
+            self._counters.clear()
+            self._timings.clear()
+
+
+_METRIC_NAME_PATTERN = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PrometheusInstrumentation(_RecordingInstrumentation):
+    """Aggregates counters and timers, rendered in the prometheus text
+    exposition format.
+
+    Counters are exported as `<namespace>_<name>_total` and timers as
+    `<namespace>_<name>_seconds` summaries (a count and a sum), with dots in
+    names replaced by underscores. Memory stays constant however long the
+    run is, since spans are only kept as their timers.
+    """
+
+    def __init__(self, namespace: str = "songbirdcore"):
+        """
+        Args:
+            namespace (str, optional): prefix of the exported metric names. Defaults to "songbirdcore".
+        """
+        self.namespace = namespace
+        self._counters: Dict[str, Dict[_Labels, float]] = {}
+        self._timers: Dict[str, Dict[_Labels, List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            summary = self._timers.setdefault(name, {}).setdefault(key, [0, 0.0])
+            summary[0] += 1
+            summary[1] += seconds
+
+    def _metric_name(self, name: str, suffix: str) -> str:
+        return _METRIC_NAME_PATTERN.sub("_", f"{self.namespace}_{name}_{suffix}")
+
+    @staticmethod
+    def _sample(name: str, labels: _Labels, value: float) -> str:
+        if labels:
+            label_text = ",".join(
+                f'{key}="{_escape_label_value(label_value)}"'
+                for key, label_value in labels
+            )
+            name = f"{name}{{{label_text}}}"
+        return f"{name} {float(value)!r}"
+
+    def render(self) -> str:
+        """Render every metric in the prometheus text exposition format
+
+        Returns:
+            str: the metrics, ready to be served on a /metrics endpoint
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                metric = self._metric_name(name, "total")
+                lines.append(f"# TYPE {metric} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(self._sample(metric, labels, value))
+            for name, series in sorted(self._timers.items()):
+                metric = self._metric_name(name, "seconds")
+                lines.append(f"# TYPE {metric} summary")
+                for labels, (count, total) in sorted(series.items()):
+                    lines.append(self._sample(f"{metric}_count", labels, count))
+                    lines.append(self._sample(f"{metric}_sum", labels, total))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def write(self, path: str) -> None:
+        """Atomically write the metrics to a file, such as one read by
+        the textfile collector of the prometheus node exporter
+
+        Args:
+            path (str): path of the file
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+def _otel_attribute(value: Any) -> Any:
+    return value if isinstance(value, (str, bool, int, float)) else str(value)
+
+
+class _OpenTelemetrySpan:
+    def __init__(
+        self, instrumentation: "OpenTelemetryInstrumentation", name: str, attributes
+    ):
+        self._instrumentation = instrumentation
+        self._name = name
+        self._attributes = attributes
+        self._context = None
+        self._span = None
+        self._started_at = 0.0
+        self._error = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self._span.set_attribute(key, _otel_attribute(value))
+
+    def set_error(self, error: str) -> None:
+        self._error = error
+        self._span.set_attribute("error.type", error)
+        try:
+            from opentelemetry.trace import Status, StatusCode
+        except ImportError:
+            return
+        self._span.set_status(Status(StatusCode.ERROR, error))
+
+    def __enter__(self) -> "_OpenTelemetrySpan":
+        self._context = self._instrumentation.tracer.start_as_current_span(
+            self._name,
+            attributes={
+                key: _otel_attribute(value) for key, value in self._attributes.items()
+            },
+        )
+        self._span = self._context.__enter__()
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        duration = time.perf_counter() - self._started_at
+        # records the exception on the span and sets its status
+        self._context.__exit__(exc_type, exc, tb)
+        self._instrumentation.observe(
+            self._name,
+            duration,
+            status="ok" if exc_type is None and self._error is None else "error",
+        )
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """Reports spans to an OpenTelemetry tracer, and counters and timers to
+    an OpenTelemetry meter. Timers are histograms in seconds, and every span
+    is also recorded by the histogram of the same name.
+
+    Requires opentelemetry-api, installed with 'pip install songbirdcore[opentelemetry]',
+    unless both a tracer and a meter are given.
+    """
+
+    def __init__(self, tracer=None, meter=None):
+        """
+        Args:
+            tracer (opentelemetry.trace.Tracer, optional): the tracer spans are started on.
+                Defaults to the "songbirdcore" tracer of the global tracer provider.
+            meter (opentelemetry.metrics.Meter, optional): the meter instruments are created on.
+                Defaults to the "songbirdcore" meter of the global meter provider.
+        """
+        if tracer is None or meter is None:
+            try:
+                from opentelemetry import metrics, trace
+            except ImportError as e:
+                raise ImportError(
+                    "OpenTelemetry instrumentation requires opentelemetry-api, install it with 'pip install songbirdcore[opentelemetry]'"
+                ) from e
+            tracer = tracer or trace.get_tracer("songbirdcore")
+            meter = meter or metrics.get_meter("songbirdcore")
+        self.tracer = tracer
+        self.meter = meter
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str, **attributes: Any) -> _OpenTelemetrySpan:
+        return _OpenTelemetrySpan(self, name, attributes)
+
+    def count(self, name: str, value: float = 1, **labels: Any) -> None:
+        with self._lock:
+            counter = self._counters.get(name)
+            if counter is None:
+                counter = self._counters[name] = self.meter.create_counter(name)
+        counter.add(value, attributes=labels)
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = self.meter.create_histogram(
+                    name, unit="s"
+                )
+        histogram.record(seconds, attributes=labels)
+
+
+_instrumentation: Instrumentation = Instrumentation()
+
+
+def get_instrumentation() -> Instrumentation:
+    """Get the instrumentation the stages of songbirdcore report to
+
+    Returns:
+        Instrumentation: the active instrumentation, a no-op one unless set
+    """
+    return _instrumentation
+
+
+def set_instrumentation(instrumentation: Optional[Instrumentation]) -> Instrumentation:
+    """Set the instrumentation the stages of songbirdcore report to, process wide
+
+    Args:
+        instrumentation (Optional[Instrumentation]): the instrumentation, None restores the no-op default
+
+    Returns:
+        Instrumentation: the previously active instrumentation
+    """
+    global _instrumentation
+    previous = _instrumentation
+    _instrumentation = Instrumentation() if instrumentation is None else instrumentation
+    return previous
+
+
+def span(name: str, **attributes: Any):
+    """Time a stage on the active instrumentation, see `Instrumentation.span`"""
+    return _instrumentation.span(name, **attributes)
+
+
+def count(name: str, value: float = 1, **labels: Any) -> None:
+    """Add to a counter of the active instrumentation, see `Instrumentation.count`"""
+    _instrumentation.count(name, value, **labels)
+
+
+def observe(name: str, seconds: float, **labels: Any) -> None:
+    """Record a duration in a timer of the active instrumentation, see `Instrumentation.observe`"""
+    _instrumentation.observe(name, seconds, **labels)
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """Decorate a function to run it in a span of the active instrumentation
+
+    Args:
+        name (str): the name of the span
+
+    Returns:
+        Callable[[Callable], Callable]: the decorator
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _instrumentation.span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
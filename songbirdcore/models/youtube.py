@@ -0,0 +1,94 @@
+from enum import Enum
+from pydantic import BaseModel
+from typing import Dict, Optional
+
+
+class SearchMode(Enum):
+    """enum class containing the engines youtube searches can run on"""
+
+    RENDER = "render"
+    """render the search page in a headless browser and read its video titles"""
+    INITIAL_DATA = "initial_data"
+    """parse the ytInitialData json embedded in the raw search page, without rendering"""
+    YTSEARCH = "ytsearch"
+    """search through yt-dlp's ytsearch extractor"""
+
+
+class VideoSearchResult(BaseModel):
+    title: str
+    """specifies title of the video"""
+    href: str
+    """specifies path of the video relative to the youtube home page, such as /watch?v=id"""
+    duration: Optional[str] = None
+    """specifies duration of the video as displayed by youtube, such as 3:05"""
+    channel: Optional[str] = None
+    """specifies name of the channel that uploaded the video"""
+
+    @property
+    def attrs(self) -> Dict[str, str]:
+        """title and href, as found in the attrs of a rendered #video-title element"""
+        return {"title": self.title, "href": self.href}
+
+
+class DownloadJob(BaseModel):
+    url: str
+    """specifies url of the video to download"""
+    file_path_no_format: str
+    """specifies file path of the download, excluding the file format"""
+    file_format: str
+    """specifies file format the audio is extracted to"""
+    embed_thumbnail: bool = False
+    """specifies whether the youtube thumbnail is embedded into the file"""
+
+
+class DownloadStatus(Enum):
+    """enum class containing the states of a download job"""
+
+    QUEUED = "queued"
+    """job is waiting for a fetch worker"""
+    DOWNLOADING = "downloading"
+    """media is being fetched"""
+    POSTPROCESSING = "postprocessing"
+    """media is fetched and being converted"""
+    FINISHED = "finished"
+    """job completed successfully"""
+    ERROR = "error"
+    """job failed"""
+
+
+class DownloadProgress(BaseModel):
+    job_id: int
+    """specifies index of the job in submission order"""
+    url: str
+    """specifies url of the job"""
+    status: DownloadStatus
+    """specifies current state of the job"""
+    downloaded_bytes: int = 0
+    """specifies number of bytes fetched so far"""
+    total_bytes: Optional[int] = None
+    """specifies size of the download, if known"""
+    eta: Optional[float] = None
+    """specifies estimated seconds until the fetch completes, if known"""
+
+    @property
+    def fraction(self) -> Optional[float]:
+        """fraction of the download fetched, or None if the size is unknown"""
+        if self.status == DownloadStatus.FINISHED:
+            return 1.0
+        if not self.total_bytes:
+            return None
+        return min(self.downloaded_bytes / self.total_bytes, 1.0)
+
+
+class DownloadResult(BaseModel):
+    job: DownloadJob
+    """specifies the job this result belongs to"""
+    file_path: Optional[str] = None
+    """specifies path of the downloaded file, None if the job failed"""
+    error: Optional[str] = None
+    """specifies reason the job failed, if it did"""
+
+    @property
+    def success(self) -> bool:
+        """True if the job completed"""
+        return self.file_path is not None
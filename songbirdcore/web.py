@@ -1,12 +1,376 @@
-from typing import Optional, List, Dict
+from typing import Any, Awaitable, Callable, Optional, List, Dict, Tuple
+from collections import deque
+import asyncio
+import atexit
+import importlib
 import logging
-from requests_html import HTMLSession
+import threading
+import time
 import requests
 from requests import Response
 
+from . import metrics
+
+# requests_html takes a few hundred ms to import, it is imported on first use
+_LAZY_ATTRIBUTES = {
+    "HTML": ("requests_html", "HTML"),
+    "HTMLSession": ("requests_html", "HTMLSession"),
+    "DEFAULT_ENCODING": ("requests_html", "DEFAULT_ENCODING"),
+}
+"""attributes this module used to import, mapped to (module, attribute name)"""
+
+
+def __getattr__(name: str):
+    # web.HTML, web.HTMLSession and web.DEFAULT_ENCODING resolve to
+    # requests_html, imported when one of them is first looked up
+    if name in _LAZY_ATTRIBUTES:
+        module_name, attribute = _LAZY_ATTRIBUTES[name]
+        module = importlib.import_module(module_name)
+        return module if attribute is None else getattr(module, attribute)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 logger = logging.getLogger(__name__)
 
 
+class _PlaywrightBrowser:
+    """a headless chromium, stopping playwright along with the browser"""
+
+    def __init__(self, playwright, browser):
+        self._playwright = playwright
+        self._browser = browser
+
+    async def new_page(self):
+        return await self._browser.new_page()
+
+    async def close(self):
+        await self._browser.close()
+        await self._playwright.stop()
+
+
+async def launch_chromium() -> _PlaywrightBrowser:
+    """Launch the headless chromium used for rendering, as requests_html does
+
+    Returns:
+        _PlaywrightBrowser: the browser
+    """
+    from playwright.async_api import async_playwright
+
+    playwright = await async_playwright().start()
+    browser = await playwright.chromium.launch(headless=True, args=["--no-sandbox"])
+    return _PlaywrightBrowser(playwright, browser)
+
+
+class RenderPool:
+    """Long lived headless browser rendering pages for every SimpleSession.
+
+    The browser is started on first use and kept running, together with a
+    pool of open pages, on an event loop in a background thread. Pages are
+    closed and replaced after `max_uses_per_page` renders so they do not
+    accumulate state. Render latencies are recorded, see `metrics`.
+
+    The pool is thread safe, at most `max_pages` renders run at once.
+    """
+
+    def __init__(
+        self,
+        max_pages: int = 2,
+        max_uses_per_page: int = 50,
+        browser_factory: Callable[[], Awaitable[Any]] = launch_chromium,
+        latency_window: int = 256,
+    ):
+        """
+        Args:
+            max_pages (int, optional): number of pages, and so of concurrent renders. Defaults to 2.
+            max_uses_per_page (int, optional): renders after which a page is replaced. Defaults to 50.
+            browser_factory (Callable[[], Awaitable[Any]], optional): coroutine function starting
+                the browser. The browser needs async `new_page` and `close` methods, and its pages
+                async `goto(url, timeout)`, `content` and `close` methods. Defaults to launch_chromium.
+            latency_window (int, optional): number of recent render latencies kept for metrics. Defaults to 256.
+        """
+        self.max_pages = max_pages
+        self.max_uses_per_page = max_uses_per_page
+        self.browser_factory = browser_factory
+        self.browser_starts = 0
+        self.browser_startup_seconds = 0.0
+        self.renders = 0
+        self.failures = 0
+        self.pages_created = 0
+        self.pages_recycled = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._browser = None
+        self._browser_lock: Optional[asyncio.Lock] = None
+        self._pages: Optional[asyncio.Queue] = None
+        self._page_uses: Dict[int, int] = {}
+        self._closed = False
+
+    def render(
+        self, url: str, timeout: float = 10, wait: float = 0.2, sleep: float = 0
+    ) -> str:
+        """Render url and return the html after javascript ran
+
+        Args:
+            url (str): the url to render
+            timeout (float, optional): seconds before abandoning the page load. Defaults to 10.
+            wait (float, optional): seconds to wait before loading the page. Defaults to 0.2.
+            sleep (float, optional): seconds to wait after loading the page. Defaults to 0.
+
+        Raises:
+            RuntimeError: if the pool is closed
+            Exception: whatever the browser raised if the render failed
+
+        Returns:
+            str: the rendered html
+        """
+        with metrics.span("web.render"):
+            loop = self._start()
+            future = asyncio.run_coroutine_threadsafe(
+                self._render(url, timeout, wait, sleep), loop
+            )
+            return future.result()
+
+    def metrics(self) -> Dict[str, float]:
+        """Get render latency metrics
+
+        Returns:
+            Dict[str, float]: counters, browser startup time, and the mean, p50,
+                p95 and max of recent render latencies in seconds
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            metrics = {
+                "renders": self.renders,
+                "failures": self.failures,
+                "browser_starts": self.browser_starts,
+                "browser_startup_seconds": self.browser_startup_seconds,
+                "pages_created": self.pages_created,
+                "pages_recycled": self.pages_recycled,
+            }
+        if latencies:
+            metrics.update(
+                {
+                    "mean_seconds": sum(latencies) / len(latencies),
+                    "p50_seconds": latencies[len(latencies) // 2],
+                    "p95_seconds": latencies[
+                        min(len(latencies) - 1, int(len(latencies) * 0.95))
+                    ],
+                    "max_seconds": latencies[-1],
+                }
+            )
+        return metrics
+
+    def close(self) -> None:
+        """Close the browser and stop the background event loop"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            loop, thread = self._loop, self._thread
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_browser(), loop).result()
+        except Exception:
+            logger.exception("Failed to close the render browser.")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    def __enter__(self) -> "RenderPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("RenderPool is closed")
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name="songbirdcore-render",
+                    daemon=True,
+                )
+                self._thread.start()
+            return self._loop
+
+    async def _ensure_browser(self):
+        if self._browser_lock is None:
+            self._browser_lock = asyncio.Lock()
+            # last in first out, so the warmest page is reused
+            self._pages = asyncio.LifoQueue()
+            for _ in range(self.max_pages):
+                # None stands for a page slot without an open page
+                self._pages.put_nowait(None)
+        async with self._browser_lock:
+            if self._browser is None:
+                start = time.perf_counter()
+                self._browser = await self.browser_factory()
+                with self._lock:
+                    self.browser_starts += 1
+                    self.browser_startup_seconds += time.perf_counter() - start
+        return self._browser
+
+    async def _render(self, url: str, timeout: float, wait: float, sleep: float) -> str:
+        browser = await self._ensure_browser()
+        page = await self._pages.get()
+        start = time.perf_counter()
+        try:
+            if page is None:
+                page = await browser.new_page()
+                self._page_uses[id(page)] = 0
+                with self._lock:
+                    self.pages_created += 1
+            await asyncio.sleep(wait)
+            await page.goto(url, timeout=int(timeout * 1000))
+            await asyncio.sleep(sleep)
+            content = await page.content()
+        except BaseException:
+            with self._lock:
+                self.failures += 1
+            # a page in an unknown state is not reused
+            page = await self._discard_page(page)
+            raise
+        finally:
+            if page is not None:
+                self._page_uses[id(page)] += 1
+                if self._page_uses[id(page)] >= self.max_uses_per_page:
+                    page = await self._discard_page(page)
+                    with self._lock:
+                        self.pages_recycled += 1
+            self._pages.put_nowait(page)
+        with self._lock:
+            self.renders += 1
+            self._latencies.append(time.perf_counter() - start)
+        return content
+
+    async def _discard_page(self, page) -> None:
+        if page is not None:
+            self._page_uses.pop(id(page), None)
+            try:
+                await page.close()
+            except Exception:
+                logger.debug("Failed to close a render page.", exc_info=True)
+        return None
+
+    async def _close_browser(self) -> None:
+        if self._pages is not None:
+            while not self._pages.empty():
+                await self._discard_page(self._pages.get_nowait())
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+
+
+_default_render_pool: Optional[RenderPool] = None
+_default_render_pool_lock = threading.Lock()
+
+
+def default_render_pool() -> RenderPool:
+    """Get the process wide render pool shared by SimpleSessions when none is given
+
+    The pool is closed when the interpreter exits.
+
+    Returns:
+        RenderPool: the shared pool
+    """
+    global _default_render_pool
+    with _default_render_pool_lock:
+        if _default_render_pool is None:
+            _default_render_pool = RenderPool()
+            atexit.register(_default_render_pool.close)
+        return _default_render_pool
+
+
+class FormSchemaCache:
+    """Cache of the input names of web forms, per form url, with TTL expiry.
+
+    Filling a search form only needs the names of its inputs, which rarely
+    change, so caching them saves fetching and parsing the form page before
+    every search.
+    """
+
+    def __init__(self, ttl: float = 60 * 60, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            ttl (float, optional): seconds a form schema stays valid. Defaults to one hour.
+            clock (Callable[[], float], optional): source of the current time in seconds. Defaults to time.time.
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._schemas: Dict[str, Tuple[float, Tuple[str, ...]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, form_url: str) -> Optional[Tuple[str, ...]]:
+        """Get the cached input names of the form at form_url
+
+        Args:
+            form_url (str): the url of the form
+
+        Returns:
+            Optional[Tuple[str, ...]]: the input names, or None if nothing valid is cached
+        """
+        with self._lock:
+            entry = self._schemas.get(form_url)
+            if entry is not None:
+                expires_at, input_names = entry
+                if expires_at > self.clock():
+                    self.hits += 1
+                    return input_names
+                del self._schemas[form_url]
+            self.misses += 1
+            return None
+
+    def set(self, form_url: str, input_names: Tuple[str, ...]) -> None:
+        """Cache the input names of the form at form_url
+
+        Args:
+            form_url (str): the url of the form
+            input_names (Tuple[str, ...]): the names of its inputs
+        """
+        with self._lock:
+            self._schemas[form_url] = (self.clock() + self.ttl, tuple(input_names))
+
+    def invalidate(self, form_url: Optional[str] = None) -> None:
+        """Drop the schema of form_url, or every schema if form_url is None
+
+        Args:
+            form_url (Optional[str], optional): the url of the form to drop. Defaults to None.
+        """
+        with self._lock:
+            if form_url is None:
+                self._schemas.clear()
+            else:
+                self._schemas.pop(form_url, None)
+
+    def __len__(self) -> int:
+        return len(self._schemas)
+
+
+_default_form_cache: Optional[FormSchemaCache] = None
+_default_form_cache_lock = threading.Lock()
+
+
+def default_form_cache() -> FormSchemaCache:
+    """Get the process wide form schema cache shared by SimpleSessions when none is given
+
+    Returns:
+        FormSchemaCache: the shared cache
+    """
+    global _default_form_cache
+    with _default_form_cache_lock:
+        if _default_form_cache is None:
+            _default_form_cache = FormSchemaCache()
+        return _default_form_cache
+
+
 class SimpleSession:
     def __init__(
         self,
@@ -14,8 +378,24 @@ class SimpleSession:
         root_url: str,
         credentials: Optional[dict] = {},
         headers: Optional[dict] = {},
+        render_pool: Optional[RenderPool] = None,
+        form_cache: Optional[FormSchemaCache] = None,
     ):
+        """
+        Args:
+            name (str): name of the session
+            root_url (str): the root url of the website
+            credentials (Optional[dict], optional): unused. Defaults to {}.
+            headers (Optional[dict], optional): headers sent with every request.
+                If None, headers copied from a desktop browser are used. Defaults to {}.
+            render_pool (Optional[RenderPool], optional): browser pages are rendered with.
+                Defaults to `default_render_pool()`, shared by every session.
+            form_cache (Optional[FormSchemaCache], optional): cache of form input names.
+                Defaults to `default_form_cache()`, shared by every session.
+        """
         self.name = name
+        self.render_pool = render_pool
+        self.form_cache = default_form_cache() if form_cache is None else form_cache
         self.root_url = root_url
         self.credentials = {}
         self.headers = headers
@@ -34,7 +414,10 @@ class SimpleSession:
             }
         self.current_url = ""
 
-        # initialize a session for this class.. to be used for all requests
+        # initialize a session for this class.. to be used for all requests.
+        # requests_html is imported here as it takes a few hundred ms to import
+        from requests_html import HTMLSession
+
         self.s = HTMLSession()
 
     def get_form_inputs(
@@ -51,6 +434,16 @@ class SimpleSession:
             Optional[dict]: a dictionary containing the form
                 inputs for the form_url, updated with payload
         """
+        input_names = self.form_cache.get(form_url)
+        if input_names is not None:
+            form_inputs = dict.fromkeys(input_names, "")
+            form_inputs.update(payload)
+            if log_calls:
+                logger.info(
+                    f"Auto filled the cached web form with inputs: {form_inputs}"
+                )
+            return form_inputs
+
         # initialize form_inputs to be empty each request
         form_inputs = {}
         try:
@@ -76,6 +469,7 @@ class SimpleSession:
         except KeyError:
             logger.debug("No nonetype attributes to be removed.")
 
+        self.form_cache.set(form_url, tuple(form_inputs))
         form_inputs.update(payload)
         if log_calls:
             logger.info(f"Auto filled the web form with inputs: {form_inputs}")
@@ -83,6 +477,7 @@ class SimpleSession:
         form_response.close()
         return form_inputs
 
+    @metrics.timed("web.enter_search_form")
     def enter_search_form(
         self,
         search_url: str,
@@ -115,11 +510,32 @@ class SimpleSession:
         except requests.exceptions.RequestException as e:
             logger.error(f"Error submitting request to: {search_url}", e)
             return None
+        if not response.ok:
+            # the form may have changed, so fetch it again on the next search
+            self.form_cache.invalidate(form_url)
 
         logger.debug("Rendering html for : " + response.url)
-        response.html.render(
-            timeout=render_timeout, wait=render_wait, sleep=render_sleep
+        render_pool = self.render_pool or default_render_pool()
+        try:
+            content = render_pool.render(
+                response.url,
+                timeout=render_timeout,
+                wait=render_wait,
+                sleep=render_sleep,
+            )
+        except Exception as e:
+            logger.error(f"Error rendering: {response.url}: {e!r}")
+            response.close()
+            return None
+        from requests_html import DEFAULT_ENCODING, HTML
+
+        # replace the html in place, as requests_html's render does
+        html = HTML(
+            url=response.url,
+            html=content.encode(DEFAULT_ENCODING),
+            default_encoding=DEFAULT_ENCODING,
         )
+        response.html.__dict__.update(html.__dict__)
         logger.debug("Rendering complete for : " + response.url)
 
         response.close()
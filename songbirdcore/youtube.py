@@ -1,17 +1,315 @@
 import logging
-from typing import Optional
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Optional
 from typing import Tuple, List
-import requests_html
-from bs4 import BeautifulSoup
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import contextlib
+import importlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import requests
 import os, sys
 
 from .models import itunes_api
+from .models.youtube import (
+    DownloadJob,
+    DownloadProgress,
+    DownloadResult,
+    DownloadStatus,
+    SearchMode,
+    VideoSearchResult,
+)
 from . import web
 from . import common
+from . import metrics
+
+# yt_dlp and requests_html take a few hundred ms to import, they are
+# imported on first use
+if TYPE_CHECKING:
+    import requests_html
+
+
+_LAZY_ATTRIBUTES = {
+    "youtube_dl": ("yt_dlp", None),
+    "DownloadError": ("yt_dlp.utils", "DownloadError"),
+    "ExtractorError": ("yt_dlp.utils", "ExtractorError"),
+    "UnavailableVideoError": ("yt_dlp.utils", "UnavailableVideoError"),
+    "BeautifulSoup": ("bs4", "BeautifulSoup"),
+    "requests_html": ("requests_html", None),
+}
+"""attributes this module used to import, mapped to (module, attribute name)"""
+
+
+def __getattr__(name: str):
+    # keeps the dependencies this module used to import available as its
+    # attributes, importing them on first access rather than along with it
+    if name in _LAZY_ATTRIBUTES:
+        module_name, attribute = _LAZY_ATTRIBUTES[name]
+        module = importlib.import_module(module_name)
+        return module if attribute is None else getattr(module, attribute)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 logger = logging.getLogger(__name__)
-import yt_dlp as youtube_dl
-from yt_dlp.utils import DownloadError, UnavailableVideoError, ExtractorError
+
+_INITIAL_DATA_PATTERN = re.compile(
+    r'(?:var\s+ytInitialData|window\["ytInitialData"\])\s*=\s*'
+)
+
+
+def parse_initial_data(html: str) -> Optional[dict]:
+    """Extract the ytInitialData json embedded in a youtube page
+
+    Args:
+        html (str): the raw html of the page
+
+    Returns:
+        Optional[dict]: the decoded ytInitialData, or None if the page has none
+    """
+    match = _INITIAL_DATA_PATTERN.search(html)
+    if match is None:
+        return None
+    try:
+        initial_data, _ = json.JSONDecoder().raw_decode(html, match.end())
+    except json.JSONDecodeError:
+        return None
+    return initial_data
+
+
+def _text(field: dict) -> str:
+    """text of a youtube formatted string, given as simpleText or runs"""
+    if "simpleText" in field:
+        return field["simpleText"]
+    return "".join(run.get("text", "") for run in field.get("runs", []))
+
+
+def video_results_from_initial_data(initial_data: dict) -> List[VideoSearchResult]:
+    """Collect the videos of a search page from its ytInitialData
+
+    Videos are collected in page order from every videoRenderer, wherever it is
+    nested, so shelves are included while ads, channels and shorts are not.
+
+    Args:
+        initial_data (dict): the ytInitialData of a search results page
+
+    Returns:
+        List[VideoSearchResult]: the videos, without duplicates
+    """
+    results = []
+    seen = set()
+    stack = [initial_data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+            continue
+        if not isinstance(node, dict):
+            continue
+        renderer = node.get("videoRenderer")
+        if isinstance(renderer, dict):
+            video_id = renderer.get("videoId")
+            title = _text(renderer.get("title", {}))
+            if video_id and title and video_id not in seen:
+                seen.add(video_id)
+                href = (
+                    renderer.get("navigationEndpoint", {})
+                    .get("commandMetadata", {})
+                    .get("webCommandMetadata", {})
+                    .get("url", f"/watch?v={video_id}")
+                )
+                owner = renderer.get("ownerText") or renderer.get("longBylineText")
+                results.append(
+                    VideoSearchResult(
+                        title=title,
+                        href=href,
+                        duration=_text(renderer.get("lengthText", {})) or None,
+                        channel=_text(owner) if owner else None,
+                    )
+                )
+            continue
+        stack.extend(reversed(list(node.values())))
+    return results
+
+
+def _element_text(element, xpath: str) -> Optional[str]:
+    """stripped text of the first match of xpath under an lxml element"""
+    for match in element.xpath(xpath):
+        text = match.text_content().strip()
+        if text:
+            return text
+    return None
+
+
+def video_results_from_rendered_html(
+    html: "requests_html.HTML",
+) -> List[VideoSearchResult]:
+    """Collect the videos of a rendered search page from its #video-title elements
+
+    Elements missing a title or href are skipped. Duration and channel are read
+    from the enclosing video renderer, when there is one.
+
+    Args:
+        html (requests_html.HTML): the rendered search page
+
+    Returns:
+        List[VideoSearchResult]: the videos, in page order
+    """
+    results = []
+    for link in html.find("#video-title"):
+        title = link.attrs.get("title")
+        href = link.attrs.get("href")
+        if not title or not href:
+            continue
+        duration = channel = None
+        renderer = next(link.element.iterancestors("ytd-video-renderer"), None)
+        if renderer is not None:
+            duration = _element_text(
+                renderer,
+                ".//ytd-thumbnail-overlay-time-status-renderer//*[@id='text']",
+            )
+            channel = _element_text(renderer, ".//ytd-channel-name//a")
+        results.append(
+            VideoSearchResult(
+                title=title, href=href, duration=duration, channel=channel
+            )
+        )
+    return results
+
+
+def _rendered_links(
+    session: web.SimpleSession,
+    youtube_search_url: str,
+    youtube_query_payload: dict,
+    render_timeout: int,
+    render_wait: float,
+    render_sleep: Optional[int],
+    log_calls: bool,
+) -> Optional[List[VideoSearchResult]]:
+    response = session.enter_search_form(
+        search_url=youtube_search_url,
+        payload=youtube_query_payload,
+        render_timeout=render_timeout,
+        render_wait=render_wait,
+        render_sleep=render_sleep,
+        log_calls=log_calls,
+    )
+    if response == None:
+        return None
+    # Get the list of hrefs to each video on the home page
+    return video_results_from_rendered_html(response.html)
+
+
+def _initial_data_links(
+    session: web.SimpleSession, youtube_search_url: str, youtube_query_payload: dict
+) -> Optional[List[VideoSearchResult]]:
+    try:
+        response = session.s.get(
+            youtube_search_url, params=youtube_query_payload, headers=session.headers
+        )
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error submitting request to: {youtube_search_url}: {e}")
+        return None
+    initial_data = parse_initial_data(response.text)
+    if initial_data is None:
+        logger.error(f"No ytInitialData found in the page at {response.url}")
+        return None
+    return video_results_from_initial_data(initial_data)
+
+
+def _format_duration(seconds: Optional[float]) -> Optional[str]:
+    """format seconds the way youtube displays durations, such as 3:05 or 1:02:03"""
+    if seconds is None:
+        return None
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def _ytsearch_links(query: str, max_results: int) -> Optional[List[VideoSearchResult]]:
+    import yt_dlp
+
+    ydl_opts = {
+        "extract_flat": "in_playlist",
+        "skip_download": True,
+        "cachedir": False,
+        "nocheckcertificate": True,
+        "logger": YtDlLogger(),
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
+    except Exception:
+        logger.exception(f"yt-dlp search failed for query {query}")
+        return None
+    return [
+        VideoSearchResult(
+            title=entry["title"],
+            href=f"/watch?v={entry['id']}",
+            duration=_format_duration(entry.get("duration")),
+            channel=entry.get("channel") or entry.get("uploader"),
+        )
+        for entry in (info or {}).get("entries") or []
+        if entry.get("id") and entry.get("title")
+    ]
+
+
+_SEARCH_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/106.0.0.0 Safari/537.36",  # ubuntu chrome headers
+}
+
+
+def _search_session(
+    youtube_home_url: str, render_pool: Optional[web.RenderPool] = None
+) -> web.SimpleSession:
+    headers = {**_SEARCH_HEADERS, "Referrer": youtube_home_url}
+    return web.SimpleSession(
+        "youtube", root_url=youtube_home_url, headers=headers, render_pool=render_pool
+    )
+
+
+def _search(
+    session: web.SimpleSession,
+    youtube_search_url: str,
+    youtube_query_payload: dict,
+    render_timeout: int,
+    render_wait: float,
+    render_sleep: Optional[int],
+    search_mode: SearchMode,
+    max_results: int,
+    log_calls: bool,
+) -> Optional[List[VideoSearchResult]]:
+    """run one search attempt on the engine of search_mode"""
+    if search_mode == SearchMode.RENDER:
+        # First, enter the search form on the youtube home page
+        return _rendered_links(
+            session,
+            youtube_search_url,
+            youtube_query_payload,
+            render_timeout,
+            render_wait,
+            render_sleep,
+            log_calls,
+        )
+    if search_mode == SearchMode.INITIAL_DATA:
+        return _initial_data_links(session, youtube_search_url, youtube_query_payload)
+    return _ytsearch_links(youtube_query_payload.get("search_query", ""), max_results)
+
+
+def _link_list(
+    youtube_home_url: str, results: List[VideoSearchResult]
+) -> Tuple[List[str], List[VideoSearchResult]]:
+    # a user friendly list, containing videos with title and href refs
+    link_list = [
+        f"{result.title} - {youtube_home_url}{result.href}" for result in results
+    ]
+    return link_list, results
 
 
 def get_video_links(
@@ -22,41 +320,42 @@ def get_video_links(
     render_wait: float,
     retry_count: Optional[int] = 3,
     render_sleep: Optional[int] = 1,
-) -> Tuple[List[str], List[requests_html.Element]]:
+    search_mode: SearchMode = SearchMode.RENDER,
+    max_results: int = 20,
+) -> Tuple[List[str], List[VideoSearchResult]]:
     """
     Args:
         render_timeout (int): amount of time before abandoning a render
         render_wait (float): the amount of time before attempting a render
         retry_count (int): the number of retries for a render
         render_sleep (Optional[int]): the amount of time to wait after rendering
+        search_mode (SearchMode): the engine running the search. SearchMode.INITIAL_DATA and
+            SearchMode.YTSEARCH skip the headless browser.
+        max_results (int): the number of results requested in SearchMode.YTSEARCH
     """
-    headers = {
-        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/106.0.0.0 Safari/537.36",  # ubuntu chrome headers
-        "Referrer": youtube_home_url,
-    }
-    session = web.SimpleSession("youtube", root_url=youtube_home_url, headers=headers)
+    session = _search_session(youtube_home_url)
     tries = 0
     # Only need to log info about these requests on first try to simplify UI experience
     log_attempts = True
     while tries < retry_count:
-        # First, enter the search form on the youtube home page
-        response = session.enter_search_form(
-            search_url=youtube_search_url,
-            payload=youtube_query_payload,
-            render_timeout=render_timeout,
-            render_wait=render_wait,
-            render_sleep=render_sleep,
-            log_calls=log_attempts,
+        links = _search(
+            session,
+            youtube_search_url,
+            youtube_query_payload,
+            render_timeout,
+            render_wait,
+            render_sleep,
+            search_mode,
+            max_results,
+            log_attempts,
         )
-        if response == None:
+        if links is None:
             logger.error(
                 f"Error occurred performing a search for {youtube_query_payload} against url {youtube_search_url}. Please try again."
             )
             tries += 1
             log_attempts = False
             continue
-        # Get the list of hrefs to each video on the home page
-        links = response.html.find("#video-title")
         if len(links) == 0:
             logger.warning(f"{tries+1}:{retry_count}.")
             tries += 1
@@ -70,18 +369,111 @@ def get_video_links(
         )
         return None, None
 
-    link_list = []
-    # create a user friendly list, containing videos with title and href refs.
-    for idx, link in enumerate(links):
-        if "title" in link.attrs and "href" in link.attrs:
-            link_list.append(
-                f"{link.attrs['title']} - {youtube_home_url+link.attrs['href']}"
+    return _link_list(youtube_home_url, links)
+
+
+async def get_video_links_many(
+    youtube_home_url: str,
+    youtube_search_url: str,
+    youtube_query_payloads: List[dict],
+    render_timeout: int,
+    render_wait: float,
+    retry_count: Optional[int] = 3,
+    render_sleep: Optional[int] = 1,
+    search_mode: SearchMode = SearchMode.RENDER,
+    max_results: int = 20,
+    concurrency: int = 4,
+    backoff: float = 1,
+    max_backoff: float = 30,
+    render_pool: Optional[web.RenderPool] = None,
+) -> List[Tuple[Optional[List[str]], Optional[List[VideoSearchResult]]]]:
+    """Run many youtube searches concurrently, such as one per track of an album
+
+    Searches share one http session and renderer, with at most `concurrency`
+    in flight at once. A failed or empty search is retried after an exponential
+    backoff with jitter, without holding up the other searches.
+
+    Example:
+        ```python
+        results = asyncio.run(
+            get_video_links_many(home_url, search_url, payloads, render_timeout=20, render_wait=0.2)
+        )
+        ```
+
+    Args:
+        youtube_query_payloads (List[dict]): the payload of each search
+        render_timeout (int): amount of time before abandoning a render
+        render_wait (float): the amount of time before attempting a render
+        retry_count (int): the number of tries for each search
+        render_sleep (Optional[int]): the amount of time to wait after rendering
+        search_mode (SearchMode): the engine running the searches, see `get_video_links`
+        max_results (int): the number of results requested in SearchMode.YTSEARCH
+        concurrency (int): maximum number of searches in flight
+        backoff (float): seconds before the first retry of a search, doubled for every later retry
+        max_backoff (float): maximum seconds between two tries of a search
+        render_pool (Optional[web.RenderPool]): renderer shared by the searches.
+            Defaults to `web.default_render_pool()`.
+
+    Returns:
+        List[Tuple[Optional[List[str]], Optional[List[VideoSearchResult]]]]: the
+            `get_video_links` result of each payload, in the order of youtube_query_payloads
+    """
+    session = _search_session(youtube_home_url, render_pool)
+    executor = ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="youtube-search"
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def attempts(youtube_query_payload: dict):
+        for attempt in range(retry_count):
+            if attempt > 0:
+                delay = min(backoff * 2 ** (attempt - 1), max_backoff)
+                await asyncio.sleep(delay * random.uniform(0.5, 1))
+            async with semaphore:
+                links = await loop.run_in_executor(
+                    executor,
+                    _search,
+                    session,
+                    youtube_search_url,
+                    youtube_query_payload,
+                    render_timeout,
+                    render_wait,
+                    render_sleep,
+                    search_mode,
+                    max_results,
+                    attempt == 0,
+                )
+            if links:
+                return _link_list(youtube_home_url, links)
+            logger.warning(
+                f"{attempt+1}:{retry_count} no results for {youtube_query_payload}."
             )
-        # the actual raw list should match list size so we can properly select the link after.
-        else:
-            links.pop(idx)
+        logger.error(
+            f"Failed to get links for {youtube_query_payload} after {retry_count} tries."
+        )
+        return None, None
+
+    async def search(youtube_query_payload: dict):
+        # an error fails this search only, the others keep using the session
+        try:
+            return await attempts(youtube_query_payload)
+        except Exception as e:
+            logger.exception(f"Error searching for {youtube_query_payload}: {e!r}")
+            return None, None
+
+    def close():
+        # searches still running in the executor use the session until they return
+        executor.shutdown(wait=True)
+        session.close()
 
-    return link_list, links
+    try:
+        return await asyncio.gather(
+            *(search(payload) for payload in youtube_query_payloads)
+        )
+    finally:
+        # shielded, so the session is closed even if the caller is cancelled again
+        await asyncio.shield(loop.run_in_executor(None, close))
 
 
 class YtDlLogger(object):
@@ -122,11 +514,209 @@ def my_hook(d):
         sys.stdout.flush()
     if d["status"] == "error":
         logger.error("Error occured during download.")
-        success_downloading = False
+
+
+def _postprocessors(file_format: str, embed_thumbnail: bool) -> List[dict]:
+    """the yt-dlp postprocessors converting a download to file_format"""
+    postprocessors = [
+        {"key": "FFmpegMetadata", "add_metadata": True},
+        {
+            "key": "FFmpegExtractAudio",
+            "preferredcodec": file_format,
+            "preferredquality": "192",
+        },
+    ]
+    if embed_thumbnail:
+        postprocessors.append(
+            {
+                "key": "EmbedThumbnail",
+            }
+        )
+    return postprocessors
+
+
+def _ydl_options(
+    file_path_no_format: str,
+    file_format: str,
+    embed_thumbnail: bool,
+    progress_hooks: List[Callable[[dict], None]],
+) -> dict:
+    """the yt-dlp options for downloading to file_path_no_format in file_format"""
+    ydl_opts = {
+        "format": "bestaudio/best",
+        "cachedir": False,
+        "postprocessors": _postprocessors(file_format, embed_thumbnail),
+        "nocheckcertificate": True,
+        "logger": YtDlLogger(),
+        "progress_hooks": progress_hooks,
+        "outtmpl": file_path_no_format + ".%(ext)s",
+    }
+    if embed_thumbnail:
+        ydl_opts["writethumbnail"] = True
+        ydl_opts["embedthumbnail"] = True
+    return ydl_opts
+
+
+class _PooledYoutubeDL:
+    """a YoutubeDL whose output template and progress hook change per download"""
+
+    def __init__(self, ydl_opts: dict):
+        self.progress_hook: Optional[Callable[[dict], None]] = None
+        ydl_opts["progress_hooks"] = [self._dispatch]
+        ydl_opts["postprocessor_hooks"] = [self._time_postprocessor]
+        self._postprocessor_started: Dict[str, float] = {}
+        import yt_dlp
+
+        self.ydl = yt_dlp.YoutubeDL(ydl_opts)
+
+    def _dispatch(self, d: dict):
+        if self.progress_hook is not None:
+            self.progress_hook(d)
+
+    def _time_postprocessor(self, d: dict):
+        """observe the duration of every postprocessor run, such as the FFmpeg conversion"""
+        name = d.get("postprocessor")
+        if d["status"] == "started":
+            self._postprocessor_started[name] = time.perf_counter()
+        elif d["status"] == "finished":
+            started = self._postprocessor_started.pop(name, None)
+            if started is not None:
+                metrics.observe(
+                    "youtube.postprocessor",
+                    time.perf_counter() - started,
+                    postprocessor=name,
+                )
+
+    def prepare(
+        self,
+        file_path_no_format: str,
+        progress_hook: Optional[Callable[[dict], None]],
+    ) -> None:
+        # YoutubeDL has no public way to change these between downloads.
+        # test_youtube_dl_internals fails if a yt-dlp release changes them.
+        self.ydl.params["outtmpl"]["default"] = file_path_no_format + ".%(ext)s"
+        # the return code of download() accumulates over the life of the instance
+        self.ydl._download_retcode = 0
+        self.progress_hook = progress_hook
+
+
+class YoutubeDLPool:
+    """Pool of long lived YoutubeDL instances, keyed by option set.
+
+    Building a YoutubeDL parses its options and sets up extractors and
+    postprocessors, which is a noticeable part of a short download. The pool
+    builds one instance per concurrent user of each option set and hands it
+    out again for later downloads, only swapping the output path and progress hook.
+
+    Instances are checked out exclusively, so the pool is safe to share between threads.
+    """
+
+    def __init__(self, max_idle_per_key: int = 4):
+        """
+        Args:
+            max_idle_per_key (int, optional): maximum number of idle instances kept per
+                option set, extra instances are closed when released. Defaults to 4.
+        """
+        self.max_idle_per_key = max_idle_per_key
+        self.created = 0
+        self._idle: Dict[tuple, List[_PooledYoutubeDL]] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @contextlib.contextmanager
+    def acquire(
+        self,
+        file_path_no_format: str,
+        file_format: str,
+        embed_thumbnail: bool = False,
+        postprocess: bool = True,
+        progress_hook: Optional[Callable[[dict], None]] = None,
+    ):
+        """Check out a YoutubeDL set up to download to file_path_no_format
+
+        Args:
+            file_path_no_format (str): the file path excluding file format
+            file_format (str): the file format audio is extracted to
+            embed_thumbnail (bool, optional): set to True to embed the youtube thumbnail. Defaults to False.
+            postprocess (bool, optional): set to False to only fetch, without FFmpeg conversion. Defaults to True.
+            progress_hook (Optional[Callable[[dict], None]], optional): yt-dlp progress hook
+                for this download. Defaults to None.
+
+        Raises:
+            RuntimeError: if the pool is closed
+
+        Yields:
+            YoutubeDL: the downloader, returned to the pool on exit. It is discarded
+                instead if the block raises.
+        """
+        key = (file_format, embed_thumbnail, postprocess)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("YoutubeDLPool is closed")
+            idle = self._idle.get(key)
+            pooled = idle.pop() if idle else None
+        if pooled is None:
+            ydl_opts = _ydl_options("", file_format, embed_thumbnail, [])
+            if not postprocess:
+                ydl_opts["postprocessors"] = []
+            pooled = _PooledYoutubeDL(ydl_opts)
+            with self._lock:
+                self.created += 1
+        pooled.prepare(file_path_no_format, progress_hook)
+        try:
+            yield pooled.ydl
+        except BaseException:
+            pooled.ydl.close()
+            raise
+        pooled.progress_hook = None
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if not self._closed and len(idle) < self.max_idle_per_key:
+                idle.append(pooled)
+                return
+        pooled.ydl.close()
+
+    def close(self) -> None:
+        """Close the idle instances. Instances in use are closed when released."""
+        with self._lock:
+            self._closed = True
+            idle = [
+                pooled for pooled_list in self._idle.values() for pooled in pooled_list
+            ]
+            self._idle.clear()
+        for pooled in idle:
+            pooled.ydl.close()
+
+    def __enter__(self) -> "YoutubeDLPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+_default_pool: Optional[YoutubeDLPool] = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool() -> YoutubeDLPool:
+    """Get the process wide YoutubeDL pool used by run_download when none is given
+
+    Returns:
+        YoutubeDLPool: the shared pool
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = YoutubeDLPool()
+        return _default_pool
 
 
 def run_download(
-    url: str, file_path_no_format: str, file_format: str, embed_thumbnail: bool = False
+    url: str,
+    file_path_no_format: str,
+    file_format: str,
+    embed_thumbnail: bool = False,
+    pool: Optional[YoutubeDLPool] = None,
 ) -> Optional[str]:
     """Run a download from youtube
 
@@ -135,44 +725,221 @@ def run_download(
         file_path_no_format (str): the file path excluding file format
         file_format (str): the file format
         embed_thumbnail (bool): set to True to embed the youtube thumbnail into the downloaded file
+        pool (Optional[YoutubeDLPool]): pool the downloader is taken from. Defaults to `default_pool()`.
     Returns:
         str: the filepath.
     """
     local_file_path = f"{file_path_no_format}.{file_format}"
-    ydl_opts = {
-        "format": "bestaudio/best",
-        "cachedir": False,
-        "postprocessors": [
-            {"key": "FFmpegMetadata", "add_metadata": True},
-            {
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": file_format,
-                "preferredquality": "192",
-            },
-        ],
-        "nocheckcertificate": True,
-        "logger": YtDlLogger(),
-        "progress_hooks": [my_hook],
-        "outtmpl": file_path_no_format + ".%(ext)s",
-    }
-    if embed_thumbnail:
-        ydl_opts["writethumbnail"] = True
-        ydl_opts["embedthumbnail"] = True
-        ydl_opts["postprocessors"].append(
-            {
-                "key": "EmbedThumbnail",
-            }
-        )
-    try:
-        with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-            error_code = ydl.download(url)
-        if error_code:
-            logger.error(
-                f"received error code from yt-dlp --- could not perform download at url {url}."
+    if pool is None:
+        pool = default_pool()
+    with metrics.span("youtube.download") as span:
+        try:
+            with pool.acquire(
+                file_path_no_format, file_format, embed_thumbnail, progress_hook=my_hook
+            ) as ydl:
+                error_code = ydl.download(url)
+            if error_code:
+                logger.error(
+                    f"received error code from yt-dlp --- could not perform download at url {url}."
+                )
+                span.set_error("DownloadError")
+                return None
+            logger.info(
+                f"Downloading successful. File stored locally: {local_file_path}"
             )
+            return local_file_path
+        except Exception as e:
+            logger.exception(f"Failed to complete the download of song at url: {url}.")
+            span.set_error(type(e).__name__)
             return None
-        logger.info(f"Downloading successful. File stored locally: {local_file_path}")
-        return local_file_path
-    except Exception as e:
-        logger.exception(f"Failed to complete the download of song at url: {url}.")
-        return None
+
+
+class DownloadManager:
+    """Runs many youtube downloads concurrently.
+
+    Media is fetched on a pool of fetch workers, while the FFmpeg conversion
+    of each fetched file runs on a separate, smaller pool, so conversions do
+    not hold up fetches. Every job reports its own progress and result;
+    progress is kept per job and passed to an optional callback.
+
+    Use as a context manager, or call `close` once done.
+    """
+
+    def __init__(
+        self,
+        max_downloads: int = 4,
+        max_postprocessors: int = 2,
+        progress_callback: Optional[Callable[[DownloadProgress], None]] = None,
+        pool: Optional[YoutubeDLPool] = None,
+    ):
+        """
+        Args:
+            max_downloads (int, optional): number of concurrent fetches. Defaults to 4.
+            max_postprocessors (int, optional): number of concurrent FFmpeg conversions. Defaults to 2.
+            progress_callback (Optional[Callable[[DownloadProgress], None]], optional): called from
+                worker threads with the new progress of a job whenever it changes. Defaults to None.
+            pool (Optional[YoutubeDLPool], optional): pool the downloaders are taken from.
+                If None, the manager uses a pool of its own, closed with the manager.
+        """
+        self.progress_callback = progress_callback
+        self._owns_pool = pool is None
+        self.pool = (
+            YoutubeDLPool(max(max_downloads, max_postprocessors))
+            if pool is None
+            else pool
+        )
+        self._fetch_pool = ThreadPoolExecutor(
+            max_workers=max_downloads, thread_name_prefix="songbirdcore-fetch"
+        )
+        self._postprocess_pool = ThreadPoolExecutor(
+            max_workers=max_postprocessors,
+            thread_name_prefix="songbirdcore-postprocess",
+        )
+        self._progress: Dict[int, DownloadProgress] = {}
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+
+    def submit(self, job: DownloadJob) -> "Future[DownloadResult]":
+        """Queue a download
+
+        Args:
+            job (DownloadJob): the download to run
+
+        Returns:
+            Future[DownloadResult]: resolves to the result of the job once it is
+                fetched and converted. It never raises, failures are reported in the result.
+        """
+        job_id = next(self._job_ids)
+        result: "Future[DownloadResult]" = Future()
+        self._report(job_id, job, DownloadStatus.QUEUED)
+        self._fetch_pool.submit(self._fetch, job_id, job, result)
+        return result
+
+    def run(self, jobs: Iterable[DownloadJob]) -> List[DownloadResult]:
+        """Run downloads and wait for all of them
+
+        Args:
+            jobs (Iterable[DownloadJob]): the downloads to run
+
+        Returns:
+            List[DownloadResult]: the result of each job, in the order of jobs
+        """
+        futures = [self.submit(job) for job in jobs]
+        return [future.result() for future in futures]
+
+    def progress(self) -> Dict[int, DownloadProgress]:
+        """Get the latest progress of every submitted job
+
+        Returns:
+            Dict[int, DownloadProgress]: maps job ids, in submission order, to their progress
+        """
+        with self._lock:
+            return dict(self._progress)
+
+    def close(self) -> None:
+        """Wait for the submitted jobs, then stop the workers"""
+        # fetches hand off to the postprocess pool, so stop them first
+        self._fetch_pool.shutdown(wait=True)
+        self._postprocess_pool.shutdown(wait=True)
+        if self._owns_pool:
+            self.pool.close()
+
+    def __enter__(self) -> "DownloadManager":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _report(
+        self, job_id: int, job: DownloadJob, status: DownloadStatus, **fields
+    ) -> None:
+        with self._lock:
+            previous = self._progress.get(job_id)
+            if previous is None:
+                progress = DownloadProgress(
+                    job_id=job_id, url=job.url, status=status, **fields
+                )
+            else:
+                progress = previous.model_copy(update={"status": status, **fields})
+            self._progress[job_id] = progress
+        if self.progress_callback is not None:
+            try:
+                self.progress_callback(progress)
+            except Exception:
+                logger.exception(f"Progress callback failed for job {job_id}.")
+
+    def _finish(
+        self,
+        job_id: int,
+        job: DownloadJob,
+        result: "Future[DownloadResult]",
+        file_path: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        if file_path is None:
+            logger.error(f"Failed to complete the download of song at url: {job.url}.")
+            self._report(job_id, job, DownloadStatus.ERROR)
+        else:
+            logger.info(f"Downloading successful. File stored locally: {file_path}")
+            self._report(job_id, job, DownloadStatus.FINISHED)
+        result.set_result(DownloadResult(job=job, file_path=file_path, error=error))
+
+    def _fetch(
+        self, job_id: int, job: DownloadJob, result: "Future[DownloadResult]"
+    ) -> None:
+        def progress_hook(d: dict):
+            if d["status"] == "downloading":
+                self._report(
+                    job_id,
+                    job,
+                    DownloadStatus.DOWNLOADING,
+                    downloaded_bytes=d.get("downloaded_bytes") or 0,
+                    total_bytes=d.get("total_bytes") or d.get("total_bytes_estimate"),
+                    eta=d.get("eta"),
+                )
+
+        self._report(job_id, job, DownloadStatus.DOWNLOADING)
+        try:
+            # conversion happens on the postprocess pool
+            with (
+                metrics.span("youtube.fetch"),
+                self.pool.acquire(
+                    job.file_path_no_format,
+                    job.file_format,
+                    job.embed_thumbnail,
+                    postprocess=False,
+                    progress_hook=progress_hook,
+                ) as ydl,
+            ):
+                info = ydl.extract_info(job.url, download=True)
+            downloads = (info or {}).get("requested_downloads")
+            if not downloads:
+                self._finish(job_id, job, result, error="yt-dlp downloaded nothing")
+                return
+        except Exception as e:
+            self._finish(job_id, job, result, error=str(e))
+            return
+        self._report(job_id, job, DownloadStatus.POSTPROCESSING)
+        self._postprocess_pool.submit(
+            self._postprocess, job_id, job, downloads[-1], result
+        )
+
+    def _postprocess(
+        self,
+        job_id: int,
+        job: DownloadJob,
+        info: dict,
+        result: "Future[DownloadResult]",
+    ) -> None:
+        try:
+            with (
+                metrics.span("youtube.postprocess"),
+                self.pool.acquire(
+                    job.file_path_no_format, job.file_format, job.embed_thumbnail
+                ) as ydl,
+            ):
+                info = ydl.post_process(info["filepath"], info)
+        except Exception as e:
+            self._finish(job_id, job, result, error=str(e))
+            return
+        self._finish(job_id, job, result, file_path=info["filepath"])
@@ -0,0 +1,186 @@
+import pytest
+
+import io
+import os, sys, shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from mutagen.mp4 import MP4, MP4Cover
+
+from songbirdcore import artwork, itunes
+from test_common import create_test_folder, song_tags, stub_http_server
+
+RESOURCES_FOLDER = "resources"
+AVAILABLE_SIZES = ["100x100", "500x500", "1000x1000", "1500x1500"]
+
+
+@pytest.fixture()
+def stub_artwork_server(stub_http_server):
+    """serves artwork up to 1500x1500, like an album without high res art"""
+    for size in AVAILABLE_SIZES:
+        stub_http_server.routes[f"/image/{size}bb.jpg"] = (
+            200,
+            {"Content-Type": "image/jpeg"},
+            f"art-{size}".encode(),
+        )
+    yield stub_http_server
+
+
+@pytest.fixture()
+def artwork_url(stub_artwork_server) -> str:
+    return f"{stub_artwork_server.url}/image/100x100bb.jpg"
+
+
+def _downloads(server) -> list:
+    return [request for request in server.requests if request.method == "GET"]
+
+
+@pytest.mark.parametrize("probe", ["head", "range"])
+def test_find_url(stub_artwork_server, artwork_url, probe):
+    fetcher = artwork.ArtworkFetcher(probe=probe)
+    assert fetcher.find_url(artwork_url).endswith("/image/1500x1500bb.jpg")
+    if probe == "head":
+        # probing never downloads a body
+        assert len(_downloads(stub_artwork_server)) == 0
+    fetcher.close()
+
+
+def test_find_url_missing(stub_artwork_server):
+    fetcher = artwork.ArtworkFetcher()
+    assert fetcher.find_url(f"{stub_artwork_server.url}/nope/100x100bb.jpg") is None
+    assert fetcher.fetch(f"{stub_artwork_server.url}/nope/100x100bb.jpg") is None
+    fetcher.close()
+
+
+def test_fetch_downloads_once(stub_artwork_server, artwork_url):
+    fetcher = artwork.ArtworkFetcher()
+    for _ in range(5):
+        assert fetcher.fetch(artwork_url, collection_id=1) == b"art-1500x1500"
+    assert len(_downloads(stub_artwork_server)) == 1
+    fetcher.close()
+
+
+def test_fetch_concurrent_downloads_once(stub_artwork_server, artwork_url):
+    fetcher = artwork.ArtworkFetcher()
+    with ThreadPoolExecutor(8) as executor:
+        results = list(
+            executor.map(
+                lambda i: fetcher.fetch(artwork_url, collection_id=i % 2), range(16)
+            )
+        )
+    assert results == [b"art-1500x1500"] * 16
+    assert len(_downloads(stub_artwork_server)) == 2
+    # the per key locks are dropped once released
+    assert fetcher._key_locks == {}
+    fetcher.close()
+
+
+def test_fetch_disk_cache(stub_artwork_server, artwork_url, create_test_folder):
+    cache_dir = os.path.join(create_test_folder, "artwork")
+    fetcher = artwork.ArtworkFetcher(
+        artwork_cache=artwork.ArtworkCache(cache_dir=cache_dir)
+    )
+    fetcher.fetch(artwork_url, collection_id=1)
+    fetcher.close()
+
+    # a new process with an empty memory tier is served from disk
+    fetcher = artwork.ArtworkFetcher(
+        artwork_cache=artwork.ArtworkCache(cache_dir=cache_dir)
+    )
+    assert fetcher.fetch(artwork_url, collection_id=1) == b"art-1500x1500"
+    assert len(_downloads(stub_artwork_server)) == 1
+    fetcher.close()
+
+
+def test_artwork_cache_eviction(create_test_folder):
+    cache_dir = os.path.join(create_test_folder, "artwork")
+    artwork_cache = artwork.ArtworkCache(
+        max_memory_bytes=10, cache_dir=cache_dir, max_disk_bytes=10
+    )
+    artwork_cache.set("a", b"aaaa")
+    artwork_cache.set("b", b"bbbb")
+    os.utime(artwork_cache._disk_path("a"), ns=(0, 0))
+    assert artwork_cache.get("a") == b"aaaa"
+    artwork_cache.set("c", b"cccc")
+    # b is the least recently used entry in both tiers
+    assert artwork_cache.get("b") is None
+    assert artwork_cache.get("a") == b"aaaa"
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_artwork_searcher(stub_artwork_server, artwork_url):
+    fetcher = artwork.ArtworkFetcher()
+    response = itunes.artwork_searcher(artwork_url, artwork_fetcher=fetcher)
+    assert response.status_code == 200
+    assert response.content == b"art-1500x1500"
+    assert len(_downloads(stub_artwork_server)) == 1
+    fetcher.close()
+
+
+def test_taggers_share_artwork(stub_artwork_server, artwork_url, create_test_folder):
+    """tagging every track of an album downloads its artwork once"""
+    fetcher = artwork.ArtworkFetcher()
+    for i, ext in enumerate(["m4a", "mp3", "m4a", "mp3"]):
+        song = song_tags(i + 1, 4, artwork_url=artwork_url)
+        path = os.path.join(create_test_folder, f"{i}.{ext}")
+        shutil.copy(os.path.join(sys.path[0], RESOURCES_FOLDER, f"empty.{ext}"), path)
+        if ext == "m4a":
+            assert itunes.m4a_tagger(path, song, artwork_fetcher=fetcher)
+            _, artwork_bytes = itunes.m4a_tag_reader(path)
+        else:
+            assert itunes.mp3ID3Tagger(path, song, artwork_fetcher=fetcher)
+            _, artwork_bytes = itunes.mp3_tag_reader(path)
+        assert artwork_bytes == b"art-1500x1500"
+    assert len(_downloads(stub_artwork_server)) == 1
+    fetcher.close()
+
+
+@pytest.mark.parametrize(
+    "data,expected",
+    [
+        (b"\xff\xd8\xff\xe0rest", "image/jpeg"),
+        (b"\x89PNG\r\n\x1a\nrest", "image/png"),
+        (b"GIF89arest", "image/gif"),
+        (b"RIFF\x00\x00\x00\x00WEBPVP8 ", "image/webp"),
+        (b"art-1500x1500", None),
+    ],
+)
+def test_detect_mime_type(data, expected):
+    assert artwork.detect_mime_type(data) == expected
+
+
+def _png(width: int, height: int) -> bytes:
+    Image = pytest.importorskip("PIL.Image")
+    output = io.BytesIO()
+    Image.new("RGBA", (width, height), (200, 30, 30, 255)).save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_artwork_processor():
+    Image = pytest.importorskip("PIL.Image")
+    processor = artwork.ArtworkProcessor(max_dimension=500, jpeg_quality=70)
+    original = _png(1500, 1000)
+    processed = processor.process(original, key="album")
+    assert artwork.detect_mime_type(processed) == "image/jpeg"
+    assert Image.open(io.BytesIO(processed)).size == (500, 333)
+    # memoized per key, so the cover is only transcoded once
+    assert processor.process(original, key="album") is processed
+    # data that is not an image is passed through
+    assert processor.process(b"art-1500x1500") == b"art-1500x1500"
+
+
+def test_fetch_with_processor(stub_http_server, create_test_folder):
+    pytest.importorskip("PIL")
+    stub_http_server.routes["/image/100x100bb.jpg"] = (200, {}, _png(800, 800))
+    fetcher = artwork.ArtworkFetcher(
+        processor=artwork.ArtworkProcessor(max_dimension=300)
+    )
+    song = song_tags(artwork_url=f"{stub_http_server.url}/image/100x100bb.jpg")
+    path = os.path.join(create_test_folder, "empty.m4a")
+    shutil.copy(os.path.join(sys.path[0], RESOURCES_FOLDER, "empty.m4a"), path)
+    assert itunes.m4a_tagger(path, song, artwork_fetcher=fetcher)
+    fetcher.close()
+
+    # the cover is labelled with its real format
+    cover = MP4(path).tags["covr"][0]
+    assert cover.imageformat == MP4Cover.FORMAT_JPEG
+    assert artwork.detect_mime_type(bytes(cover)) == "image/jpeg"
@@ -0,0 +1,117 @@
+import pytest
+
+import os
+
+from songbirdcore import cache, itunes
+from songbirdcore.models import itunes_api, modes
+from test_common import create_test_folder, stub_http_server
+from test_itunes import itunes_lookup_payload, stub_itunes_api
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _album(name: str) -> itunes_api.ItunesApiAlbumKeys:
+    return itunes_api.ItunesApiAlbumKeys(
+        artistName="Dolly Parton", collectionName=name, trackCount=10
+    )
+
+
+def test_cache_key_normalization():
+    assert cache.cache_key(
+        "/search", {"term": "  Dolly   PARTON ", "entity": "song", "limit": 10}
+    ) == cache.cache_key(
+        "/search", {"limit": "10", "entity": "song", "term": "dolly parton"}
+    )
+    assert cache.cache_key("/search", {"term": "a"}) != cache.cache_key(
+        "/lookup", {"term": "a"}
+    )
+    assert cache.cache_key("https://a/search", {"term": "a"}) != cache.cache_key(
+        "https://b/search", {"term": "a"}
+    )
+
+
+def test_cache_lru_eviction():
+    response_cache = cache.ResponseCache(max_entries=2)
+    response_cache.set("a", [_album("a")])
+    response_cache.set("b", [_album("b")])
+    assert response_cache.get("a") is not None
+    response_cache.set("c", [_album("c")])
+    # b was the least recently used entry
+    assert response_cache.get("b") is None
+    assert response_cache.get("a")[0].collectionName == "a"
+    assert response_cache.get("c")[0].collectionName == "c"
+
+
+def test_cache_ttl_and_negative_caching():
+    clock = FakeClock()
+    response_cache = cache.ResponseCache(ttl=100, negative_ttl=10, clock=clock)
+    response_cache.set("found", [_album("a")])
+    response_cache.set("empty", [])
+    assert response_cache.get("empty") == []
+    clock.now += 11
+    assert response_cache.get("empty") is None
+    assert len(response_cache.get("found")) == 1
+    clock.now += 100
+    assert response_cache.get("found") is None
+
+
+def test_cache_sqlite_tier(create_test_folder):
+    """entries survive a restart and come back as models without revalidation"""
+    db_path = os.path.join(create_test_folder, "cache.sqlite")
+    clock = FakeClock()
+    response_cache = cache.ResponseCache(db_path=db_path, clock=clock)
+    response_cache.set("a", [_album("a")])
+    response_cache.set("empty", [])
+    response_cache.close()
+
+    reopened = cache.ResponseCache(db_path=db_path, clock=clock)
+    results = reopened.get("a")
+    assert isinstance(results[0], itunes_api.ItunesApiAlbumKeys)
+    assert results[0] == _album("a")
+    assert reopened.get("empty") == []
+    reopened.invalidate("a")
+    assert reopened.get("a") is None
+    clock.now += reopened.negative_ttl
+    assert reopened.get("empty") is None
+    reopened.close()
+
+
+def test_query_api_cache_hit(stub_itunes_api):
+    response_cache = cache.ResponseCache()
+    first = itunes.query_api(
+        "1062400323",
+        11,
+        modes.Modes.SONG,
+        lookup=True,
+        base_url=stub_itunes_api.url,
+        response_cache=response_cache,
+    )
+    second = itunes.query_api(
+        " 1062400323",
+        11,
+        modes.Modes.SONG,
+        lookup=True,
+        base_url=stub_itunes_api.url,
+        response_cache=response_cache,
+    )
+    assert first == second
+    assert len(stub_itunes_api.requests) == 1
+    assert response_cache.hits == 1
+
+    # the same query against another host is not served from the cache
+    mirror_url = stub_itunes_api.url.replace("127.0.0.1", "localhost")
+    itunes.query_api(
+        "1062400323",
+        11,
+        modes.Modes.SONG,
+        lookup=True,
+        base_url=mirror_url,
+        response_cache=response_cache,
+    )
+    assert len(stub_itunes_api.requests) == 2
@@ -0,0 +1,206 @@
+import pytest
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from songbirdcore import catalog, itunes
+from songbirdcore.models import itunes_api
+from test_common import song_tags, write_track
+
+COVER = b"\xff\xd8\xff\xe0" + bytes(2000)
+
+
+def _write_tagged_track(lib_path, artist, album, name, tags, artwork_bytes=COVER):
+    folder = os.path.join(lib_path, artist, album)
+    os.makedirs(folder, exist_ok=True)
+    path = write_track(os.path.join(folder, name))
+    if tags is not None:
+        itunes._TAG_WRITERS[os.path.splitext(name)[1]](path, tags, artwork_bytes)
+    return path
+
+
+@pytest.fixture()
+def tagged_library(tmp_path):
+    lib_path = str(tmp_path / "lib")
+    paths = [
+        _write_tagged_track(
+            lib_path,
+            "Artist",
+            "Album",
+            f"{i:02d}.{'mp3' if i % 2 else 'm4a'}",
+            song_tags(i, 3, album="Album"),
+        )
+        for i in range(1, 4)
+    ]
+    paths.append(
+        _write_tagged_track(
+            lib_path,
+            "Artist",
+            "Single",
+            "01.mp3",
+            song_tags(1, 1, album="Single"),
+            None,
+        )
+    )
+    paths.append(_write_tagged_track(lib_path, "Unknown", "Unknown", "raw.m4a", None))
+    # files the scanner must skip
+    with open(os.path.join(lib_path, "Artist", "Album", "cover.jpg"), "wb") as f:
+        f.write(COVER)
+    _write_tagged_track(
+        lib_path,
+        ".hidden",
+        "Album",
+        "01.mp3",
+        song_tags(1, 1, album="Hidden"),
+    )
+    yield lib_path, paths
+
+
+def test_walk_tracks(tagged_library):
+    lib_path, paths = tagged_library
+    found = list(catalog.walk_tracks(lib_path))
+    assert sorted(file.path for file in found) == sorted(paths)
+    for file in found:
+        stat = os.stat(file.path)
+        assert (file.inode, file.size, file.mtime_ns) == (
+            stat.st_ino,
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+
+
+def test_read_track_artwork(tagged_library):
+    lib_path, paths = tagged_library
+    file = next(f for f in catalog.walk_tracks(lib_path) if f.path == paths[0])
+
+    track = catalog.read_track(file)
+    assert track.tags.trackName == "Track 1"
+    assert track.artwork_md5 == hashlib.md5(COVER).hexdigest()
+    assert track.artwork_size == len(COVER)
+    assert track.artwork is None
+
+    assert catalog.read_track(file, include_artwork=True).artwork == COVER
+
+
+@pytest.mark.parametrize("max_workers", [0, 2])
+def test_scan_library(tagged_library, max_workers):
+    lib_path, paths = tagged_library
+    tracks = {
+        track.path: track
+        for track in catalog.scan_library(lib_path, max_workers=max_workers)
+    }
+    assert sorted(tracks) == sorted(paths)
+    assert tracks[paths[1]].tags.collectionName == "Album"
+    assert tracks[paths[1]].tags.trackNumber == 2
+    assert tracks[paths[3]].artwork_md5 is None
+    assert all(track.artwork is None for track in tracks.values())
+
+
+def test_read_tracks_bounded_batches(tagged_library):
+    lib_path, paths = tagged_library
+    files = list(catalog.walk_tracks(lib_path)) * 10
+    with ThreadPoolExecutor(2) as executor:
+        tracks = list(
+            catalog.read_tracks(files, max_workers=1, executor=executor, batch_size=3)
+        )
+    assert sorted(track.path for track in tracks) == sorted(file.path for file in files)
+
+
+def test_catalog(tagged_library, tmp_path):
+    lib_path, paths = tagged_library
+    db_path = str(tmp_path / "catalog.db")
+    with catalog.LibraryCatalog(db_path) as library_catalog:
+        assert library_catalog.add(catalog.scan_library(lib_path, max_workers=0)) == 5
+        assert library_catalog.add(catalog.scan_library(lib_path, max_workers=0)) == 5
+        assert len(library_catalog) == 5
+
+    with catalog.LibraryCatalog(db_path) as library_catalog:
+        assert len(library_catalog) == 5
+        track = library_catalog.get(paths[0])
+        assert track.tags.trackName == "Track 1"
+        assert track.tags.trackCount == 3
+        assert track.artwork_size == len(COVER)
+        # untagged m4a files read as empty tags
+        assert library_catalog.get(paths[4]).tags.trackName == ""
+        assert library_catalog.get("missing.mp3") is None
+
+        tracks = library_catalog.album_tracks("artist", "ALBUM")
+        assert [track.tags.trackNumber for track in tracks] == [1, 2, 3]
+
+        album = itunes_api.ItunesApiAlbumKeys(
+            artistName="Artist", collectionName="Album", trackCount=3
+        )
+        assert library_catalog.is_album_tagged(album)
+        library_catalog.remove([paths[2]])
+        assert not library_catalog.is_album_tagged(album)
+
+        single = itunes_api.ItunesApiAlbumKeys(
+            artistName="Artist", collectionName="Single", trackCount=1
+        )
+        assert not library_catalog.is_album_tagged(single)
+        assert library_catalog.is_album_tagged(single, require_artwork=False)
+
+
+def _bump_mtime(path: str):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def test_rescan(tagged_library, monkeypatch):
+    lib_path, paths = tagged_library
+    library_catalog = catalog.LibraryCatalog()
+    diff = library_catalog.rescan(lib_path, max_workers=0)
+    assert sorted(diff.added) == sorted(paths)
+    assert (diff.changed, diff.removed, diff.unchanged) == ([], [], 0)
+
+    read = []
+    read_track = catalog.read_track
+    monkeypatch.setattr(
+        catalog,
+        "read_track",
+        lambda file, *args: read.append(file.path) or read_track(file, *args),
+    )
+    diff = library_catalog.rescan(lib_path)
+    assert diff == catalog.CatalogDiff([], [], [], 5)
+    assert not read
+
+    # retag, delete, add and rename (same inode, new path) tracks
+    itunes._TAG_WRITERS[".mp3"](paths[0], song_tags(1, 3, album="Album", artist="New"))
+    _bump_mtime(paths[0])
+    os.remove(paths[1])
+    added = _write_tagged_track(
+        lib_path, "Artist", "Album", "04.m4a", song_tags(4, 4, album="Album")
+    )
+    renamed = os.path.join(os.path.dirname(paths[3]), "renamed.mp3")
+    os.rename(paths[3], renamed)
+
+    diff = library_catalog.rescan(lib_path)
+    assert diff.changed == [paths[0]]
+    assert sorted(diff.added) == sorted([added, renamed])
+    assert sorted(diff.removed) == sorted([paths[1], paths[3]])
+    assert diff.unchanged == 2
+    assert sorted(read) == sorted([paths[0], added, renamed])
+    assert library_catalog.get(paths[0]).tags.artistName == "New"
+    assert library_catalog.get(paths[1]) is None
+    assert len(library_catalog) == 5
+
+
+def test_rescan_only_touches_root(tagged_library, tmp_path):
+    lib_path, paths = tagged_library
+    other_path = str(tmp_path / "lib other")
+    other = _write_tagged_track(
+        other_path,
+        "Artist",
+        "Album",
+        "01.mp3",
+        song_tags(1, 1, album="Album"),
+    )
+    library_catalog = catalog.LibraryCatalog()
+    library_catalog.rescan(other_path, max_workers=0)
+    library_catalog.rescan(lib_path, max_workers=0)
+
+    assert set(library_catalog.snapshot(lib_path)) == set(paths)
+    diff = library_catalog.rescan(lib_path, max_workers=0)
+    assert diff.removed == [] and diff.unchanged == 5
+    assert library_catalog.get(other) is not None
@@ -1,8 +1,21 @@
 import pytest
 import os, sys, shutil
+import threading
+from dataclasses import dataclass
+from urllib.parse import parse_qs, urlparse
 from pydantic import BaseModel
+from requests.structures import CaseInsensitiveDict
 
 from songbirdcore import common
+from songbirdcore.bench import http_stub
+
+# synthetic tracks and their tag data, built by the benchmark helpers
+from songbirdcore.bench.synthetic import album_tags, song_tags, write_track
+
+FIXTURES_FOLDER = os.path.join(
+    sys.path[0], "..", "..", "songbirdcore", "bench", "resources"
+)
+"""api response fixtures, shipped with the benchmarks of the package"""
 
 
 @pytest.fixture
@@ -15,6 +28,52 @@ def create_test_folder():
     shutil.rmtree(tests_data_folder)
 
 
+@dataclass
+class StubRequest:
+    method: str
+    path: str
+    query: dict
+    headers: dict
+    body: bytes
+    client_address: tuple
+
+
+class StubHTTPServer(http_stub.StubServer):
+    """local http server standing in for remote apis in tests.
+
+    routes maps a url path to either a (status, headers, body) tuple or a
+    callable taking a StubRequest and returning one. Every request received
+    is kept in requests.
+    """
+
+    def __init__(self):
+        super().__init__({})
+        self.requests = []
+
+    def respond(self, handler) -> http_stub.Response:
+        parsed = urlparse(handler.path)
+        length = int(handler.headers.get("Content-Length", 0))
+        request = StubRequest(
+            method=handler.command,
+            path=parsed.path,
+            query=parse_qs(parsed.query),
+            headers=CaseInsensitiveDict(handler.headers),
+            body=handler.rfile.read(length) if length else b"",
+            client_address=handler.client_address,
+        )
+        self.requests.append(request)
+        route = self.routes.get(parsed.path)
+        if route is None:
+            return 404, {}, b""
+        return route(request) if callable(route) else route
+
+
+@pytest.fixture
+def stub_http_server():
+    with StubHTTPServer() as server:
+        yield server
+
+
 def test_load_data():
     toml_path = os.path.join(sys.path[0], "..", "..", "pyproject.toml")
     data = common.load_toml(toml_path)
@@ -57,6 +116,78 @@ def test_fname_duper_fails(create_dummy_file):
     assert fname is None
 
 
+def test_fname_duper_names(tmp_path):
+    for name in ["song.mp3", "songdup.mp3"]:
+        (tmp_path / name).touch()
+    fname = common.fname_duper(
+        str(tmp_path / "song.mp3"), limit=5, count=1, dup_key="dup"
+    )
+    assert fname == str(tmp_path / "songdupdup.mp3")
+    fname = common.fname_duper(
+        str(tmp_path / "new.mp3"), limit=5, count=1, dup_key="dup"
+    )
+    assert fname == str(tmp_path / "new.mp3")
+
+
+def test_fname_duper_does_not_list_folder(tmp_path, monkeypatch):
+    """fname_duper checks its candidates one by one, without listing the folder"""
+    (tmp_path / "song.mp3").touch()
+    monkeypatch.setattr(os, "listdir", None)
+    fname = common.fname_duper(
+        str(tmp_path / "song.mp3"), limit=5, count=1, dup_key="dup"
+    )
+    assert fname == str(tmp_path / "songdup.mp3")
+
+
+def test_fname_resolver(tmp_path):
+    for name in ["song.mp3", "song 2.mp3"]:
+        (tmp_path / name).touch()
+    resolver = common.FnameResolver(str(tmp_path))
+    names = [os.path.basename(resolver.resolve("song.mp3")) for _ in range(3)]
+    assert names == ["song 1.mp3", "song 3.mp3", "song 4.mp3"]
+    assert resolver.resolve("other.mp3") == str(tmp_path / "other.mp3")
+    # resolve does not touch the file system
+    assert sorted(os.listdir(tmp_path)) == ["song 2.mp3", "song.mp3"]
+
+
+def test_fname_resolver_existing_and_limit():
+    resolver = common.FnameResolver(
+        "folder", existing=["a.txt", "a-1.txt"], dup_key="-", limit=3
+    )
+    assert resolver.resolve("a.txt") == os.path.join("folder", "a-2.txt")
+    assert resolver.resolve("a.txt") == os.path.join("folder", "a-3.txt")
+    assert resolver.resolve("a.txt") is None
+    assert "a-3.txt" in resolver
+
+
+def test_fname_resolver_create(tmp_path):
+    (tmp_path / "song.mp3").touch()
+    resolver = common.FnameResolver(str(tmp_path))
+    # created by another process after the folder was listed
+    (tmp_path / "song 1.mp3").touch()
+    assert resolver.create("song.mp3") == str(tmp_path / "song 2.mp3")
+    assert (tmp_path / "song 2.mp3").exists()
+
+
+def test_unique_fname_concurrent_create(tmp_path):
+    (tmp_path / "song.mp3").touch()
+    barrier = threading.Barrier(8)
+    paths = []
+
+    def create():
+        barrier.wait()
+        # each thread lists the folder on its own, like separate downloaders
+        paths.append(common.unique_fname(str(tmp_path / "song.mp3"), exclusive=True))
+
+    threads = [threading.Thread(target=create) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(paths)) == 8
+    assert len(os.listdir(tmp_path)) == 9
+
+
 def test_remove_illegal_characters():
     """test remove illegal character"""
     try:
@@ -113,3 +244,33 @@ def tests_pretty_lst_printer():
         common.pretty_lst_printer(["hi", "there"])
     except Exception as e:
         pytest.fail(f"Unexpected exception: {e}")
+
+
+def test_remove_illegal_characters_custom_set():
+    """only the configured characters are stripped"""
+    result = common.remove_illegal_characters(
+        'a/b:c?"d', illegal_characters=common.POSIX_ILLEGAL_CHARACTERS
+    )
+    assert result == 'ab:c?"d'
+
+
+@pytest.mark.parametrize(
+    "platform,expected",
+    [
+        ("win32", common.WINDOWS_ILLEGAL_CHARACTERS),
+        ("darwin", common.MACOS_ILLEGAL_CHARACTERS),
+        ("linux", common.POSIX_ILLEGAL_CHARACTERS),
+    ],
+)
+def test_platform_illegal_characters(platform, expected):
+    assert common.platform_illegal_characters(platform) == expected
+
+
+def test_sanitize_many():
+    """bulk sanitization matches sanitizing each name, including names
+    containing the characters used to join them"""
+    filenames = ["a:b", "c\nd?", "", "e\x00f*", "ünïcödé|"]
+    assert common.sanitize_many(filenames) == [
+        common.remove_illegal_characters(filename) for filename in filenames
+    ]
+    assert common.sanitize_many([]) == []
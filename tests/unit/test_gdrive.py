@@ -0,0 +1,302 @@
+import pytest
+
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import time
+
+from google.auth.credentials import AnonymousCredentials
+
+from songbirdcore import gdrive
+from test_common import StubRequest, stub_http_server
+
+CHUNK_SIZE = 256 * 1024
+FOLDER_ID = "folder-1"
+
+
+class StubDrive:
+    """the drive v3 resumable upload protocol, served by the stub http server.
+
+    `failures` lists statuses returned, in order, to the next chunk uploads.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.sessions = {}
+        self.files = {}
+        self.failures = []
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+
+    def handle(self, request: StubRequest):
+        if request.method == "POST":
+            return self._start(request)
+        return self._put(request)
+
+    def add_file(self, folder_id: str, name: str, data: bytes) -> str:
+        file_id = f"file-{next(self._file_ids)}"
+        self.files[file_id] = {
+            "metadata": {"name": name, "parents": [folder_id]},
+            "data": bytearray(data),
+        }
+        return file_id
+
+    def list_files(self, request: StubRequest):
+        folder_id = re.match(r"'(.+)' in parents", request.query["q"][0]).group(1)
+        page_size = int(request.query["pageSize"][0])
+        offset = int(request.query.get("pageToken", ["0"])[0])
+        matching = [
+            {
+                "id": file_id,
+                "name": file["metadata"]["name"],
+                "size": str(len(file["data"])),
+                "md5Checksum": hashlib.md5(file["data"]).hexdigest(),
+            }
+            for file_id, file in self.files.items()
+            if folder_id in file["metadata"]["parents"]
+        ]
+        page = {"files": matching[offset : offset + page_size]}
+        if offset + page_size < len(matching):
+            page["nextPageToken"] = str(offset + page_size)
+        return 200, {"Content-Type": "application/json"}, json.dumps(page).encode()
+
+    def lists(self):
+        return [r for r in self.server.requests if r.path == "/drive/v3/files"]
+
+    def uploads(self):
+        return [r for r in self.server.requests if r.method == "POST"]
+
+    def _start(self, request: StubRequest):
+        with self.lock:
+            upload_id = str(next(self._ids))
+            self.sessions[upload_id] = {
+                "metadata": json.loads(request.body),
+                "mimetype": request.headers["X-Upload-Content-Type"],
+                "data": bytearray(),
+            }
+        location = f"{self.server.url}/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}"
+        return 200, {"Location": location}, b""
+
+    def _put(self, request: StubRequest):
+        session = self.sessions[request.query["upload_id"][0]]
+        content_range = request.headers["Content-Range"]
+        if not content_range.startswith("bytes */"):
+            with self.lock:
+                status = self.failures.pop(0) if self.failures else None
+            if status is not None:
+                return status, {}, b""
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+)", content_range)
+        if match is not None:
+            start, end, total = map(int, match.groups())
+            assert start == len(session["data"])
+            session["data"] += request.body
+        else:
+            # status query after a failed chunk
+            total = int(content_range.split("/")[1])
+        if len(session["data"]) < total:
+            headers = {}
+            if session["data"]:
+                headers["Range"] = f"bytes=0-{len(session['data']) - 1}"
+            return 308, headers, b""
+        file_id = f"file-{next(self._file_ids)}"
+        self.files[file_id] = session
+        body = json.dumps({"id": file_id}).encode()
+        return 200, {"Content-Type": "application/json"}, body
+
+    def chunk_puts(self):
+        return [
+            r
+            for r in self.server.requests
+            if r.method == "PUT"
+            and not r.headers["Content-Range"].startswith("bytes */")
+        ]
+
+
+@pytest.fixture()
+def stub_drive(stub_http_server):
+    drive = StubDrive(stub_http_server)
+    stub_http_server.routes["/upload/drive/v3/files"] = drive.handle
+    stub_http_server.routes["/drive/v3/files"] = drive.list_files
+    yield drive
+
+
+@pytest.fixture()
+def uploader(stub_drive):
+    return gdrive.DriveUploader(
+        credentials=AnonymousCredentials(),
+        chunk_size=CHUNK_SIZE,
+        backoff=0,
+        root_url=stub_drive.server.url,
+    )
+
+
+def _song(folder, name: str, size: int) -> str:
+    path = os.path.join(folder, name)
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return path
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_upload_chunked(uploader, stub_drive, tmp_path):
+    path = _song(tmp_path, "song.mp3", 2 * CHUNK_SIZE + 1000)
+    file_id = uploader.upload(FOLDER_ID, "My Song.mp3", path)
+
+    uploaded = stub_drive.files[file_id]
+    assert uploaded["data"] == _read(path)
+    assert uploaded["metadata"] == {"name": "My Song.mp3", "parents": [FOLDER_ID]}
+    assert uploaded["mimetype"] == "audio/mpeg"
+    assert len(stub_drive.chunk_puts()) == 3
+
+
+def test_upload_retries_failed_chunk(uploader, stub_drive, tmp_path):
+    path = _song(tmp_path, "song.m4a", 2 * CHUNK_SIZE + 1000)
+    uploader.upload(FOLDER_ID, "song.m4a", path)
+    stub_drive.failures = [503, 500]
+    stub_drive.server.requests.clear()
+    file_id = uploader.upload(FOLDER_ID, "song.m4a", path)
+
+    assert stub_drive.files[file_id]["data"] == _read(path)
+    # the failed chunk is resent, the upload is not restarted
+    starts = [r for r in stub_drive.server.requests if r.method == "POST"]
+    assert len(starts) == 1
+    assert len(stub_drive.chunk_puts()) == 3 + 2
+
+
+def test_upload_gives_up(stub_drive, tmp_path):
+    uploader = gdrive.DriveUploader(
+        credentials=AnonymousCredentials(),
+        chunk_size=CHUNK_SIZE,
+        num_retries=2,
+        backoff=0,
+        root_url=stub_drive.server.url,
+    )
+    stub_drive.failures = [503] * 3
+    with pytest.raises(gdrive.HttpError):
+        uploader.upload(FOLDER_ID, "song.mp3", _song(tmp_path, "song.mp3", 1000))
+
+    stub_drive.failures = [403]
+    with pytest.raises(gdrive.HttpError):
+        uploader.upload(FOLDER_ID, "song.mp3", _song(tmp_path, "song.mp3", 1000))
+    assert not stub_drive.files
+
+
+def test_upload_many(uploader, stub_drive, tmp_path):
+    songs = [
+        (f"song {i}.mp3", _song(tmp_path, f"{i}.mp3", CHUNK_SIZE + i)) for i in range(6)
+    ]
+    songs.append(("missing.mp3", str(tmp_path / "missing.mp3")))
+    file_ids = uploader.upload_many(FOLDER_ID, songs)
+
+    assert file_ids[-1] is None
+    for (song_name, song_path), file_id in zip(songs, file_ids[:-1]):
+        uploaded = stub_drive.files[file_id]
+        assert uploaded["metadata"]["name"] == song_name
+        assert uploaded["data"] == _read(song_path)
+
+
+def test_save_song_reuses_uploader(stub_drive, tmp_path, monkeypatch):
+    created = []
+    drive_uploader = gdrive.DriveUploader
+
+    def uploader(**kwargs):
+        created.append(kwargs)
+        return drive_uploader(
+            credentials=AnonymousCredentials(), root_url=stub_drive.server.url, **kwargs
+        )
+
+    monkeypatch.setattr(gdrive, "DriveUploader", uploader)
+    monkeypatch.setattr(gdrive, "_uploaders", {})
+    for i in range(3):
+        path = _song(tmp_path, f"{i}.mp3", 100)
+        file_id = gdrive.save_song(
+            FOLDER_ID, "credentials.json", "token.json", f"{i}.mp3", path, 8080
+        )
+        assert stub_drive.files[file_id]["data"] == _read(path)
+    assert len(created) == 1
+
+
+@pytest.fixture()
+def dedup_uploader(stub_drive, tmp_path, monkeypatch):
+    monkeypatch.setattr(gdrive, "_LIST_PAGE_SIZE", 2)
+    return gdrive.DriveUploader(
+        credentials=AnonymousCredentials(),
+        backoff=0,
+        root_url=stub_drive.server.url,
+        manifest=gdrive.DriveManifest(str(tmp_path / "manifest.json")),
+    )
+
+
+def test_file_md5(tmp_path):
+    path = _song(tmp_path, "song.mp3", 3 * 1024 + 5)
+    assert (
+        gdrive.file_md5(path, chunk_size=1024) == hashlib.md5(_read(path)).hexdigest()
+    )
+
+
+def test_upload_dedup(dedup_uploader, stub_drive, tmp_path):
+    existing = [os.urandom(100 + i) for i in range(5)]
+    existing_ids = [
+        stub_drive.add_file(FOLDER_ID, f"old {i}.mp3", data)
+        for i, data in enumerate(existing)
+    ]
+    stub_drive.add_file("other-folder", "other.mp3", b"elsewhere")
+
+    path = str(tmp_path / "renamed.mp3")
+    with open(path, "wb") as f:
+        f.write(existing[3])
+    assert dedup_uploader.upload(FOLDER_ID, "renamed.mp3", path) == existing_ids[3]
+    # 5 files listed 2 per page
+    assert len(stub_drive.lists()) == 3
+    assert not stub_drive.uploads()
+
+    other = str(tmp_path / "other.mp3")
+    with open(other, "wb") as f:
+        f.write(b"elsewhere")
+    new_ids = dedup_uploader.upload_many(
+        FOLDER_ID, [("other.mp3", other), ("new.mp3", _song(tmp_path, "new.mp3", 50))]
+    )
+    assert len(stub_drive.uploads()) == 2 and len(set(new_ids)) == 2
+    # uploads are added to the manifest, no need to list the folder again
+    assert dedup_uploader.upload(FOLDER_ID, "again.mp3", other) == new_ids[0]
+    assert len(stub_drive.lists()) == 3
+
+
+def test_manifest_persisted(dedup_uploader, stub_drive, tmp_path):
+    path = _song(tmp_path, "song.mp3", 100)
+    file_id = dedup_uploader.upload(FOLDER_ID, "song.mp3", path)
+    clock = [time.time()]
+    manifest = gdrive.DriveManifest(
+        str(tmp_path / "manifest.json"), ttl=60, clock=lambda: clock[0]
+    )
+    assert manifest.find(FOLDER_ID, 100, gdrive.file_md5(path)) == {
+        "id": file_id,
+        "name": "song.mp3",
+    }
+    uploader = gdrive.DriveUploader(
+        credentials=AnonymousCredentials(),
+        root_url=stub_drive.server.url,
+        manifest=manifest,
+    )
+    assert uploader.upload(FOLDER_ID, "song.mp3", path) == file_id
+    assert len(stub_drive.lists()) == 1
+
+    # a stale listing is refreshed, dropping files deleted from drive
+    clock[0] += 60
+    del stub_drive.files[file_id]
+    assert uploader.upload(FOLDER_ID, "song.mp3", path) != file_id
+    assert len(stub_drive.lists()) == 2
+
+
+def test_manifest_other_version(tmp_path):
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps({"version": -1, "folders": {"f": {}}}))
+    assert gdrive.DriveManifest(str(path)).find("f", 1, "x") is None
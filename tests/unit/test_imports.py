@@ -0,0 +1,114 @@
+import pytest
+
+import importlib
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = [
+    "eyed3",
+    "mutagen",
+    "yt_dlp",
+    "requests_html",
+    "googleapiclient",
+    "google_auth_oauthlib",
+    "playwright",
+]
+"""dependencies only loaded on first use, never by importing a module"""
+
+IMPORT_BUDGETS_S = {
+    "songbirdcore.common": 0.4,
+    "songbirdcore.itunes": 0.8,
+}
+"""cumulative import time allowed for modules imported by short lived workers,
+checked when IMPORT_BUDGETS is set"""
+
+
+def _importtime(module: str):
+    """Import module in a fresh interpreter with -X importtime
+
+    Returns:
+        the cumulative import time of module in seconds, and the names of all
+        the modules imported along with it
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+    )
+    cumulative_us = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            cumulative_us[name.strip()] = int(cumulative)
+    return cumulative_us[module] / 1e6, set(cumulative_us)
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "songbirdcore.common",
+        "songbirdcore.itunes",
+        "songbirdcore.catalog",
+        "songbirdcore.youtube",
+        "songbirdcore.gdrive",
+        "songbirdcore.web",
+    ],
+)
+def test_heavy_dependencies_are_lazy(module):
+    _, imported = _importtime(module)
+    loaded = [
+        heavy
+        for heavy in HEAVY_MODULES
+        if any(name == heavy or name.startswith(heavy + ".") for name in imported)
+    ]
+    assert loaded == []
+
+
+@pytest.mark.skipif(
+    os.getenv("IMPORT_BUDGETS", None) is None,
+    reason="Wall clock budgets depend on the machine, opt in with IMPORT_BUDGETS=1",
+)
+@pytest.mark.parametrize("module", list(IMPORT_BUDGETS_S))
+def test_import_time_budget(module):
+    # best of a few runs, the first one may also be compiling bytecode
+    duration = min(_importtime(module)[0] for _ in range(3))
+    assert duration < IMPORT_BUDGETS_S[module]
+
+
+@pytest.mark.parametrize(
+    "module,name,dependency,attribute",
+    [
+        ("songbirdcore.youtube", "youtube_dl", "yt_dlp", None),
+        ("songbirdcore.youtube", "DownloadError", "yt_dlp.utils", "DownloadError"),
+        ("songbirdcore.youtube", "ExtractorError", "yt_dlp.utils", "ExtractorError"),
+        (
+            "songbirdcore.youtube",
+            "UnavailableVideoError",
+            "yt_dlp.utils",
+            "UnavailableVideoError",
+        ),
+        ("songbirdcore.web", "HTML", "requests_html", "HTML"),
+        ("songbirdcore.web", "HTMLSession", "requests_html", "HTMLSession"),
+        ("songbirdcore.web", "DEFAULT_ENCODING", "requests_html", "DEFAULT_ENCODING"),
+        ("songbirdcore.gdrive", "HttpError", "googleapiclient.errors", "HttpError"),
+    ],
+)
+def test_lazy_attributes(module, name, dependency, attribute):
+    """names of dependencies formerly imported at module level still resolve"""
+    expected = importlib.import_module(dependency)
+    if attribute is not None:
+        expected = getattr(expected, attribute)
+    assert getattr(importlib.import_module(module), name) is expected
+
+
+def test_lazy_attributes_missing():
+    from songbirdcore import youtube
+
+    with pytest.raises(AttributeError):
+        youtube.not_an_attribute
@@ -3,10 +3,19 @@ import pytest
 from typing import List, Union
 import shutil
 import os, sys
+import asyncio
+import json
+import requests
 
-from songbirdcore import itunes
+from songbirdcore import artwork, itunes
 from songbirdcore.models import modes, itunes_api
-from test_common import create_test_folder
+from test_common import (
+    FIXTURES_FOLDER,
+    album_tags,
+    create_test_folder,
+    stub_http_server,
+)
+from test_artwork import artwork_url, stub_artwork_server
 
 RESOURCES_FOLDER = "resources"
 
@@ -175,3 +184,304 @@ def test_m4a_no_artwork_tagger_round_trip(create_test_folder, query_api):
     model, artwork_bytes = itunes.m4a_tag_reader(output_fpath)
     _assert_round_trip(model, tags)
     assert artwork_bytes is None
+
+
+def test_itunes_lib_search_many(get_itunes_lib_path):
+    """batched search returns the same results as one search per query"""
+    queries = ["empty", "jolene", "JOLENE", "", "artist1", "nothing"]
+    results = itunes.itunes_lib_search_many(
+        itunes_lib_path=get_itunes_lib_path, queries=queries
+    )
+    assert results == [
+        itunes.itunes_lib_search(get_itunes_lib_path, query) for query in queries
+    ]
+
+
+def test_itunes_lib_search_many_with_props(get_itunes_lib_path):
+    """batched search enhanced with album properties"""
+    props = itunes_api.ItunesApiAlbumKeys(
+        artistName="Dolly Parton", collectionName="Jolene", trackCount=11
+    )
+    queries = ["jolene", "empty"]
+    results = itunes.itunes_lib_search_many(
+        itunes_lib_path=get_itunes_lib_path, queries=queries, album_properties=props
+    )
+    assert results == [
+        itunes.itunes_lib_search(get_itunes_lib_path, query, props) for query in queries
+    ]
+    assert len(results[0]) == 1
+
+
+@pytest.fixture()
+def itunes_lookup_payload() -> bytes:
+    """recorded itunes lookup response for an album, its first result is the album itself"""
+    with open(os.path.join(FIXTURES_FOLDER, "itunes-lookup-jolene.json"), "rb") as f:
+        return f.read()
+
+
+@pytest.fixture()
+def stub_itunes_api(stub_http_server, itunes_lookup_payload):
+    stub_http_server.routes["/lookup"] = (
+        200,
+        {"Content-Type": "application/json"},
+        itunes_lookup_payload,
+    )
+    stub_http_server.routes["/search"] = (500, {}, b"oops")
+    yield stub_http_server
+
+
+def test_query_api_stub(stub_itunes_api):
+    """results that are not songs are skipped and release dates are trimmed to the year"""
+    results = itunes.query_api(
+        search_variable="1062400323",
+        limit=11,
+        mode=modes.Modes.SONG,
+        lookup=True,
+        base_url=stub_itunes_api.url,
+    )
+    assert len(results) == 10
+    assert results[0].trackName == "Jolene"
+    assert all(result.releaseDate == "1974" for result in results)
+    assert stub_itunes_api.requests[0].query == {
+        "id": ["1062400323"],
+        "entity": ["song"],
+        "limit": ["11"],
+    }
+
+
+def test_query_api_stub_error(stub_itunes_api):
+    results = itunes.query_api(
+        search_variable="jolene",
+        limit=11,
+        mode=modes.Modes.SONG,
+        base_url=stub_itunes_api.url,
+    )
+    assert results is None
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_parse_api_response(itunes_lookup_payload, monkeypatch, caplog, use_orjson):
+    """invalid results are skipped, the others are parsed in a single pass"""
+    if not use_orjson:
+        monkeypatch.setattr(itunes, "orjson", None)
+    payload = itunes._loads(itunes_lookup_payload)
+    album, songs = payload["results"][0], payload["results"][1:]
+    mislabelled = dict(songs[1], releaseDateKey="otherDate", otherDate="2001-01-01")
+    payload["results"] = [album, songs[0], None, mislabelled, songs[2]]
+
+    results = itunes.parse_api_response(payload, modes.Modes.SONG)
+    assert [result.trackName for result in results] == [
+        songs[0]["trackName"],
+        songs[1]["trackName"],
+        songs[2]["trackName"],
+    ]
+    assert [result.releaseDate for result in results] == ["1974", "2001", "1974"]
+    skipped = [r.message for r in caplog.records if "Skipping" in r.message]
+    assert len(skipped) == 2
+    assert "index [0]" in skipped[0] and "index [2]" in skipped[1]
+
+    albums = itunes.parse_api_response(payload, modes.Modes.ALBUM)
+    assert len(albums) == 4
+    assert albums[0].collectionName == album["collectionName"]
+
+
+@pytest.fixture()
+def stub_paged_search(stub_http_server, itunes_lookup_payload):
+    """search api serving 23 songs by limit and offset, the 6th one invalid"""
+    songs = json.loads(itunes_lookup_payload)["results"][1:]
+    results = [
+        dict(songs[i % len(songs)], trackName=f"Track {i}", trackNumber=i)
+        for i in range(23)
+    ]
+    del results[5]["trackName"]
+
+    def search(request):
+        offset = int(request.query.get("offset", ["0"])[0])
+        limit = int(request.query["limit"][0])
+        page = results[offset : offset + limit]
+        body = json.dumps({"resultCount": len(page), "results": page}).encode()
+        return 200, {"Content-Type": "application/json"}, body
+
+    stub_http_server.routes["/search"] = search
+    yield stub_http_server
+
+
+def _page_queries(server):
+    return [
+        (int(r.query["offset"][0]), int(r.query["limit"][0])) for r in server.requests
+    ]
+
+
+@pytest.mark.parametrize("prefetch", [True, False])
+def test_iter_query_api(stub_paged_search, prefetch):
+    with requests.Session() as session:
+        results = itunes.iter_query_api(
+            "jolene",
+            modes.Modes.SONG,
+            page_size=10,
+            base_url=stub_paged_search.url,
+            session=session,
+            prefetch=prefetch,
+        )
+        assert [result.trackNumber for result in results] == [
+            i for i in range(23) if i != 5
+        ]
+    assert _page_queries(stub_paged_search) == [(0, 10), (10, 10), (20, 10)]
+    assert stub_paged_search.requests[0].query["term"] == ["jolene"]
+
+
+def test_iter_query_api_max_results(stub_paged_search):
+    results = itunes.iter_query_api(
+        "jolene",
+        modes.Modes.SONG,
+        page_size=10,
+        max_results=15,
+        base_url=stub_paged_search.url,
+    )
+    assert len(list(results)) == 14
+    assert _page_queries(stub_paged_search) == [(0, 10), (10, 5)]
+
+
+def test_iter_query_api_page_size_cap(stub_http_server, itunes_lookup_payload):
+    """pages are requested at most MAX_PAGE_SIZE at a time, as the api returns no more"""
+    song = json.loads(itunes_lookup_payload)["results"][1]
+    songs = [dict(song, trackNumber=i) for i in range(450)]
+
+    def search(request):
+        offset = int(request.query["offset"][0])
+        limit = min(int(request.query["limit"][0]), itunes.MAX_PAGE_SIZE)
+        page = songs[offset : offset + limit]
+        body = json.dumps({"resultCount": len(page), "results": page}).encode()
+        return 200, {"Content-Type": "application/json"}, body
+
+    stub_http_server.routes["/search"] = search
+    results = itunes.iter_query_api(
+        "jolene", modes.Modes.SONG, page_size=500, base_url=stub_http_server.url
+    )
+    assert [result.trackNumber for result in results] == list(range(450))
+    assert _page_queries(stub_http_server) == [(0, 200), (200, 200), (400, 200)]
+
+
+def test_iter_query_api_stops_early(stub_paged_search):
+    results = itunes.iter_query_api(
+        "jolene", modes.Modes.SONG, page_size=5, base_url=stub_paged_search.url
+    )
+    for result in results:
+        break
+    results.close()
+    # the first page and at most the prefetched one were requested
+    assert len(stub_paged_search.requests) <= 2
+    assert result.trackNumber == 0
+
+
+def test_iter_query_api_failures(stub_http_server, itunes_lookup_payload):
+    stub_http_server.routes["/search"] = (500, {}, b"oops")
+    results = itunes.iter_query_api(
+        "jolene", modes.Modes.SONG, base_url=stub_http_server.url
+    )
+    assert list(results) == []
+
+    # a lookup ignoring the offset serves the same page forever
+    stub_http_server.routes["/lookup"] = (
+        200,
+        {"Content-Type": "application/json"},
+        itunes_lookup_payload,
+    )
+    results = itunes.iter_query_api(
+        "1062400323",
+        modes.Modes.SONG,
+        lookup=True,
+        page_size=5,
+        base_url=stub_http_server.url,
+    )
+    assert len(list(results)) == 10
+    assert len(stub_http_server.requests) == 1 + 2
+
+    with pytest.raises(ValueError):
+        next(itunes.iter_query_api("jolene", modes.Modes.SONG, page_size=0))
+
+
+def test_async_client_query_many(stub_itunes_api):
+    """queries run concurrently over pooled keep-alive connections"""
+    n_queries = 20
+    concurrency = 4
+
+    async def run():
+        async with itunes.AsyncItunesClient(
+            base_url=stub_itunes_api.url, concurrency=concurrency
+        ) as client:
+            return await client.query_many(
+                [str(i) for i in range(n_queries)],
+                limit=11,
+                mode=modes.Modes.SONG,
+                lookup=True,
+            )
+
+    results = asyncio.run(run())
+    expected = itunes.query_api(
+        "0", 11, modes.Modes.SONG, lookup=True, base_url=stub_itunes_api.url
+    )
+    assert len(results) == n_queries
+    assert all(result == expected for result in results)
+    assert {request.query["id"][0] for request in stub_itunes_api.requests[:-1]} == {
+        str(i) for i in range(n_queries)
+    }
+    # connections are reused rather than opened per request
+    clients = {request.client_address for request in stub_itunes_api.requests[:-1]}
+    assert len(clients) <= concurrency
+
+
+def test_async_client_failures(stub_itunes_api):
+    """http errors and unreachable servers resolve to None without failing the batch"""
+
+    async def run():
+        async with itunes.AsyncItunesClient(base_url=stub_itunes_api.url) as client:
+            bad = itunes.AsyncItunesClient(base_url="http://127.0.0.1:1", timeout=1)
+            try:
+                return await asyncio.gather(
+                    client.query("jolene", 11, modes.Modes.SONG),
+                    bad.query("jolene", 11, modes.Modes.SONG),
+                    client.query("1", 11, modes.Modes.ALBUM, lookup=True),
+                )
+            finally:
+                bad.close()
+
+    search, unreachable, albums = asyncio.run(run())
+    assert search is None
+    assert unreachable is None
+    assert len(albums) == 11
+
+
+def test_tag_album(create_test_folder, stub_artwork_server, artwork_url):
+    """every file is tagged with the right backend and the cover is downloaded once"""
+    file_paths = []
+    for i, ext in enumerate(["mp3", "m4a", "mp3", "m4a", "txt"]):
+        file_path = os.path.join(create_test_folder, f"{i}.{ext}")
+        if ext == "txt":
+            open(file_path, "w").close()
+        else:
+            shutil.copy(
+                os.path.join(sys.path[0], RESOURCES_FOLDER, f"empty.{ext}"), file_path
+            )
+        file_paths.append(file_path)
+    tags = album_tags(len(file_paths), artwork_url)
+
+    fetcher = artwork.ArtworkFetcher()
+    results = itunes.tag_album(file_paths, tags, artwork_fetcher=fetcher, max_workers=3)
+    fetcher.close()
+
+    assert results == [True, True, True, True, False]
+    for file_path, expected in zip(file_paths[:4], tags):
+        if file_path.endswith(".mp3"):
+            model, artwork_bytes = itunes.mp3_tag_reader(file_path)
+        else:
+            model, artwork_bytes = itunes.m4a_tag_reader(file_path)
+        _assert_round_trip(model, expected)
+        assert artwork_bytes == b"art-1500x1500"
+    downloads = [r for r in stub_artwork_server.requests if r.method == "GET"]
+    assert len(downloads) == 1
+
+
+def test_tag_album_mismatched_lengths():
+    with pytest.raises(ValueError):
+        itunes.tag_album(["a.mp3"], [])
@@ -0,0 +1,124 @@
+import pytest
+
+import os, sys
+
+from songbirdcore import itunes, library
+from songbirdcore.models import itunes_api
+from test_common import create_test_folder
+
+RESOURCES_FOLDER = "resources"
+
+
+@pytest.fixture()
+def get_itunes_lib_path():
+    return os.path.join(sys.path[0], RESOURCES_FOLDER, "mock-itunes-lib")
+
+
+@pytest.fixture()
+def create_test_library(create_test_folder):
+    """creates a small itunes library within the test output folder"""
+    lib_path = os.path.join(create_test_folder, "lib")
+    for artist, album, track in [
+        ("dolly parton", "jolene", "01 jolene.mp3"),
+        ("dolly parton", "jolene", "02 when someone wants to leave.mp3"),
+        ("dolly parton", "9 to 5", "01 9 to 5.m4a"),
+        ("pentatonix", "PTX Vol. II", "jolene.m4a"),
+        (".hidden", "album", "jolene.mp3"),
+    ]:
+        os.makedirs(os.path.join(lib_path, artist, album), exist_ok=True)
+        with open(os.path.join(lib_path, artist, album, track), "w") as f:
+            f.write("song")
+    yield lib_path
+
+
+def _add_track(lib_path: str, artist: str, album: str, track: str):
+    os.makedirs(os.path.join(lib_path, artist, album), exist_ok=True)
+    path = os.path.join(lib_path, artist, album, track)
+    with open(path, "w") as f:
+        f.write("song")
+    # make sure the folder mtime changes even on coarse grained filesystems
+    st = os.stat(os.path.dirname(path))
+    os.utime(os.path.dirname(path), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    return path
+
+
+@pytest.mark.parametrize("search_parameters", ["jolene", "EMPTY", "album", "", "zzz"])
+def test_index_search_matches_glob(get_itunes_lib_path, search_parameters):
+    """the index must return the same results as a full glob of the library"""
+    index = library.LibraryIndex(get_itunes_lib_path)
+    index.refresh()
+    expected = itunes.itunes_lib_search(get_itunes_lib_path, search_parameters)
+    results = itunes.itunes_lib_search(
+        get_itunes_lib_path, search_parameters, index=index
+    )
+    assert results == expected
+
+
+def test_index_search_with_props(create_test_library):
+    props = itunes_api.ItunesApiAlbumKeys(
+        artistName="Dolly Parton", collectionName="Jolene", trackCount=2
+    )
+    index = library.LibraryIndex(create_test_library)
+    index.refresh()
+    expected = itunes.itunes_lib_search(create_test_library, "jolene", props)
+    results = itunes.itunes_lib_search(create_test_library, "jolene", props, index)
+    assert results == expected
+    assert len(results) == 1
+
+
+def test_index_persist_and_refresh(create_test_library, create_test_folder):
+    """index is saved, reloaded and picks up changes incrementally"""
+    index_path = os.path.join(create_test_folder, "index.json")
+    index = library.LibraryIndex.open(create_test_library, index_path)
+    assert os.path.exists(index_path)
+    assert len(index) == 4
+
+    reloaded = library.LibraryIndex(create_test_library, index_path)
+    assert reloaded.load()
+    assert reloaded.refresh() is False
+    assert reloaded.search("jolene") == index.search("jolene")
+
+    new_path = _add_track(create_test_library, "dolly parton", "jolene", "jolene.m4a")
+    assert reloaded.refresh() is True
+    assert new_path in reloaded.search("jolene")
+
+    new_artist_path = _add_track(create_test_library, "the weepies", "be my", "x.mp3")
+    os.utime(create_test_library, ns=(0, os.stat(create_test_library).st_mtime_ns + 1))
+    assert reloaded.refresh() is True
+    assert reloaded.search("weepies") == [new_artist_path]
+    assert reloaded.search("weepies") == itunes.itunes_lib_search(
+        create_test_library, "weepies"
+    )
+
+
+def test_index_ignores_other_library(create_test_library, create_test_folder):
+    index_path = os.path.join(create_test_folder, "index.json")
+    library.LibraryIndex.open(create_test_library, index_path)
+    other = library.LibraryIndex(create_test_folder, index_path)
+    assert other.load() is False
+
+
+def test_index_entries(create_test_library):
+    index = library.LibraryIndex(create_test_library)
+    index.refresh()
+    entries = list(index.entries())
+    assert len(entries) == 4
+    assert all(entry.size == 4 for entry in entries)
+    assert all(os.path.exists(entry.path) for entry in entries)
+
+
+def test_multi_term_matcher():
+    terms = ["he", "she", "his", "hers", "", "she"]
+    matcher = library.MultiTermMatcher(terms)
+    for text in ["ushers", "his", "", "xyz", "ahishers"]:
+        assert matcher.match(text) == {
+            idx for idx, term in enumerate(terms) if term in text
+        }
+
+
+def test_index_search_many_matches_search(create_test_library):
+    queries = ["jolene", "dolly", "9 to 5", "ptx vol. ii", "zzz"]
+    index = library.LibraryIndex(create_test_library)
+    index.refresh()
+    results = itunes.itunes_lib_search_many(create_test_library, queries, index=index)
+    assert results == [index.search(query) for query in queries]
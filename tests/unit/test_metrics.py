@@ -0,0 +1,297 @@
+import pytest
+
+import asyncio
+import contextlib
+import os
+from unittest import mock
+
+from songbirdcore import cache, itunes, metrics, web, youtube
+from songbirdcore.models import modes
+from test_common import create_test_folder, song_tags, stub_http_server, write_track
+from test_gdrive import FOLDER_ID, stub_drive, uploader
+from test_itunes import itunes_lookup_payload, stub_itunes_api, stub_paged_search
+from test_web import fake_browsers, render_pool
+
+
+@pytest.fixture()
+def instrumentation():
+    instrumentation = metrics.InMemoryInstrumentation()
+    previous = metrics.set_instrumentation(instrumentation)
+    yield instrumentation
+    metrics.set_instrumentation(previous)
+
+
+def test_noop_default():
+    assert type(metrics.get_instrumentation()) is metrics.Instrumentation
+    with metrics.span("stage", a=1) as span:
+        span.set_attribute("b", 2)
+        span.set_error("Error")
+    metrics.count("counter")
+    metrics.observe("timer", 1.0)
+
+
+def test_spans(instrumentation):
+    with metrics.span("outer", album="jolene") as outer:
+        with metrics.span("inner") as inner:
+            inner.set_attribute("cached", True)
+        with pytest.raises(ValueError):
+            with metrics.span("failing"):
+                raise ValueError()
+
+    assert instrumentation.span_names() == ["inner", "failing", "outer"]
+    inner, failing, outer = instrumentation.spans
+    assert inner.parent is outer and failing.parent is outer and outer.parent is None
+    assert inner.attributes == {"cached": True}
+    assert outer.attributes == {"album": "jolene"}
+    assert failing.error == "ValueError" and failing.status == "error"
+    assert outer.duration >= inner.duration + failing.duration
+    assert instrumentation.timings("inner", status="ok") == [inner.duration]
+    assert instrumentation.timings("failing", status="error") == [failing.duration]
+
+
+def test_counters_and_timed(instrumentation):
+    @metrics.timed("stage")
+    def stage(x):
+        return x * 2
+
+    assert stage(2) == 4
+    metrics.count("bytes", 10, kind="mp3")
+    metrics.count("bytes", 5, kind="mp3")
+    metrics.observe("timer", 0.5)
+
+    assert instrumentation.span_names() == ["stage"]
+    assert instrumentation.counter("bytes", kind="mp3") == 15
+    assert instrumentation.counter("bytes", kind="m4a") == 0
+    assert instrumentation.timings("timer") == [0.5]
+    instrumentation.reset()
+    assert not instrumentation.spans and instrumentation.counter("bytes") == 0
+
+
+def test_set_instrumentation_restores_default():
+    instrumentation = metrics.InMemoryInstrumentation()
+    previous = metrics.set_instrumentation(instrumentation)
+    assert metrics.set_instrumentation(None) is instrumentation
+    assert metrics.get_instrumentation() is not instrumentation
+    metrics.set_instrumentation(previous)
+
+
+def test_prometheus(tmp_path):
+    prometheus = metrics.PrometheusInstrumentation()
+    assert prometheus.render() == ""
+    prometheus.count("gdrive.uploaded_bytes", 100)
+    prometheus.count("itunes.cache", result="hit")
+    prometheus.count("itunes.cache", 2, result="miss")
+    prometheus.observe("youtube.postprocessor", 1.5, postprocessor='Ff"mpeg')
+    prometheus.observe("youtube.postprocessor", 0.5, postprocessor='Ff"mpeg')
+
+    assert prometheus.render() == (
+        "# TYPE songbirdcore_gdrive_uploaded_bytes_total counter\n"
+        "songbirdcore_gdrive_uploaded_bytes_total 100.0\n"
+        "# TYPE songbirdcore_itunes_cache_total counter\n"
+        'songbirdcore_itunes_cache_total{result="hit"} 1.0\n'
+        'songbirdcore_itunes_cache_total{result="miss"} 2.0\n'
+        "# TYPE songbirdcore_youtube_postprocessor_seconds summary\n"
+        'songbirdcore_youtube_postprocessor_seconds_count{postprocessor="Ff\\"mpeg"} 2.0\n'
+        'songbirdcore_youtube_postprocessor_seconds_sum{postprocessor="Ff\\"mpeg"} 2.0\n'
+    )
+
+    with prometheus.span("artwork.fetch"):
+        pass
+    assert (
+        'songbirdcore_artwork_fetch_seconds_count{status="ok"} 1.0'
+        in prometheus.render().splitlines()
+    )
+
+    path = str(tmp_path / "songbirdcore.prom")
+    prometheus.write(path)
+    with open(path) as f:
+        assert f.read() == prometheus.render()
+
+
+class FakeOtelSpan:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.exited_with = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class FakeTracer:
+    def __init__(self):
+        self.spans = []
+
+    def start_as_current_span(self, name, attributes=None):
+        tracer = self
+
+        class Context:
+            def __enter__(self):
+                self.span = FakeOtelSpan(name, attributes or {})
+                tracer.spans.append(self.span)
+                return self.span
+
+            def __exit__(self, exc_type, exc, tb):
+                self.span.exited_with = exc_type
+
+        return Context()
+
+
+class FakeInstrument:
+    def __init__(self, name, unit=""):
+        self.name = name
+        self.unit = unit
+        self.values = []
+
+    def add(self, value, attributes=None):
+        self.values.append((value, attributes))
+
+    record = add
+
+
+class FakeMeter:
+    def __init__(self):
+        self.instruments = {}
+
+    def create_counter(self, name):
+        return self.instruments.setdefault(name, FakeInstrument(name))
+
+    def create_histogram(self, name, unit=""):
+        return self.instruments.setdefault(name, FakeInstrument(name, unit))
+
+
+def test_opentelemetry():
+    tracer, meter = FakeTracer(), FakeMeter()
+    otel = metrics.OpenTelemetryInstrumentation(tracer=tracer, meter=meter)
+    with otel.span("itunes.query_api", endpoint="/lookup") as span:
+        span.set_attribute("path", ["not", "a", "primitive"])
+    with pytest.raises(KeyError):
+        with otel.span("itunes.query_api"):
+            raise KeyError()
+    with otel.span("itunes.query_api") as span:
+        span.set_error("DownloadError")
+    otel.count("gdrive.deduplicated")
+    otel.count("gdrive.deduplicated", 2)
+
+    assert tracer.spans[0].attributes == {
+        "endpoint": "/lookup",
+        "path": "['not', 'a', 'primitive']",
+    }
+    assert tracer.spans[1].exited_with is KeyError
+    assert tracer.spans[2].attributes == {"error.type": "DownloadError"}
+    histogram = meter.instruments["itunes.query_api"]
+    assert histogram.unit == "s"
+    assert [attributes for _, attributes in histogram.values] == [
+        {"status": "ok"},
+        {"status": "error"},
+        {"status": "error"},
+    ]
+    assert meter.instruments["gdrive.deduplicated"].values == [(1, {}), (2, {})]
+
+
+def test_query_api_instrumented(instrumentation, stub_itunes_api):
+    response_cache = cache.ResponseCache()
+    for _ in range(2):
+        itunes.query_api(
+            "1062400323",
+            limit=11,
+            mode=modes.Modes.SONG,
+            lookup=True,
+            base_url=stub_itunes_api.url,
+            response_cache=response_cache,
+        )
+    first, second = instrumentation.spans
+    assert first.attributes == {"endpoint": "/lookup", "status_code": 200}
+    assert second.attributes == {"endpoint": "/lookup", "cached": True}
+    assert instrumentation.counter("itunes.cache", result="hit") == 1
+    assert instrumentation.counter("itunes.cache", result="miss") == 1
+
+
+def test_iter_query_api_instrumented(instrumentation, stub_paged_search):
+    with metrics.span("outer") as outer:
+        results = itunes.iter_query_api(
+            "jolene", modes.Modes.SONG, page_size=10, base_url=stub_paged_search.url
+        )
+        assert len(list(results)) == 22
+    pages = instrumentation.spans[:-1]
+    assert [page.attributes["offset"] for page in pages] == [0, 10, 20]
+    # prefetched pages are requested in the context of the caller
+    assert all(page.parent is outer for page in pages)
+
+
+def test_async_query_instrumented(instrumentation, stub_itunes_api):
+    async def query():
+        async with itunes.AsyncItunesClient(base_url=stub_itunes_api.url) as client:
+            return await client.query_many(["1", "2"], 11, modes.Modes.SONG, True)
+
+    asyncio.run(query())
+    assert instrumentation.span_names() == ["itunes.query_api"] * 2
+
+
+def test_taggers_instrumented(instrumentation, tmp_path):
+    path = write_track(str(tmp_path / "song.mp3"))
+    assert itunes.mp3ID3TaggerNoArtwork(path, song_tags())
+    assert instrumentation.span_names() == ["itunes.write_mp3_tags"]
+
+
+def test_upload_instrumented(instrumentation, uploader, stub_drive, tmp_path):
+    path = str(tmp_path / "song.mp3")
+    with open(path, "wb") as f:
+        f.write(os.urandom(1000))
+    uploader.upload(FOLDER_ID, "song.mp3", path)
+    assert instrumentation.span_names() == ["gdrive.upload"]
+    assert instrumentation.counter("gdrive.uploaded_bytes") == 1000
+
+
+class ErrorCodePool:
+    """pool whose downloader reports a failed download"""
+
+    @contextlib.contextmanager
+    def acquire(self, *args, **kwargs):
+        yield mock.Mock(download=mock.Mock(return_value=1))
+
+
+def test_failed_download_instrumented(instrumentation, tmp_path):
+    path = str(tmp_path / "song")
+    assert youtube.run_download("url", path, "mp3", pool=ErrorCodePool()) is None
+    (span,) = instrumentation.spans
+    assert (span.name, span.status, span.error) == (
+        "youtube.download",
+        "error",
+        "DownloadError",
+    )
+    assert len(instrumentation.timings("youtube.download", status="error")) == 1
+
+
+def test_postprocessor_timing(instrumentation):
+    pooled = youtube._PooledYoutubeDL(youtube._ydl_options("", "mp3", False, []))
+    assert pooled.ydl.params["postprocessor_hooks"] == [pooled._time_postprocessor]
+    for status in ["started", "finished", "finished"]:
+        pooled._time_postprocessor(
+            {"status": status, "postprocessor": "ExtractAudio", "info_dict": {}}
+        )
+    assert (
+        len(
+            instrumentation.timings(
+                "youtube.postprocessor", postprocessor="ExtractAudio"
+            )
+        )
+        == 1
+    )
+    pooled.ydl.close()
+
+
+def test_search_form_instrumented(instrumentation, stub_http_server, render_pool):
+    stub_http_server.routes["/"] = (200, {}, b'<html><input name="q"></html>')
+    stub_http_server.routes["/results"] = (200, {}, b"<html></html>")
+    session = web.SimpleSession(
+        "stub", root_url=stub_http_server.url, render_pool=render_pool
+    )
+    session.enter_search_form(
+        search_url=f"{stub_http_server.url}/results",
+        payload={"q": "jolene"},
+        render_sleep=0,
+    )
+    render, search = instrumentation.spans
+    assert (render.name, search.name) == ("web.render", "web.enter_search_form")
+    assert render.parent is search
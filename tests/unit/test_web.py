@@ -1,6 +1,9 @@
 import pytest
+from concurrent.futures import ThreadPoolExecutor
 from songbirdcore import web
 
+from test_common import stub_http_server
+
 
 @pytest.fixture()
 def get_youtube_session():
@@ -15,3 +18,206 @@ def test_enter_search_form(get_youtube_session: str):
         payload={"search_query": "billy joel"},
     )
     assert response is not None and response.status_code == 200
+
+
+class FakePage:
+    def __init__(self, browser):
+        self.browser = browser
+        self.url = None
+        self.closed = False
+
+    async def goto(self, url, timeout):
+        if "timeout" in url:
+            raise TimeoutError(f"timed out after {timeout}ms")
+        self.url = url
+        self.browser.gotos.append((id(self), url, timeout))
+
+    async def content(self):
+        return f'<html><body><a id="video-title" title="rendered" href="{self.url}">x</a></body></html>'
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.pages = []
+        self.gotos = []
+        self.closed = False
+
+    async def new_page(self):
+        page = FakePage(self)
+        self.pages.append(page)
+        return page
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture()
+def fake_browsers():
+    browsers = []
+    yield browsers
+    assert all(browser.closed for browser in browsers)
+
+
+@pytest.fixture()
+def render_pool(fake_browsers):
+    async def launch():
+        browser = FakeBrowser()
+        fake_browsers.append(browser)
+        return browser
+
+    pool = web.RenderPool(max_pages=2, max_uses_per_page=3, browser_factory=launch)
+    yield pool
+    pool.close()
+
+
+def test_render_pool_shared_across_sessions(
+    stub_http_server, render_pool, fake_browsers
+):
+    stub_http_server.routes["/"] = (200, {}, b'<html><input name="q"></html>')
+    stub_http_server.routes["/results"] = (200, {}, b"<html>not rendered</html>")
+    for query in ["one", "two", "three", "four"]:
+        session = web.SimpleSession(
+            "stub", root_url=stub_http_server.url, render_pool=render_pool
+        )
+        response = session.enter_search_form(
+            search_url=f"{stub_http_server.url}/results",
+            payload={"q": query},
+            render_timeout=5,
+            render_wait=0,
+            render_sleep=0,
+        )
+        session.close()
+        (link,) = response.html.find("#video-title")
+        assert link.attrs["href"] == f"{stub_http_server.url}/results?q={query}"
+
+    (browser,) = fake_browsers
+    assert [url for _, url, _ in browser.gotos][-1].endswith("q=four")
+    assert all(timeout == 5000 for _, _, timeout in browser.gotos)
+    # the first page is replaced after 3 renders
+    assert len(browser.pages) == 2 and browser.pages[0].closed
+
+    metrics = render_pool.metrics()
+    assert metrics["renders"] == 4 and metrics["failures"] == 0
+    assert metrics["browser_starts"] == 1
+    assert metrics["pages_created"] == 2 and metrics["pages_recycled"] == 1
+    assert 0 <= metrics["p50_seconds"] <= metrics["max_seconds"]
+
+
+def test_render_pool_concurrent_renders(render_pool, fake_browsers):
+    urls = [f"http://stub/{i}" for i in range(12)]
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        contents = list(executor.map(lambda url: render_pool.render(url, wait=0), urls))
+
+    assert [content.count(url + '"') for content, url in zip(contents, urls)] == [
+        1
+    ] * 12
+    (browser,) = fake_browsers
+    assert render_pool.metrics()["browser_starts"] == 1
+    # never more pages open at once than the pool allows
+    assert len([page for page in browser.pages if not page.closed]) <= 2
+
+
+def test_render_pool_failure(stub_http_server, render_pool, fake_browsers):
+    with pytest.raises(TimeoutError):
+        render_pool.render("http://stub/timeout", wait=0)
+    assert render_pool.render("http://stub/ok", wait=0)
+
+    (browser,) = fake_browsers
+    assert browser.pages[0].closed and not browser.pages[1].closed
+    assert render_pool.metrics()["failures"] == 1
+
+    stub_http_server.routes["/"] = (200, {}, b'<html><input name="q"></html>')
+    stub_http_server.routes["/timeout"] = (200, {}, b"<html></html>")
+    session = web.SimpleSession(
+        "stub", root_url=stub_http_server.url, render_pool=render_pool
+    )
+    assert (
+        session.enter_search_form(
+            search_url=f"{stub_http_server.url}/timeout",
+            payload={"q": "x"},
+            render_wait=0,
+        )
+        is None
+    )
+
+
+def test_render_pool_closed(render_pool):
+    render_pool.close()
+    with pytest.raises(RuntimeError):
+        render_pool.render("http://stub/")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture()
+def stub_form_site(stub_http_server):
+    stub_http_server.routes["/"] = (
+        200,
+        {},
+        b'<html><form><input name="q"><input name="lang"></form></html>',
+    )
+    stub_http_server.routes["/results"] = (200, {}, b"<html>results</html>")
+    yield stub_http_server
+
+
+def _search(server, render_pool, form_cache, query, path="/results"):
+    session = web.SimpleSession(
+        "stub", root_url=server.url, render_pool=render_pool, form_cache=form_cache
+    )
+    response = session.enter_search_form(
+        search_url=f"{server.url}{path}",
+        payload={"q": query},
+        render_wait=0,
+        render_sleep=0,
+    )
+    session.close()
+    return response
+
+
+def _paths(server):
+    return [request.path for request in server.requests]
+
+
+def test_form_schema_cached_across_sessions(stub_form_site, render_pool):
+    form_cache = web.FormSchemaCache()
+    for query in ["one", "two", "three"]:
+        assert _search(stub_form_site, render_pool, form_cache, query) is not None
+
+    assert _paths(stub_form_site) == ["/", "/results", "/results", "/results"]
+    assert [request.query for request in stub_form_site.requests[1:]] == [
+        {"q": [query]} for query in ["one", "two", "three"]
+    ]
+    assert form_cache.get(stub_form_site.url + "/") is None
+    assert form_cache.get(stub_form_site.url) == ("q", "lang")
+
+
+def test_form_schema_ttl_and_invalidation(stub_form_site, render_pool):
+    clock = FakeClock()
+    form_cache = web.FormSchemaCache(ttl=60, clock=clock)
+    _search(stub_form_site, render_pool, form_cache, "one")
+    clock.now += 59
+    _search(stub_form_site, render_pool, form_cache, "two")
+    clock.now += 1
+    _search(stub_form_site, render_pool, form_cache, "three")
+    form_cache.invalidate(stub_form_site.url)
+    _search(stub_form_site, render_pool, form_cache, "four")
+
+    assert _paths(stub_form_site).count("/") == 3
+    assert (form_cache.hits, form_cache.misses) == (1, 3)
+
+
+def test_form_schema_invalidated_on_failed_search(stub_form_site, render_pool):
+    form_cache = web.FormSchemaCache()
+    _search(stub_form_site, render_pool, form_cache, "one", path="/gone")
+    assert len(form_cache) == 0
+    _search(stub_form_site, render_pool, form_cache, "two")
+    assert _paths(stub_form_site) == ["/", "/gone", "/", "/results"]
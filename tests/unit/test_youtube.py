@@ -1,7 +1,39 @@
 import pytest
+import requests_html
 from songbirdcore import youtube
+import asyncio
+import json
+import threading
+import time
+from songbirdcore.models.youtube import DownloadJob, DownloadStatus, SearchMode
 import uuid
-import os
+import os, sys
+
+from test_common import FIXTURES_FOLDER, stub_http_server
+
+MEDIA_CONTENT = os.urandom(64 * 1024)
+SEARCH_PAGE_VIDEOS = [
+    ("Dolly Parton - Jolene (Audio)", "/watch?v=Ixrje2rXLMA"),
+    ("Jolene }; </script> (Live) & more", "/watch?v=wOwblaKmyVw"),
+    ("Jolene – Miley Cyrus cover", "/watch?v=e7D1F4ZHSO0"),
+    ("Dolly Parton “Jolene” 1974", "/watch?v=u0uxI4pvOWQ"),
+]
+
+
+@pytest.fixture
+def search_page_html() -> str:
+    """a synthetic youtube search results page for 'jolene dolly parton'.
+
+    Hand-written, not captured from youtube: it follows the ytInitialData
+    layout of a real results page, with an ad slot, a channel, a shelf, a
+    shorts shelf and a continuation around four videos, but a real page is
+    several hundred KB of the same structure.
+    """
+    with open(
+        os.path.join(FIXTURES_FOLDER, "youtube-search-jolene.html"),
+        encoding="utf-8",
+    ) as f:
+        return f.read()
 
 
 @pytest.mark.skipif(
@@ -43,3 +75,451 @@ def test_get_video_links():
     )
 
     assert len(link_list) > 0 and len(links) > 0
+
+
+def test_parse_initial_data(search_page_html: str):
+    initial_data = youtube.parse_initial_data(search_page_html)
+    assert initial_data["estimatedResults"] == "1234567"
+
+    results = youtube.video_results_from_initial_data(initial_data)
+    assert [(r.title, r.href) for r in results] == SEARCH_PAGE_VIDEOS
+    assert [(r.duration, r.channel) for r in results] == [
+        ("2:42", "Dolly Parton"),
+        ("3:05", "Dolly Parton"),
+        ("3:48", "Miley Cyrus"),
+        ("2:44", "Dolly Parton Archive"),
+    ]
+    # compatible with the attrs of rendered elements
+    assert results[0].attrs == {
+        "title": "Dolly Parton - Jolene (Audio)",
+        "href": "/watch?v=Ixrje2rXLMA",
+    }
+
+
+def _video_renderer(title, href, duration, channel):
+    return (
+        "<ytd-video-renderer><div id='dismissible'>"
+        "<ytd-thumbnail><ytd-thumbnail-overlay-time-status-renderer>"
+        f"<span id='text'>\n  {duration}\n</span>"
+        "</ytd-thumbnail-overlay-time-status-renderer></ytd-thumbnail>"
+        f"<a id='video-title' title='{title}' href='{href}'>{title}</a>"
+        f"<ytd-channel-name><a href='/@c'>{channel}</a></ytd-channel-name>"
+        "</div></ytd-video-renderer>"
+    )
+
+
+def test_video_results_from_rendered_html():
+    html = requests_html.HTML(
+        html="<html><body>"
+        + _video_renderer("first", "/watch?v=1", "2:42", "Dolly Parton")
+        # two consecutive incomplete links used to misalign link_list and links
+        + "<a id='video-title' title='no href'>x</a>"
+        + "<a id='video-title' href='/watch?v=no-title'>x</a>"
+        + _video_renderer("second", "/watch?v=2", "1:02:03", "Someone")
+        + "<ytd-radio-renderer><a id='video-title' title='mix' href='/watch?v=3&list=RD'>mix</a></ytd-radio-renderer>"
+        + "</body></html>"
+    )
+    results = youtube.video_results_from_rendered_html(html)
+    assert [(r.title, r.href, r.duration, r.channel) for r in results] == [
+        ("first", "/watch?v=1", "2:42", "Dolly Parton"),
+        ("second", "/watch?v=2", "1:02:03", "Someone"),
+        ("mix", "/watch?v=3&list=RD", None, None),
+    ]
+    link_list, links = youtube._link_list("https://www.youtube.com", results)
+    assert link_list == [
+        f"{r.title} - https://www.youtube.com{r.href}" for r in results
+    ]
+    assert links == results
+
+
+def test_parse_initial_data_missing():
+    assert youtube.parse_initial_data("<html><body></body></html>") is None
+    assert youtube.parse_initial_data("<script>var ytInitialData = {broken") is None
+
+
+def test_get_video_links_initial_data(stub_http_server, search_page_html: str):
+    stub_http_server.routes["/results"] = (
+        200,
+        {"Content-Type": "text/html; charset=utf-8"},
+        search_page_html.encode(),
+    )
+    link_list, links = youtube.get_video_links(
+        youtube_home_url=stub_http_server.url,
+        youtube_search_url=f"{stub_http_server.url}/results",
+        youtube_query_payload={"search_query": "jolene dolly parton"},
+        render_timeout=20,
+        render_wait=0.2,
+        search_mode=SearchMode.INITIAL_DATA,
+    )
+
+    assert link_list == [
+        f"{title} - {stub_http_server.url}{href}" for title, href in SEARCH_PAGE_VIDEOS
+    ]
+    assert [link.attrs["href"] for link in links] == [
+        href for _, href in SEARCH_PAGE_VIDEOS
+    ]
+    (request,) = stub_http_server.requests
+    assert request.query == {"search_query": ["jolene dolly parton"]}
+
+
+def test_get_video_links_initial_data_retries(stub_http_server):
+    stub_http_server.routes["/results"] = (200, {}, b"<html>consent wall</html>")
+    assert youtube.get_video_links(
+        youtube_home_url=stub_http_server.url,
+        youtube_search_url=f"{stub_http_server.url}/results",
+        youtube_query_payload={"search_query": "jolene"},
+        render_timeout=20,
+        render_wait=0.2,
+        retry_count=2,
+        search_mode=SearchMode.INITIAL_DATA,
+    ) == (None, None)
+    assert len(stub_http_server.requests) == 2
+
+
+def test_get_video_links_ytsearch(monkeypatch):
+    queries = []
+
+    def extract_info(self, url, download=True):
+        queries.append(url)
+        return {
+            "entries": [
+                {
+                    "id": "Ixrje2rXLMA",
+                    "title": "Dolly Parton - Jolene (Audio)",
+                    "duration": 162.0,
+                    "channel": "Dolly Parton",
+                },
+                {"id": "private0001", "title": None},
+                {"id": "wOwblaKmyVw", "title": "Jolene (Live)"},
+            ]
+        }
+
+    monkeypatch.setattr(youtube.youtube_dl.YoutubeDL, "extract_info", extract_info)
+    link_list, links = youtube.get_video_links(
+        youtube_home_url="https://www.youtube.com",
+        youtube_search_url="https://www.youtube.com/results",
+        youtube_query_payload={"search_query": "jolene dolly parton"},
+        render_timeout=20,
+        render_wait=0.2,
+        search_mode=SearchMode.YTSEARCH,
+        max_results=3,
+    )
+
+    assert queries == ["ytsearch3:jolene dolly parton"]
+    assert link_list == [
+        "Dolly Parton - Jolene (Audio) - https://www.youtube.com/watch?v=Ixrje2rXLMA",
+        "Jolene (Live) - https://www.youtube.com/watch?v=wOwblaKmyVw",
+    ]
+    assert [(link.duration, link.channel) for link in links] == [
+        ("2:42", "Dolly Parton"),
+        (None, None),
+    ]
+
+
+def _search_page(query: str) -> bytes:
+    initial_data = {
+        "contents": [
+            {
+                "videoRenderer": {
+                    "videoId": f"id-{query}",
+                    "title": {"runs": [{"text": query}]},
+                }
+            }
+        ]
+    }
+    return f"<script>var ytInitialData = {json.dumps(initial_data)};</script>".encode()
+
+
+@pytest.fixture
+def stub_search_server(stub_http_server):
+    """answers searches after a short delay, failing the first tries of queries
+    named 'flaky-<n>' n times, and every try of queries named 'broken'"""
+    state = {"in_flight": 0, "max_in_flight": 0, "tries": {}}
+    lock = threading.Lock()
+
+    def results(request):
+        query = request.query["search_query"][0]
+        with lock:
+            state["in_flight"] += 1
+            state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+            state["tries"].setdefault(query, []).append(time.monotonic())
+            tries = len(state["tries"][query])
+        time.sleep(0.05)
+        with lock:
+            state["in_flight"] -= 1
+        failures = int(query.split("-")[1]) if query.startswith("flaky-") else 0
+        if query == "broken" or tries <= failures:
+            return 503, {}, b""
+        return 200, {"Content-Type": "text/html"}, _search_page(query)
+
+    stub_http_server.routes["/results"] = results
+    stub_http_server.state = state
+    yield stub_http_server
+
+
+def _search_many(server, queries, **kwargs):
+    return asyncio.run(
+        youtube.get_video_links_many(
+            youtube_home_url=server.url,
+            youtube_search_url=f"{server.url}/results",
+            youtube_query_payloads=[{"search_query": query} for query in queries],
+            render_timeout=20,
+            render_wait=0,
+            search_mode=SearchMode.INITIAL_DATA,
+            **kwargs,
+        )
+    )
+
+
+def test_get_video_links_many(stub_search_server):
+    queries = [f"track {i}" for i in range(8)]
+    results = _search_many(stub_search_server, queries, concurrency=3)
+
+    assert [link_list for link_list, _ in results] == [
+        [f"{query} - {stub_search_server.url}/watch?v=id-{query}"] for query in queries
+    ]
+    assert all(len(links) == 1 for _, links in results)
+    assert stub_search_server.state["max_in_flight"] == 3
+
+
+def test_get_video_links_many_errors(stub_search_server, monkeypatch):
+    """a search raising fails alone, the session is closed once every search returned"""
+    search = youtube._search
+    closed = []
+
+    def failing_search(session, url, payload, *args):
+        if payload["search_query"] == "raises":
+            raise RuntimeError("boom")
+        time.sleep(0.1)
+        assert not closed
+        return search(session, url, payload, *args)
+
+    monkeypatch.setattr(youtube, "_search", failing_search)
+    close = youtube.web.SimpleSession.close
+    monkeypatch.setattr(
+        youtube.web.SimpleSession,
+        "close",
+        lambda self: closed.append(True) or close(self),
+    )
+    results = _search_many(stub_search_server, ["raises", "ok"], retry_count=2)
+
+    assert results[0] == (None, None)
+    assert results[1][0] == [f"ok - {stub_search_server.url}/watch?v=id-ok"]
+    assert closed == [True]
+    assert "raises" not in stub_search_server.state["tries"]
+
+
+def test_get_video_links_many_backoff(stub_search_server):
+    results = _search_many(
+        stub_search_server,
+        ["flaky-2", "ok", "broken"],
+        retry_count=3,
+        backoff=0.1,
+    )
+
+    assert results[0][0] == [f"flaky-2 - {stub_search_server.url}/watch?v=id-flaky-2"]
+    assert results[1][0] == [f"ok - {stub_search_server.url}/watch?v=id-ok"]
+    assert results[2] == (None, None)
+
+    tries = stub_search_server.state["tries"]
+    assert len(tries["ok"]) == 1
+    assert len(tries["flaky-2"]) == len(tries["broken"]) == 3
+    gaps = [
+        after - before for before, after in zip(tries["broken"], tries["broken"][1:])
+    ]
+    # at least half the backoff, plus the 0.05s response time
+    assert gaps[0] >= 0.05 + 0.05 and gaps[1] >= 0.05 + 0.1
+
+
+@pytest.fixture
+def stub_media_server(stub_http_server):
+    """serves direct media links, which yt-dlp fetches with its generic extractor"""
+    for name in ["one", "two", "three"]:
+        stub_http_server.routes[f"/{name}.mp3"] = (
+            200,
+            {"Content-Type": "audio/mpeg"},
+            MEDIA_CONTENT,
+        )
+    yield stub_http_server
+
+
+@pytest.fixture
+def no_conversion(monkeypatch):
+    """skip the FFmpeg conversion, which needs ffmpeg installed"""
+    monkeypatch.setattr(youtube, "_postprocessors", lambda *args: [])
+
+
+def _jobs(server, tmp_path, names):
+    return [
+        DownloadJob(
+            url=f"{server.url}/{name}.mp3",
+            file_path_no_format=str(tmp_path / name),
+            file_format="mp3",
+        )
+        for name in names
+    ]
+
+
+def test_download_manager_run(stub_media_server, no_conversion, tmp_path):
+    updates = []
+    with youtube.DownloadManager(
+        max_downloads=2, progress_callback=updates.append
+    ) as manager:
+        results = manager.run(
+            _jobs(stub_media_server, tmp_path, ["one", "two", "three"])
+        )
+
+    assert [result.file_path for result in results] == [
+        str(tmp_path / f"{name}.mp3") for name in ["one", "two", "three"]
+    ]
+    for result in results:
+        assert result.success and result.error is None
+        with open(result.file_path, "rb") as f:
+            assert f.read() == MEDIA_CONTENT
+
+    progress = manager.progress()
+    assert sorted(progress) == [0, 1, 2]
+    for job_id, job_progress in progress.items():
+        assert job_progress.status == DownloadStatus.FINISHED
+        assert job_progress.fraction == 1.0
+        statuses = [u.status for u in updates if u.job_id == job_id]
+        assert statuses[0] == DownloadStatus.QUEUED
+        assert DownloadStatus.POSTPROCESSING in statuses
+        assert statuses[-1] == DownloadStatus.FINISHED
+    downloading = [u for u in updates if u.downloaded_bytes == len(MEDIA_CONTENT)]
+    assert downloading and all(u.total_bytes == len(MEDIA_CONTENT) for u in downloading)
+
+
+def test_download_manager_reports_failures_per_job(
+    stub_media_server, no_conversion, tmp_path
+):
+    with youtube.DownloadManager() as manager:
+        results = manager.run(_jobs(stub_media_server, tmp_path, ["one", "missing"]))
+
+    assert results[0].success
+    assert not results[1].success
+    assert results[1].file_path is None and results[1].error
+    assert manager.progress()[1].status == DownloadStatus.ERROR
+
+
+def test_download_manager_survives_failing_callback(
+    stub_media_server, no_conversion, tmp_path
+):
+    def callback(progress):
+        raise RuntimeError("broken ui")
+
+    with youtube.DownloadManager(progress_callback=callback) as manager:
+        future = manager.submit(_jobs(stub_media_server, tmp_path, ["one"])[0])
+        assert future.result(timeout=30).success
+
+
+def test_download_manager_conversion_failure(stub_media_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        youtube,
+        "_postprocessors",
+        lambda *args: [{"key": "FFmpegExtractAudio", "preferredcodec": "m4a"}],
+    )
+    # no ffmpeg binary, so the conversion fails after a successful fetch
+    monkeypatch.setenv("PATH", str(tmp_path))
+    with youtube.DownloadManager() as manager:
+        (result,) = manager.run(_jobs(stub_media_server, tmp_path, ["one"]))
+
+    assert not result.success and result.error
+    assert os.path.exists(tmp_path / "one.mp3")
+
+
+def test_youtube_dl_pool_reuses_instances(stub_media_server, tmp_path):
+    with youtube.YoutubeDLPool() as pool:
+        for name in ["one", "two", "three"]:
+            seen = []
+            with pool.acquire(
+                str(tmp_path / name),
+                "mp3",
+                postprocess=False,
+                progress_hook=seen.append,
+            ) as ydl:
+                assert ydl.download(f"{stub_media_server.url}/{name}.mp3") == 0
+            assert seen and seen[-1]["status"] == "finished"
+            assert os.path.exists(tmp_path / f"{name}.mp3")
+        assert pool.created == 1
+
+        # an option set of its own gets its own instance
+        with pool.acquire(str(tmp_path / "four"), "m4a", postprocess=False):
+            pass
+        assert pool.created == 2
+
+
+def test_youtube_dl_pool_resets_error_code(stub_media_server, tmp_path):
+    with youtube.YoutubeDLPool() as pool:
+        with pool.acquire(str(tmp_path / "x"), "mp3", postprocess=False) as ydl:
+            ydl.params["ignoreerrors"] = True
+            assert ydl.download(f"{stub_media_server.url}/missing.mp3") != 0
+            ydl.params["ignoreerrors"] = False
+        with pool.acquire(str(tmp_path / "one"), "mp3", postprocess=False) as ydl:
+            assert ydl.download(f"{stub_media_server.url}/one.mp3") == 0
+        assert pool.created == 1
+
+
+def test_youtube_dl_pool_concurrent_checkout(tmp_path):
+    with youtube.YoutubeDLPool(max_idle_per_key=1) as pool:
+        with pool.acquire(str(tmp_path / "a"), "mp3") as first:
+            with pool.acquire(str(tmp_path / "b"), "mp3") as second:
+                assert first is not second
+                assert first.params["outtmpl"]["default"] == str(tmp_path / "a.%(ext)s")
+                assert second.params["outtmpl"]["default"] == str(
+                    tmp_path / "b.%(ext)s"
+                )
+        assert pool.created == 2
+        # only one idle instance is kept
+        with pool.acquire(str(tmp_path / "c"), "mp3"):
+            with pool.acquire(str(tmp_path / "d"), "mp3"):
+                pass
+        assert pool.created == 3
+
+
+def test_youtube_dl_pool_discards_on_error(tmp_path):
+    with youtube.YoutubeDLPool() as pool:
+        with pytest.raises(ValueError):
+            with pool.acquire(str(tmp_path / "a"), "mp3"):
+                raise ValueError()
+        with pool.acquire(str(tmp_path / "a"), "mp3"):
+            pass
+        assert pool.created == 2
+
+
+def test_youtube_dl_internals(tmp_path):
+    """the pool reuses YoutubeDL instances by changing attributes that are not
+    public, this fails if a yt-dlp release changes them"""
+    pooled = youtube._PooledYoutubeDL(youtube._ydl_options("", "mp3", False, []))
+    assert set(pooled.ydl.params["outtmpl"]) >= {"default"}
+    pooled.prepare(str(tmp_path / "song"), None)
+    info = {"id": "id", "title": "title", "ext": "webm"}
+    assert pooled.ydl.prepare_filename(info) == str(tmp_path / "song.webm")
+
+    # download returns the return code accumulated by the instance
+    pooled.ydl._download_retcode = 1
+    assert pooled.ydl.download([]) == 1
+    pooled.prepare(str(tmp_path / "song"), None)
+    assert pooled.ydl.download([]) == 0
+    pooled.ydl.close()
+
+
+def test_youtube_dl_pool_closed(tmp_path):
+    pool = youtube.YoutubeDLPool()
+    pool.close()
+    with pytest.raises(RuntimeError):
+        with pool.acquire(str(tmp_path / "a"), "mp3"):
+            pass
+
+
+def test_download_manager_shares_pool(stub_media_server, no_conversion, tmp_path):
+    with youtube.YoutubeDLPool() as pool:
+        with youtube.DownloadManager(
+            max_downloads=1, max_postprocessors=1, pool=pool
+        ) as manager:
+            results = manager.run(
+                _jobs(stub_media_server, tmp_path, ["one", "two", "three"])
+            )
+        assert all(result.success for result in results)
+        # one fetch instance and one conversion instance, reused for every job
+        assert pool.created == 2